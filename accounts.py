@@ -0,0 +1,108 @@
+"""
+    @Description: 账号文件流式读写, 适用于大量账号
+"""
+
+from typing import Iterator, NoReturn
+import json
+import logging
+
+from records import SignInResult
+from utils import AtomicFile
+
+
+def read_accounts(path: str) -> Iterator[dict]:
+    """
+    逐行读取账号文件, 每行为一个 refresh token, 或包含 refresh_token 字段及其他账号信息的 JSON 对象.
+    空行和 # 开头的行会被忽略
+
+    :param path: 账号文件路径
+    :return: 账号字典迭代器, 至少包含 refresh_token
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+
+            if not line.startswith('{'):
+                yield {'refresh_token': line}
+                continue
+
+            try:
+                account = json.loads(line)
+            except ValueError as e:
+                logging.error(f'账号文件 {path} 第 {line_no} 行格式错误, 已跳过: {e}')
+                continue
+
+            if not account.get('refresh_token'):
+                logging.error(f'账号文件 {path} 第 {line_no} 行缺少 refresh_token, 已跳过')
+                continue
+
+            yield account
+
+
+class AccountWriter:
+    """
+    逐个写入轮换后的账号, 先写入临时文件, 完成后替换原文件
+    """
+
+    def __init__(self, path: str):
+        """
+        初始化
+
+        :param path: 账号文件路径
+        """
+        self.path = path
+        self.file = AtomicFile(path)
+
+    def write(self, account: dict) -> NoReturn:
+        """
+        写入一个账号, 仅有 refresh_token 时按纯文本写入, 否则按 JSON 写入
+
+        :param account: 账号字典
+        :return:
+        """
+        if len(account) == 1:
+            self.file.write(account['refresh_token'] + '\n')
+        else:
+            self.file.write(json.dumps(account, ensure_ascii=False) + '\n')
+
+    def commit(self) -> NoReturn:
+        """
+        完成写入并替换原文件
+
+        :return:
+        """
+        self.file.commit()
+
+    def abort(self) -> NoReturn:
+        """
+        放弃写入, 保留原文件
+
+        :return:
+        """
+        self.file.abort()
+
+
+class ResultWriter:
+    """
+    逐个追加签到结果到 JSONL 文件
+    """
+
+    FIELDS = ['user', 'success', 'count', 'reward', 'retryable', 'text']
+
+    def __init__(self, path: str):
+        """
+        初始化
+
+        :param path: 结果文件路径
+        """
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, result: SignInResult) -> NoReturn:
+        self.file.write(json.dumps({k: getattr(result, k) for k in self.FIELDS}, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self) -> NoReturn:
+        self.file.close()
@@ -5,17 +5,58 @@
     @Description:
 """
 
+import argparse
+import functools
+import itertools
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from os import environ
 from sys import argv
-from typing import NoReturn, Optional
-import json
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, NoReturn, Optional
+import os
+import sys
+import time
 
 from configobj import ConfigObj
 import requests
-import github
+import logger
+import message
+import metrics
+import pushers
+from accounts import AccountWriter, ResultWriter, read_accounts
+from records import DEAD_TOKEN_CODES, SignInResult
+from scheduler import (
+    AdaptiveLimiter, CircuitBreakers, CircuitOpenError, RateLimiter, RetryPolicy, TransientError,
+)
+from shard import Shard, account_key, digest, parse_shard, read_digests, select, unseen, write_digests
+from session import get_session, init_session, close_session
+from utils import parse_bool
 
-from modules import dingtalk, serverchan, pushdeer, telegram, pushplus, smtp
+# 状态存储, 发件箱和 token 缓存在使用时再导入, 避免仅导入 app 时加载 sqlite3 等模块
+if TYPE_CHECKING:
+    from cache import TokenCache
+    from outbox import Outbox
+    from state import StateStore
+
+AUTH_HOST = 'auth.aliyundrive.com'
+MEMBER_HOST = 'member.aliyundrive.com'
+
+# 响应中表示被限流的错误码, 按临时错误重试
+THROTTLE_CODES = ['TooManyRequests', 'Throttling', 'Throttling.User', 'Throttling.Api']
+
+# 签到请求的默认超时时间, 单位秒
+REQUEST_TIMEOUT = 10
+
+
+class Attempt(NamedTuple):
+    """
+    单次请求结果. 成功时 result 为 (状态码, 响应 JSON), 临时错误时为 None
+    """
+    result: Optional[tuple[int, dict]]
+    error: Optional[str] = None
+    retry_after: Optional[float] = None
+    throttled: bool = False
 
 
 class SignIn:
@@ -27,15 +68,37 @@ class SignIn:
             self,
             config: ConfigObj | dict,
             refresh_token: str,
+            session: Optional[requests.Session] = None,
+            token_cache: Optional['TokenCache'] = None,
+            rate_limiter: Optional[RateLimiter] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            circuit_breakers: Optional[CircuitBreakers] = None,
+            timeout: float = REQUEST_TIMEOUT,
+            concurrency: Optional[AdaptiveLimiter] = None,
     ):
         """
         初始化
 
         :param config: 配置文件, ConfigObj 对象或字典
         :param refresh_token: refresh_token
+        :param session: HTTP 会话, 默认使用共享会话
+        :param token_cache: access token 缓存, 为 None 时不使用缓存
+        :param rate_limiter: 按 host 限速器, 为 None 时不限速
+        :param retry_policy: 临时错误重试策略, 为 None 时不重试
+        :param circuit_breakers: 按 host 熔断器, 为 None 时不熔断
+        :param timeout: 请求超时时间, 单位秒
+        :param concurrency: 自适应并发限制, 为 None 时不限制同时发出的请求数
         """
         self.config = config
         self.refresh_token = refresh_token
+        self.session = session or get_session()
+        self.token_cache = token_cache
+        self.token_from_cache = False
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breakers = circuit_breakers
+        self.timeout = timeout
+        self.concurrency = concurrency
         self.hide_refresh_token = self.__hide_refresh_token()
         self.access_token = None
         self.new_refresh_token = None
@@ -43,6 +106,7 @@ class SignIn:
         self.signin_count = 0
         self.signin_reward = None
         self.error = None
+        self.retryable = False
 
     def __hide_refresh_token(self) -> str:
         """
@@ -55,33 +119,153 @@ class SignIn:
         except IndexError:
             return self.refresh_token
 
+    def __post(self, url: str, **kwargs) -> tuple[int, dict]:
+        """
+        发送 POST 请求, 请求前按 host 限速, 临时错误按退避策略重试
+
+        :param url: 请求地址
+        :param kwargs: 传递给 requests 的参数
+        :return: 状态码及响应 JSON
+        :raises TransientError: 重试次数用尽后仍为临时错误
+        """
+        retries = self.retry_policy.retries if self.retry_policy else 0
+        retry_after = None
+        error = None
+        breaker = self.circuit_breakers.get(url) if self.circuit_breakers else None
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(retries + 1):
+            if attempt:
+                self.retry_policy.sleep(attempt, retry_after)
+
+            # 熔断期间不发出请求, 账号在本轮结束后重新排队
+            if breaker and not breaker.allow():
+                raise CircuitOpenError(f'{breaker.name} 熔断中, 请求未发出')
+
+            if self.rate_limiter:
+                self.rate_limiter.acquire(url)
+
+            started = self.concurrency.acquire() if self.concurrency else None
+
+            try:
+                result, error, retry_after, throttled = self.__attempt(url, **kwargs)
+            except BaseException:
+                if breaker:
+                    breaker.record(False)
+                if self.concurrency:
+                    self.concurrency.release(started, False, url=url)
+                raise
+
+            if breaker:
+                breaker.record(result is not None)
+
+            # 限流及超时时减小并发上限, 其他临时错误不调整
+            if self.concurrency:
+                self.concurrency.release(started, result is not None, throttled, url)
+
+            if result:
+                return result
+
+            logging.warning(
+                f'[{self.phone or self.hide_refresh_token}] 请求 {url} 失败 ({error}), '
+                f'已尝试 {attempt + 1}/{retries + 1} 次.'
+            )
+
+        raise TransientError(error)
+
+    def __attempt(self, url: str, **kwargs) -> Attempt:
+        """
+        发送一次 POST 请求
+
+        :param url: 请求地址
+        :param kwargs: 传递给 requests 的参数
+        :return: 请求结果
+        """
+        try:
+            resp = self.session.post(url, **kwargs)
+        except requests.Timeout as e:
+            return Attempt(None, f'请求超时: {e}', throttled=True)
+        except requests.RequestException as e:
+            return Attempt(None, f'请求异常: {e}')
+
+        if resp.status_code == 429 or resp.status_code >= 500:
+            try:
+                retry_after = float(resp.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                retry_after = None
+
+            return Attempt(None, f'HTTP {resp.status_code}', retry_after, resp.status_code == 429)
+
+        try:
+            data = resp.json()
+        except ValueError:
+            return Attempt(None, f'HTTP {resp.status_code}, 响应不是有效的 JSON')
+
+        if not isinstance(data, dict):
+            return Attempt(None, f'HTTP {resp.status_code}, 响应格式异常')
+
+        if data.get('code') in THROTTLE_CODES:
+            return Attempt(None, f'请求被限流: {data["code"]}', throttled=True)
+
+        return Attempt((resp.status_code, data))
+
+    def __load_cached_access_token(self) -> bool:
+        """
+        从缓存读取 access_token
+
+        :return: 命中未过期的缓存返回 True, 否则返回 False
+        """
+        if not self.token_cache:
+            return False
+
+        cached = self.token_cache.find(self.refresh_token)
+
+        if not cached:
+            return False
+
+        self.access_token = cached['access_token']
+        self.phone = cached['user_name']
+        self.token_from_cache = True
+
+        logging.info(f'[{self.phone}] 使用缓存的 access token.')
+        return True
+
     def __get_access_token(self) -> bool:
         """
         获取 access_token
 
         :return: 更新成功返回字典, 失败返回 False
         """
-        data = requests.post(
-            'https://auth.aliyundrive.com/v2/account/token',
+        _, data = self.__post(
+            f'https://{AUTH_HOST}/v2/account/token',
             json={
                 'grant_type': 'refresh_token',
                 'refresh_token': self.refresh_token,
             }
-        ).json()
+        )
 
-        try:
-            if data['code'] in [
-                'RefreshTokenExpired', 'InvalidParameter.RefreshToken',
-            ]:
-                logging.error(f'[{self.hide_refresh_token}] 获取 access token 失败, 可能是 refresh token 无效.')
-                self.error = data
-                return False
-        except KeyError:
-            pass
+        if data.get('code') in DEAD_TOKEN_CODES:
+            logging.error(f'[{self.hide_refresh_token}] 获取 access token 失败, 可能是 refresh token 无效.')
+            self.error = data
+            return False
+
+        if 'access_token' not in data:
+            logging.error(f'[{self.hide_refresh_token}] 获取 access token 失败, 错误信息: {data}')
+            self.error = data
+            return False
 
         self.access_token = data['access_token']
         self.new_refresh_token = data['refresh_token']
         self.phone = data['user_name']
+        self.token_from_cache = False
+
+        if self.token_cache:
+            self.token_cache.put(
+                self.phone,
+                self.access_token,
+                self.new_refresh_token,
+                data.get('expires_in', 7200),
+            )
 
         return True
 
@@ -91,13 +275,22 @@ class SignIn:
 
         :return:
         """
-        data = requests.post(
-            'https://member.aliyundrive.com/v1/activity/sign_in_list',
+        status, data = self.__post(
+            f'https://{MEMBER_HOST}/v1/activity/sign_in_list',
             headers={
                 'Authorization': f'Bearer {self.access_token}',
             },
             json={},
-        ).json()
+        )
+
+        if status == 401 and self.token_from_cache:
+            # 缓存的 access token 已失效, 刷新后重试
+            logging.warning(f'[{self.phone}] 缓存的 access token 已失效, 重新获取.')
+            self.token_cache.invalidate(self.phone)
+
+            if self.__get_access_token():
+                self.__sign_in()
+            return
 
         if 'success' not in data:
             logging.error(f'[{self.phone}] 签到失败, 错误信息: {data}')
@@ -122,205 +315,1478 @@ class SignIn:
         logging.info(f'[{self.phone}] 签到成功, 本月累计签到 {self.signin_count} 天.')
         logging.info(f'[{self.phone}] 本次签到{reward}')
 
-    def __generate_result(self) -> dict:
+    def __generate_result(self) -> SignInResult:
         """
-        获取签到结果
+        获取签到结果, 推送内容在使用时生成
 
         :return: 签到结果
         """
         user = self.phone or self.hide_refresh_token
-        text = (
-            f'[{user}] 签到成功, 本月累计签到 {self.signin_count} 天.\n本次签到{self.signin_reward}'
-            if self.signin_count
-            else f'[{user}] 签到失败\n{json.dumps(self.error, indent=2, ensure_ascii=False)}'
-        )
+        refresh_token = self.new_refresh_token or self.refresh_token
 
-        text_html = (
-            f'<code>{user}</code> 签到成功, 本月累计签到 {self.signin_count} 天.\n本次签到{self.signin_reward}'
-            if self.signin_count
-            else (
-                f'<code>{user}</code> 签到失败\n'
-                f'<code>{json.dumps(self.error, indent=2, ensure_ascii=False)}</code>'
-            )
-        )
+        if not self.signin_count:
+            return SignInResult.from_error(user, refresh_token, self.error or {}, self.retryable)
 
-        return {
-            'success': True if self.signin_count else False,
-            'user': self.phone or self.hide_refresh_token,
-            'refresh_token': self.new_refresh_token or self.refresh_token,
-            'count': self.signin_count,
-            'reward': self.signin_reward,
-            'text': text,
-            'text_html': text_html,
-        }
+        return SignInResult(
+            success=True,
+            user=user,
+            refresh_token=refresh_token,
+            count=self.signin_count,
+            reward=self.signin_reward,
+        )
 
-    def run(self) -> dict:
+    def run(self) -> SignInResult:
         """
         运行签到
 
         :return: 签到结果
         """
-        result = self.__get_access_token()
+        stats = metrics.get_metrics()
+        account = lambda: self.phone  # noqa: E731
 
-        if result:
-            self.__sign_in()
+        try:
+            with stats.timer('access_token', account) as timer:
+                result = self.__load_cached_access_token() or self.__get_access_token()
+                timer.outcome = 'cached' if self.token_from_cache else ('success' if result else 'failure')
+
+            if result:
+                with stats.timer('sign_in', account) as timer:
+                    self.__sign_in()
+                    timer.outcome = 'success' if self.signin_count else 'failure'
+        except CircuitOpenError as e:
+            logging.warning(f'[{self.phone or self.hide_refresh_token}] 签到推迟, {e}')
+            self.error = {'code': 'CircuitOpen', 'message': str(e)}
+            self.retryable = True
+        except TransientError as e:
+            logging.error(f'[{self.phone or self.hide_refresh_token}] 签到失败, 重试后仍为临时错误: {e}')
+            self.error = {'code': 'TransientError', 'message': str(e)}
+            self.retryable = True
 
         return self.__generate_result()
 
 
-def push(
+def iter_sign_in(
         config: ConfigObj | dict,
-        content: str,
-        content_html: str,
-        title: Optional[str] = None,
-) -> NoReturn:
+        accounts: Iterable[dict],
+        max_workers: int = 1,
+        token_cache: Optional['TokenCache'] = None,
+        store: Optional['StateStore'] = None,
+        force: bool = False,
+        options: Optional[dict] = None,
+) -> Iterator[tuple[dict, SignInResult]]:
     """
-    推送签到结果
+    流式批量签到, max_workers 大于 1 时使用线程池并发执行, 同时最多预读 2 * max_workers 个账号.
+    遇到临时错误的账号在本轮结束后重新排队签到, 最多 requeue_rounds 轮
 
     :param config: 配置文件, ConfigObj 对象或字典
-    :param content: 推送内容
-    :param content_html: 推送内容, HTML 格式
-    :param title: 推送标题
+    :param accounts: 账号迭代器, 每个账号为至少包含 refresh_token 的字典,
+        source 为配置中的 refresh token, 缺省时与 refresh_token 相同
+    :param max_workers: 最大并发数
+    :param token_cache: access token 缓存
+    :param store: 状态存储, 每个账号签到完成后即在工作线程中记录, 今日已签到成功的账号直接跳过
+    :param force: 为 True 时忽略今日签到记录, 所有账号重新签到
+    :param options: get_sign_in_options 创建的限速, 重试, 熔断及并发控制, 多次调用时传入同一组以共享状态,
+        为 None 时按配置新建
+    :return: (账号, 签到结果) 迭代器, 每个账号只产出一次最终结果.
+        首轮结果按输入顺序产出, 重新排队的账号在最后产出
+    """
+    options = {
+        'session': get_session(),
+        'token_cache': token_cache,
+        **(options or get_sign_in_options(config, max_workers)),
+    }
+    breakers = options['circuit_breakers']
+    rejected = breakers.rejected() if breakers else 0
 
-    :return:
+    def sign_in(account: dict) -> SignInResult:
+        source = account.get('source', account['refresh_token'])
+        record = store.get(source) if store and not force else None
+
+        if record and store.signed_today(record['user']):
+            logging.info(f'[{record["user"]}] 今日已签到, 跳过.')
+            result = skipped_result(record)
+        else:
+            result = SignIn(config=config, refresh_token=account['refresh_token'], **options).run()
+
+        # 在工作线程中记录, 排在慢账号之后尚未产出的结果在运行中断时也不会丢失.
+        # refresh token 已轮换时立即提交, WAL 模式下 synchronous=NORMAL 的提交不触发 fsync, 开销很小
+        if store:
+            store.record(source, result)
+
+            if result.refresh_token != account['refresh_token']:
+                store.commit()
+
+        return result
+
+    def execute(items: Iterable[dict]) -> Iterator[tuple[dict, SignInResult]]:
+        try:
+            yield from schedule(items)
+        finally:
+            # 批量提交只在后续写入时触发, 每轮结束时提交剩余的写入, 常驻模式下批次间隔较长也不会丢失
+            if store:
+                store.commit()
+
+    def schedule(items: Iterable[dict]) -> Iterator[tuple[dict, SignInResult]]:
+        if max_workers <= 1:
+            for account in items:
+                yield account, sign_in(account)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='signin') as executor:
+            # 按提交顺序取结果, 保证推送内容与 refresh token 顺序对齐
+            window = deque()
+
+            for account in items:
+                window.append((account, executor.submit(sign_in, account)))
+
+                if len(window) >= max_workers * 2:
+                    account, future = window.popleft()
+                    yield account, future.result()
+
+            while window:
+                account, future = window.popleft()
+                yield account, future.result()
+
+    pending = []
+
+    for account, result in execute(accounts):
+        if result.retryable:
+            pending.append((account, result))
+        else:
+            yield account, result
+
+    for i in range(get_config_number(config, 'requeue_rounds', 1)):
+        if not pending:
+            break
+
+        logging.info(f'{len(pending)} 个账号遇到临时错误, 第 {i + 1} 轮重新签到.')
+
+        # 熔断器打开时等待进入半开状态, 由探测请求决定是否恢复
+        if options['circuit_breakers']:
+            options['circuit_breakers'].wait()
+
+        # 已轮换的 refresh token 会记录在结果中, 重新签到时使用最新的 token
+        retry = [
+            {**account, 'source': account.get('source', account['refresh_token']), 'refresh_token': result.refresh_token}
+            for account, result in pending
+        ]
+        pending = []
+
+        for account, result in execute(retry):
+            if result.retryable:
+                pending.append((account, result))
+            else:
+                yield account, result
+
+    if breakers and breakers.rejected() > rejected:
+        logging.warning(f'熔断期间共跳过 {breakers.rejected() - rejected} 次请求.')
+
+    if options['concurrency']:
+        report_concurrency(options['concurrency'])
+
+    yield from pending
+
+
+def get_sign_in_options(config: ConfigObj | dict, max_workers: int = 1) -> dict:
     """
-    configured_push_types = [
-        i.lower().strip()
-        for i in (
-            [config['push_types']]
-            if type(config['push_types']) == str
-            else config['push_types']
-        )
-    ]
+    按配置创建签到请求的限速, 重试, 熔断及自适应并发控制.
+    熔断器及自适应并发按请求结果累积状态, 常驻模式下创建一次, 供各批次共享
 
-    for push_type, pusher in {
-        'dingtalk': dingtalk,
-        'serverchan': serverchan,
-        'pushdeer': pushdeer,
-        'telegram': telegram,
-        'pushplus': pushplus,
-        'smtp': smtp,
-    }.items():
-        if push_type in configured_push_types:
-            pusher.push(config, content, content_html, title)
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param max_workers: 最大并发数, 作为自适应并发的上限
+    :return: 传递给 SignIn 的参数字典
+    """
+    return {
+        'rate_limiter': get_rate_limiter(config),
+        'retry_policy': get_retry_policy(config),
+        'circuit_breakers': get_circuit_breakers(config),
+        'timeout': get_config_number(config, 'request_timeout', REQUEST_TIMEOUT, float),
+        'concurrency': get_adaptive_limiter(config, max_workers),
+    }
 
 
-def init_logger() -> NoReturn:
+def skipped_result(record: dict) -> SignInResult:
     """
-    初始化日志系统
+    生成今日已签到账号的结果
 
-    :return:
+    :param record: 状态存储中的签到记录
+    :return: 签到结果
     """
-    log = logging.getLogger()
-    log.setLevel(logging.INFO)
-    log_format = logging.Formatter(
-        '%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s: %(message)s'
+    return SignInResult(
+        success=True,
+        user=record['user'],
+        refresh_token=record['refresh_token'],
+        count=record['count'],
+        reward=record['reward'],
+        skipped=True,
     )
 
-    # Console
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    ch.setFormatter(log_format)
-    log.addHandler(ch)
 
-    # Log file
-    log_name = 'aliyun_auto_signin.log'
-    fh = logging.FileHandler(log_name, mode='a', encoding='utf-8')
-    fh.setLevel(logging.DEBUG)
-    fh.setFormatter(log_format)
-    log.addHandler(fh)
+def run_sign_in(
+        config: ConfigObj | dict,
+        users: list[str],
+        max_workers: int = 1,
+        token_cache: Optional['TokenCache'] = None,
+        store: Optional['StateStore'] = None,
+        force: bool = False,
+        options: Optional[dict] = None,
+) -> list[SignInResult]:
+    """
+    批量签到
 
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param users: refresh token 列表
+    :param max_workers: 最大并发数
+    :param token_cache: access token 缓存
+    :param store: 状态存储, 用于找回上次中断时已轮换的 refresh token, 跳过今日已签到的账号并记录结果
+    :param force: 为 True 时忽略今日签到记录
+    :param options: get_sign_in_options 创建的请求控制, 为 None 时按配置新建
+    :return: 签到结果列表, 顺序与 users 一致
+    """
+    results = [None] * len(users)
 
-def get_config_from_env() -> Optional[dict]:
+    for account, result in iter_sign_in(
+            config,
+            (
+                {
+                    'index': i,
+                    'source': user,
+                    'refresh_token': store.resolve(user) if store else user,
+                }
+                for i, user in enumerate(users)
+            ),
+            max_workers,
+            token_cache,
+            store,
+            force,
+            options,
+    ):
+        results[account['index']] = result
+
+    return results
+
+
+def sign_in_from_file(
+        config: ConfigObj | dict,
+        path: str,
+        token_cache: Optional['TokenCache'] = None,
+        store: Optional['StateStore'] = None,
+        force: bool = False,
+        shard: Optional[Shard] = None,
+        read_only: bool = False,
+) -> tuple[str, list[SignInResult], list[SignInResult]]:
     """
-    从环境变量获取配置
+    从账号文件流式签到, 签到结果及轮换后的 refresh token 逐个写出, 内存占用与账号数量无关.
+    指定分片时读写 <path>.shard<i>, 该文件不存在时从账号文件中筛选属于该分片的账号
 
-    :return: 配置字典, 配置缺失返回 None
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param path: 账号文件路径
+    :param token_cache: access token 缓存
+    :param store: 状态存储
+    :param force: 为 True 时忽略今日签到记录
+    :param shard: 分片, 为 None 时处理所有账号
+    :param read_only: 为 True 时不回写账号文件
+    :return: 统计, 失败账号的签到结果, 以及账号信息中带有 email 字段的签到结果, 用于按账号推送
+    """
+    accounts = read_accounts(path)
+    quarantined = store.quarantined() if store else set()
+
+    if shard:
+        shard_path = f'{path}.shard{shard.index}'
+
+        seen_path = f'{shard_path}.seen'
+
+        if os.path.exists(shard_path):
+            seen = read_digests(seen_path)
+            accounts = read_accounts(shard_path)
+
+            if seen is None:
+                logging.info(f'分片 {shard} 尚未记录已分配的账号, 本次以 {path} 中属于该分片的账号为准, 之后新增的账号将自动加入')
+            else:
+                # 账号文件中新增的账号按哈希加入所属分片
+                new_accounts = list(unseen(read_accounts(path), shard, account_key, seen))
+
+                if new_accounts:
+                    logging.info(f'{path} 中新增 {len(new_accounts)} 个属于分片 {shard} 的账号')
+                    accounts = itertools.chain(accounts, new_accounts)
+        else:
+            logging.info(f'分片 {shard} 账号文件 {shard_path} 不存在, 从 {path} 中筛选')
+            accounts = select(accounts, shard, account_key)
+
+        base_path, path = path, shard_path
+
+    writer = AccountWriter(path) if not read_only else None
+    result_writer = ResultWriter(config['results_file']) if config.get('results_file') else None
+    success = 0
+    failures = []
+    personal = []
+    skipped = 0
+    # 写入账号文件的原 refresh token, 文件提交后以轮换后的 token 作为状态存储的新键
+    sources = []
+
+    def active(items: Iterable[dict]) -> Iterator[dict]:
+        nonlocal skipped
+
+        for account in items:
+            # 已隔离的账号原样写回, 不再签到
+            if account['refresh_token'] in quarantined:
+                if writer:
+                    writer.write(account)
+                skipped += 1
+                continue
+
+            yield {
+                'meta': account,
+                'source': account['refresh_token'],
+                'refresh_token': store.resolve(account['refresh_token']) if store else account['refresh_token'],
+            }
+
+    try:
+        for account, result in iter_sign_in(
+                config,
+                active(accounts),
+                get_max_workers(config),
+                token_cache,
+                store,
+                force,
+        ):
+            if writer:
+                writer.write({**account['meta'], 'refresh_token': result.refresh_token})
+                sources.append(account['source'])
+
+            if result_writer:
+                result_writer.write(result)
+
+            if account['meta'].get('email'):
+                result.email = account['meta']['email']
+                personal.append(result)
+
+            if result.success:
+                success += 1
+            else:
+                failures.append(result)
+    except BaseException:
+        if writer:
+            writer.abort()
+        raise
+    finally:
+        if result_writer:
+            result_writer.close()
+
+    if writer:
+        writer.commit()
+
+        # 与 finish 一致, 账号文件已保存最新的 refresh token, 下次运行按新 token 查找记录
+        if store:
+            store.rebase(sources)
+
+        if shard:
+            write_digests(seen_path, (digest(account_key(i)) for i in select(read_accounts(base_path), shard, account_key)))
+
+    if skipped:
+        logging.info(f'跳过 {skipped} 个已隔离的账号.')
+
+    metrics.get_metrics().set_gauge('quarantined_accounts', skipped, '已隔离的账号数')
+
+    if store:
+        store.commit()
+
+    return (
+        message.summarize(success, len(failures), store.report_quarantined() if store else None),
+        failures,
+        personal,
+    )
+
+
+def get_config_number(
+        config: ConfigObj | dict,
+        key: str,
+        default: int | float,
+        cast: type = int,
+) -> int | float:
+    """
+    读取数值配置项
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param key: 配置项名称
+    :param default: 配置缺失, 为空或无效时的默认值
+    :param cast: 数值类型, int 或 float
+    :return: 配置值
     """
+    value = config.get(key)
+
+    if value is None or value == '':
+        return default
+
     try:
-        return {
-            'refresh_tokens': (
-                [environ['REFRESH_TOKENS']]
-                if not environ['REFRESH_TOKENS']
-                else environ['REFRESH_TOKENS'].split(',')
-            ),
-            'push_types': (
-                [environ['PUSH_TYPES']]
-                if not environ['PUSH_TYPES']
-                else environ['PUSH_TYPES'].split(',')
-            ),
-            'serverchan_send_key': environ['SERVERCHAN_SEND_KEY'],
-            'telegram_endpoint': 'https://api.telegram.org',
-            'telegram_bot_token': environ['TELEGRAM_BOT_TOKEN'],
-            'telegram_chat_id': environ['TELEGRAM_CHAT_ID'],
-            'telegram_proxy': None,
-            'pushplus_token': environ['PUSHPLUS_TOKEN'],
-            'smtp_host': environ['SMTP_HOST'],
-            'smtp_port': environ['SMTP_PORT'],
-            'smtp_tls': environ['SMTP_TLS'],
-            'smtp_user': environ['SMTP_USER'],
-            'smtp_password': environ['SMTP_PASSWORD'],
-            'smtp_sender': environ['SMTP_SENDER'],
-            'smtp_receiver': environ['SMTP_RECEIVER'],
-        }
-    except KeyError as e:
-        logging.error(f'环境变量 {e} 缺失.')
+        return cast(value)
+    except (TypeError, ValueError):
+        logging.warning(f'{key} 配置无效: {value}, 使用默认值 {default}.')
+        return default
+
+
+def get_max_workers(config: ConfigObj | dict) -> int:
+    """
+    获取签到并发数
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 并发数, 配置缺失或无效时返回 1
+    """
+    return max(get_config_number(config, 'max_workers', 1), 1)
+
+
+def get_pool_size(config: ConfigObj | dict) -> int:
+    """
+    获取每个 host 的连接池大小, 未配置时不小于签到并发数
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 连接池大小
+    """
+    return max(get_config_number(config, 'pool_size', max(get_max_workers(config), 10)), 1)
+
+
+def get_rate_limiter(config: ConfigObj | dict) -> Optional[RateLimiter]:
+    """
+    按配置创建限速器, auth 与 member 接口分别限速
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 限速器, 均未限速时返回 None
+    """
+    rates = {
+        AUTH_HOST: get_config_number(config, 'auth_rate_limit', 0, float),
+        MEMBER_HOST: get_config_number(config, 'member_rate_limit', 0, float),
+    }
+
+    if not any(rate > 0 for rate in rates.values()):
         return None
 
+    return RateLimiter(rates, get_config_number(config, 'rate_limit_burst', 1))
 
-def main():
+
+def get_retry_policy(config: ConfigObj | dict) -> RetryPolicy:
     """
-    主函数
+    按配置创建重试策略
 
-    :return:
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 重试策略
     """
-    environ['NO_PROXY'] = '*'  # 禁止代理
+    return RetryPolicy(
+        retries=get_config_number(config, 'retry_times', 3),
+        base=get_config_number(config, 'retry_backoff', 1, float),
+    )
 
-    init_logger()  # 初始化日志系统
 
-    by_action = (
-        True
-        if len(argv) == 2 and argv[1] == 'action'
-        else False
+def get_adaptive_limiter(config: ConfigObj | dict, max_workers: int) -> Optional[AdaptiveLimiter]:
+    """
+    按配置创建自适应并发限制, max_workers 作为并发上限的最大值
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param max_workers: 最大并发数
+    :return: 自适应并发限制, 未启用或 max_workers 为 1 时返回 None
+    """
+    if max_workers <= 1 or not parse_bool(config.get('adaptive_concurrency')):
+        return None
+
+    return AdaptiveLimiter(
+        initial=get_config_number(config, 'adaptive_initial', max(max_workers // 4, 1)),
+        max_limit=max_workers,
+        min_limit=get_config_number(config, 'adaptive_min', 1),
+        latency_factor=get_config_number(config, 'adaptive_latency_factor', 2, float),
+        min_latency_delta=get_config_number(config, 'adaptive_latency_delta', 0.05, float),
     )
 
-    # 获取配置
-    config = (
-        get_config_from_env()
-        if by_action
-        else ConfigObj('config.ini', encoding='UTF8')
+
+def report_concurrency(limiter: AdaptiveLimiter) -> NoReturn:
+    """
+    输出自适应并发上限的变化, 并记录到耗时统计中
+
+    :param limiter: 自适应并发限制
+    :return:
+    """
+    stats = limiter.stats()
+    logging.info(
+        f'自适应并发: 当前上限 {stats["limit"]}, 最高 {stats["peak"]}, 最低 {stats["low"]}, '
+        f'增加 {stats["increases"]} 次, 减小 {stats["decreases"]} 次.'
     )
 
-    if not config:
-        logging.error('获取配置失败.')
-        return
+    gauges = metrics.get_metrics()
+    gauges.set_gauge('concurrency_limit', stats['limit'], 'Adaptive in-flight request limit at the end of the run.')
+    gauges.set_gauge('concurrency_limit_peak', stats['peak'], 'Highest adaptive in-flight request limit.')
+    gauges.set_gauge('concurrency_limit_low', stats['low'], 'Lowest adaptive in-flight request limit.')
 
-    # 获取所有 refresh token 指向用户
-    users = (
-        [config['refresh_tokens']]
-        if type(config['refresh_tokens']) == str
-        else config['refresh_tokens']
+
+def get_circuit_breakers(config: ConfigObj | dict) -> Optional[CircuitBreakers]:
+    """
+    按配置创建熔断器, auth 与 member 接口分别熔断
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 熔断器, breaker_error_rate 为 0 时返回 None
+    """
+    error_rate = get_config_number(config, 'breaker_error_rate', 0.5, float)
+
+    if error_rate <= 0:
+        return None
+
+    return CircuitBreakers(
+        [AUTH_HOST, MEMBER_HOST],
+        error_rate=error_rate,
+        window=get_config_number(config, 'breaker_window', 20),
+        min_requests=get_config_number(config, 'breaker_min_requests', 5),
+        cooldown=get_config_number(config, 'breaker_cooldown', 10, float),
     )
 
-    results = []
 
-    for user in users:
-        result = SignIn(config=config, refresh_token=user).run()
-        results.append(result)
+def push(
+        config: ConfigObj | dict,
+        content: str,
+        content_html: str,
+        title: Optional[str] = None,
+        results: Optional[list[SignInResult]] = None,
+        push_types: Optional[list[str]] = None,
+) -> list[dict]:
+    """
+    推送签到结果, 所有渠道并发推送, 受全局截止时间和单渠道超时限制
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param content: 推送内容
+    :param content_html: 推送内容, HTML 格式
+    :param title: 推送标题
+    :param results: 签到结果列表, 仅传递给 push 函数接受 results 参数的渠道, 用于按账号推送
+    :param push_types: 推送渠道列表, 默认为配置的所有渠道
+
+    :return: 各渠道推送结果, 包含 type, success, latency, error
+    """
+    # 只导入需要推送的渠道
+    configured_pushers = {
+        push_type: pusher
+        for push_type, pusher in (
+            (push_type, pushers.get(push_type))
+            for push_type in (get_push_types(config) if push_types is None else push_types)
+        )
+        if pusher
+    }
+
+    if not configured_pushers:
+        return []
+
+    timeout = get_config_number(config, 'push_timeout', 10, float)
+    deadline = get_config_number(config, 'push_deadline', 60, float)
+    stats = metrics.get_metrics()
+
+    # 超出渠道长度限制时可省略的段, 即成功账号的详情, 仅在需要精简时生成
+    @functools.cache
+    def omit() -> tuple[set[str], set[str]]:
+        return (
+            {i.text for i in results if i.success} if content else set(),
+            {i.text_html for i in results if i.success} if content_html else set(),
+        )
+
+    def timed_push(push_type: str, pusher) -> tuple[bool, float]:
+        import inspect
 
-    # 合并推送
-    text = '\n\n'.join([i['text'] for i in results])
-    text_html = '\n\n'.join([i['text_html'] for i in results])
+        # 第三方渠道的 push 不一定支持可选参数, 只传入其签名中声明的参数
+        parameters = inspect.signature(pusher.push).parameters
+        accepts = lambda name: name in parameters or any(  # noqa: E731
+            i.kind is inspect.Parameter.VAR_KEYWORD for i in parameters.values()
+        )
+        kwargs = {'timeout': timeout} if accepts('timeout') else {}
 
-    push(config, text, text_html, '阿里云盘签到')
+        if results is not None and accepts('results'):
+            kwargs['results'] = results
 
-    # 更新 refresh token
-    new_users = [i['refresh_token'] for i in results]
+        # 渠道自行处理截止时间时传入截止时间, 否则每次请求的超时不超过剩余时间
+        if accepts('deadline'):
+            kwargs['deadline'] = ends
 
-    if not by_action:
-        config['refresh_tokens'] = ','.join(new_users)
-    else:
-        github.update_secret('REFRESH_TOKENS', ','.join(new_users))
+        pages = message.paginate(
+            content,
+            content_html,
+            get_message_limit(config, push_type, pusher),
+            getattr(pusher, 'MESSAGE_FORMAT', 'text') == 'html',
+            omit if results else None,
+        )
+        success = True
+        start = time.perf_counter()
+
+        for i, (page, page_html) in enumerate(pages):
+            remaining = ends - time.monotonic()
+
+            if remaining <= 0:
+                logging.error(f'{push_type} 已超出推送截止时间 {deadline} 秒, 剩余 {len(pages) - i} 页未发送')
+                return False, time.perf_counter() - start
+
+            if 'timeout' in kwargs and 'deadline' not in kwargs:
+                kwargs['timeout'] = min(timeout, remaining)
+
+            page_title = f'{title} ({i + 1}/{len(pages)})' if len(pages) > 1 else title
+            success = pusher.push(config, page, page_html, page_title, **kwargs) and success
+            # 按账号推送只随第一页发送
+            kwargs.pop('results', None)
+
+        return success, time.perf_counter() - start
+
+    started = time.perf_counter()
+    ends = time.monotonic() + deadline
+    executor = ThreadPoolExecutor(max_workers=len(configured_pushers), thread_name_prefix='push')
+    futures = {
+        push_type: executor.submit(timed_push, push_type, pusher)
+        for push_type, pusher in configured_pushers.items()
+    }
+    wait(futures.values(), timeout=deadline)
+    # 不等待超出截止时间的渠道. 每次请求的超时不超过剩余时间, 超时后不再发送后续请求, 推送线程在截止时间后很快结束
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    outcomes = []
+
+    for push_type, future in futures.items():
+        outcome = {
+            'type': push_type,
+            'success': False,
+            'latency': None,
+            'error': None,
+        }
+
+        if not future.done():
+            outcome['latency'] = time.perf_counter() - started
+            outcome['error'] = f'超出推送截止时间 {deadline} 秒'
+            logging.error(f'{push_type} 推送超时, 已超出截止时间 {deadline} 秒')
+        elif future.exception():
+            outcome['error'] = str(future.exception())
+            logging.error(f'{push_type} 推送异常, 错误信息: {future.exception()}')
+        else:
+            outcome['success'], outcome['latency'] = future.result()
+            if not outcome['success']:
+                outcome['error'] = '推送失败'
+
+        stats.observe(
+            'push',
+            outcome['latency'] or 0,
+            'success' if outcome['success'] else ('timeout' if not future.done() else 'failure'),
+            target=push_type,
+        )
+        outcomes.append(outcome)
+
+    return outcomes
+
+
+def get_message_formats(config: ConfigObj | dict) -> set[str]:
+    """
+    获取已配置渠道使用的推送内容格式
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 格式集合, 如 {'text', 'html'}
+    """
+    return {
+        getattr(pusher, 'MESSAGE_FORMAT', 'text')
+        for pusher in (pushers.get(push_type) for push_type in get_push_types(config))
+        if pusher
+    }
+
+
+def get_push_types(config: ConfigObj | dict) -> list[str]:
+    """
+    获取配置的推送渠道
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 去重后的渠道名列表, 小写
+    """
+    configured_push_types = [
+        i.lower().strip()
+        for i in (
+            [config['push_types']]
+            if type(config['push_types']) == str
+            else config['push_types']
+        )
+    ]
+    return [i for i in dict.fromkeys(configured_push_types) if i]
+
+
+def get_message_limit(config: ConfigObj | dict, push_type: str, pusher) -> Optional[int]:
+    """
+    获取渠道单条消息的最大长度, 可通过 <渠道名>_message_limit 配置覆盖
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param push_type: 渠道名
+    :param pusher: 渠道模块
+    :return: 最大长度, 为 None 时不限制
+    """
+    limit = get_config_number(config, f'{push_type}_message_limit', getattr(pusher, 'MESSAGE_LIMIT', None) or 0)
+    return limit if limit > 0 else None
+
+
+def get_outbox(config: ConfigObj | dict, store: 'StateStore') -> Optional['Outbox']:
+    """
+    按配置创建推送发件箱
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param store: 状态存储, 用于保存待推送消息
+    :return: 发件箱, push_outbox 为 false 时返回 None
+    """
+    if not parse_bool(config.get('push_outbox'), True):
+        return None
+
+    from outbox import Outbox
+
+    return Outbox(
+        store,
+        push,
+        get_push_types,
+        interval=get_config_number(config, 'push_retry_interval', 300, float),
+        ttl=get_config_number(config, 'push_outbox_ttl', 3 * 86400, float),
+    )
+
+
+def init_logger(config: Optional[ConfigObj | dict] = None) -> NoReturn:
+    """
+    初始化日志系统, 日志由后台线程写出. 重复调用时按新配置替换, 不会重复输出
+
+    :param config: 配置文件, ConfigObj 对象或字典, 为 None 时使用默认配置
+    :return:
+    """
+    config = config or {}
+    logger.init(
+        path=config.get('log_file', 'aliyun_auto_signin.log'),
+        json_path=config.get('log_json'),
+        max_bytes=get_config_number(config, 'log_max_bytes', 10 * 1024 * 1024),
+        backup_count=get_config_number(config, 'log_backup_count', 5),
+        when=config.get('log_rotate_when') or None,
+    )
+
+
+def init_metrics(config: ConfigObj | dict) -> NoReturn:
+    """
+    按配置设置耗时统计, metrics_accounts 为 false 时不记录单账号统计
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return:
+    """
+    per_account = parse_bool(config.get('metrics_accounts'), True)
+    stats = metrics.get_metrics()
+    stats.per_account = per_account
+
+    if not per_account:
+        stats.reset_accounts()
+
+
+def get_config_from_env() -> Optional[dict]:
+    """
+    从环境变量获取配置
+
+    :return: 配置字典, 配置缺失返回 None
+    """
+    try:
+        return {
+            'refresh_tokens': (
+                [environ['REFRESH_TOKENS']]
+                if not environ['REFRESH_TOKENS']
+                else environ['REFRESH_TOKENS'].split(',')
+            ),
+            'push_types': (
+                [environ['PUSH_TYPES']]
+                if not environ['PUSH_TYPES']
+                else environ['PUSH_TYPES'].split(',')
+            ),
+            'serverchan_send_key': environ['SERVERCHAN_SEND_KEY'],
+            'telegram_endpoint': 'https://api.telegram.org',
+            'telegram_bot_token': environ['TELEGRAM_BOT_TOKEN'],
+            'telegram_chat_id': environ['TELEGRAM_CHAT_ID'],
+            'telegram_proxy': None,
+            'pushplus_token': environ['PUSHPLUS_TOKEN'],
+            'smtp_host': environ['SMTP_HOST'],
+            'smtp_port': environ['SMTP_PORT'],
+            'smtp_tls': environ['SMTP_TLS'],
+            'smtp_user': environ['SMTP_USER'],
+            'smtp_password': environ['SMTP_PASSWORD'],
+            'smtp_sender': environ['SMTP_SENDER'],
+            'smtp_receiver': environ['SMTP_RECEIVER'],
+            'smtp_account_receivers': environ.get('SMTP_ACCOUNT_RECEIVERS', ''),
+            'max_workers': environ.get('MAX_WORKERS', '1'),
+            'pool_size': environ.get('POOL_SIZE', ''),
+            'token_cache': environ.get('TOKEN_CACHE', ''),
+            'push_timeout': environ.get('PUSH_TIMEOUT', ''),
+            'push_deadline': environ.get('PUSH_DEADLINE', ''),
+            'auth_rate_limit': environ.get('AUTH_RATE_LIMIT', ''),
+            'member_rate_limit': environ.get('MEMBER_RATE_LIMIT', ''),
+            'retry_times': environ.get('RETRY_TIMES', ''),
+            'request_timeout': environ.get('REQUEST_TIMEOUT', ''),
+            'breaker_error_rate': environ.get('BREAKER_ERROR_RATE', ''),
+            'adaptive_concurrency': environ.get('ADAPTIVE_CONCURRENCY', ''),
+            'state_db': environ.get('STATE_DB', ''),
+            'quarantine_after': environ.get('QUARANTINE_AFTER', ''),
+            'metrics_file': environ.get('METRICS_FILE', ''),
+            'metrics_json': environ.get('METRICS_JSON', ''),
+            'metrics_accounts': environ.get('METRICS_ACCOUNTS', ''),
+            'push_outbox': environ.get('PUSH_OUTBOX', 'true'),
+            'log_json': environ.get('LOG_JSON', ''),
+            'shard': environ.get('SHARD', ''),
+            **get_shard_config_from_env(),
+        }
+    except KeyError as e:
+        logging.error(f'环境变量 {e} 缺失.')
+        return None
+
+
+def get_shard_config_from_env() -> dict[str, list[str]]:
+    """
+    从环境变量获取各分片的 refresh token 及已分配账号的摘要. REFRESH_TOKENS_<i> 及 SHARD_SEEN_<i> 对应分片 i,
+    SHARD_REFRESH_TOKENS 及 SHARD_SEEN 对应 SHARD 指定的当前分片, 便于在 workflow 中按分片传入不同的 secret
+
+    :return: refresh_tokens_<i> 及 shard_seen_<i> 配置项字典, 未配置的分片不包含在内
+    """
+    items = {
+        name.lower(): value.split(',')
+        for name, value in environ.items()
+        for prefix in ('REFRESH_TOKENS_', 'SHARD_SEEN_')
+        if name.startswith(prefix) and name[len(prefix):].isdigit() and value
+    }
+
+    if environ.get('SHARD') and (environ.get('SHARD_REFRESH_TOKENS') or environ.get('SHARD_SEEN')):
+        try:
+            shard = parse_shard(environ['SHARD'])
+        except ValueError as e:
+            logging.error(e)
+            return items
+
+        if environ.get('SHARD_REFRESH_TOKENS'):
+            items[get_shard_key(shard)] = environ['SHARD_REFRESH_TOKENS'].split(',')
+
+        if environ.get('SHARD_SEEN'):
+            items[get_shard_seen_key(shard)] = environ['SHARD_SEEN'].split(',')
+
+    return items
+
+
+def get_shard(config: ConfigObj | dict, shard: Optional[Shard] = None) -> Optional[Shard]:
+    """
+    获取分片, 命令行参数优先, 其次为配置项 shard
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param shard: 命令行指定的分片
+    :return: 分片, 未配置时返回 None
+    :raises ValueError: 配置项格式错误
+    """
+    if shard:
+        return shard
+
+    return parse_shard(config['shard']) if config.get('shard') else None
+
+
+def get_shard_key(shard: Shard) -> str:
+    """
+    获取分片 refresh token 的配置项名称
+
+    :param shard: 分片
+    :return: 配置项名称, 对应的 GitHub Secret 名称为其大写
+    """
+    return f'refresh_tokens_{shard.index}'
+
+
+def get_shard_seen_key(shard: Shard) -> str:
+    """
+    获取分片已分配账号摘要的配置项名称
+
+    :param shard: 分片
+    :return: 配置项名称, 对应的 GitHub Secret 名称为其大写
+    """
+    return f'shard_seen_{shard.index}'
+
+
+def get_shard_seen(config: ConfigObj | dict, shard: Shard) -> Optional[set[str]]:
+    """
+    获取分片已分配的账号, 即 refresh_tokens 中已加入该分片的 refresh token 的摘要
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param shard: 分片
+    :return: 摘要集合, 未记录时返回 None
+    """
+    value = config.get(get_shard_seen_key(shard))
+
+    if value is None or value == '':
+        return None
+
+    return {value} if type(value) == str else {i for i in value if i}
+
+
+def get_shard_digests(config: ConfigObj | dict, shard: Shard) -> list[str]:
+    """
+    计算 refresh_tokens 中属于分片的账号的摘要, 回写后作为已分配的账号
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param shard: 分片
+    :return: 排序后的摘要列表
+    """
+    return sorted({digest(i) for i in select(get_users(config), shard, lambda i: i)})
+
+
+def get_new_shard_users(config: ConfigObj | dict, shard: Shard) -> list[str]:
+    """
+    获取分片建立后新增到 refresh_tokens 中且属于该分片的 refresh token
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param shard: 分片
+    :return: refresh token 列表, 未记录已分配的账号时为空
+    """
+    seen = get_shard_seen(config, shard)
+
+    if seen is None:
+        return []
+
+    return list(unseen(get_users(config), shard, lambda i: i, seen))
+
+
+def run(
+        config: ConfigObj | dict,
+        by_action: bool,
+        store: 'StateStore',
+        token_cache: Optional['TokenCache'] = None,
+        force: bool = False,
+        outbox: Optional['Outbox'] = None,
+        shard: Optional[Shard] = None,
+        read_only: bool = False,
+) -> NoReturn:
+    """
+    执行一次签到, 推送并回写 refresh token
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param by_action: 是否在 GitHub Action 中运行
+    :param store: 状态存储
+    :param token_cache: access token 缓存
+    :param force: 为 True 时忽略今日签到记录, 所有账号重新签到
+    :param outbox: 推送发件箱, 为 None 时同步推送
+    :param shard: 分片, 为 None 时处理所有账号
+    :param read_only: 为 True 时不回写 refresh token, 用于回放
+    :return:
+    """
+    # 本地运行且配置了账号文件时, 从文件流式读取账号并回写
+    if not by_action and config.get('refresh_tokens_file'):
+        summary, failures, personal = sign_in_from_file(
+            config, config['refresh_tokens_file'], token_cache, store, force, shard, read_only,
+        )
+
+        if token_cache:
+            token_cache.save()
+
+        text, text_html = message.compose(failures, get_message_formats(config), summary)
+        (outbox.submit if outbox else push)(config, text, text_html, '阿里云盘签到', personal)
+        return
+
+    users = get_active_users(config, store, shard)
+    results = run_sign_in(config, users, get_max_workers(config), token_cache, store, force)
+    finish(config, by_action, store, users, results, token_cache, outbox, shard, read_only)
+
+
+def get_users(config: ConfigObj | dict, shard: Optional[Shard] = None) -> list[str]:
+    """
+    获取所有 refresh token 指向用户.
+    指定分片时优先使用该分片回写的 refresh_tokens_<i>, 未回写过时按 refresh token 的哈希从 refresh_tokens 中筛选.
+    此后分片成员以 refresh_tokens_<i> 为准, 不随 refresh token 轮换变化; refresh_tokens 中新增的账号按 shard_seen_<i> 识别后加入
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param shard: 分片, 为 None 时返回所有账号
+    :return: refresh token 列表
+    """
+    if shard and config.get(get_shard_key(shard)):
+        tokens = config[get_shard_key(shard)]
+        tokens = [tokens] if type(tokens) == str else [i for i in tokens if i]
+        # refresh_tokens 中新增的账号按哈希加入所属分片
+        return tokens + [i for i in get_new_shard_users(config, shard) if i not in tokens]
+
+    users = (
+        [config['refresh_tokens']]
+        if type(config['refresh_tokens']) == str
+        else list(config['refresh_tokens'])
+    )
+    return list(select(users, shard, lambda i: i)) if shard else users
+
+
+def get_active_users(config: ConfigObj | dict, store: 'StateStore', shard: Optional[Shard] = None) -> list[str]:
+    """
+    获取需要签到的 refresh token, 排除已隔离的账号
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param store: 状态存储
+    :param shard: 分片, 为 None 时返回所有账号
+    :return: refresh token 列表
+    """
+    users = get_users(config, shard)
+    quarantined = store.quarantined()
+
+    if shard and config.get(get_shard_key(shard)):
+        if get_shard_seen(config, shard) is None:
+            logging.info(
+                f'分片 {shard} 尚未记录已分配的账号, 本次以 refresh_tokens 中属于该分片的账号为准, 之后新增的账号将自动加入. '
+                f'在 Action 中运行时需传入 {get_shard_seen_key(shard).upper()}'
+            )
+        elif new_users := get_new_shard_users(config, shard):
+            logging.info(f'refresh_tokens 中新增 {len(new_users)} 个属于分片 {shard} 的账号')
+
+    active = [user for user in users if user not in quarantined]
+
+    if len(active) < len(users):
+        logging.info(f'跳过 {len(users) - len(active)} 个已隔离的账号.')
+
+    metrics.get_metrics().set_gauge('quarantined_accounts', len(users) - len(active), '已隔离的账号数')
+    return active
+
+
+def finish(
+        config: ConfigObj | dict,
+        by_action: bool,
+        store: 'StateStore',
+        users: list[str],
+        results: list[SignInResult],
+        token_cache: Optional['TokenCache'] = None,
+        outbox: Optional['Outbox'] = None,
+        shard: Optional[Shard] = None,
+        read_only: bool = False,
+) -> NoReturn:
+    """
+    签到结束后合并推送, 并回写 refresh token. 指定分片时仅回写该分片的 refresh_tokens_<i>
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :param by_action: 是否在 GitHub Action 中运行
+    :param store: 状态存储
+    :param users: 本次签到的 refresh token 列表, 不含已隔离的账号
+    :param results: 签到结果, 顺序与 users 一致
+    :param token_cache: access token 缓存
+    :param outbox: 推送发件箱, 为 None 时同步推送
+    :param shard: 分片, 为 None 时回写 refresh_tokens
+    :param read_only: 为 True 时只推送, 不回写 refresh token
+    :return:
+    """
+    store.commit()
+
+    if token_cache:
+        token_cache.save()
+
+    # 合并推送, 只生成已配置渠道使用的格式, 超出渠道长度限制时精简或分页
+    text, text_html = message.compose(
+        results, get_message_formats(config), quarantined=store.report_quarantined(),
+    )
+
+    # 使用发件箱时在后台推送, 不阻塞 refresh token 回写
+    (outbox.submit if outbox else push)(config, text, text_html, '阿里云盘签到', results)
+
+    if read_only:
+        return
+
+    # 更新 refresh token, 以状态存储中的最新记录为准. 按当前配置导出, 避免覆盖运行期间新增的账号,
+    # 已隔离的账号原样保留
+    new_users = store.export(get_users(config, shard))
+    key = get_shard_key(shard) if shard else 'refresh_tokens'
+    # 记录已分配的账号, 之后 refresh_tokens 中新增的账号才能被识别
+    seen_key = get_shard_seen_key(shard) if shard else None
+    seen = get_shard_digests(config, shard) if shard else None
+
+    if not by_action:
+        config[key] = new_users
+
+        if shard:
+            config[seen_key] = seen
+            # 多个分片可能共用同一配置文件, 重新读取后仅修改本分片的配置项
+            latest = ConfigObj(config.filename, encoding='UTF8')
+            latest[key] = new_users
+            latest[seen_key] = seen
+            latest.write()
+        else:
+            config.write()
+    else:
+        # github 依赖 PyNaCl, 仅在 Action 中回写时导入
+        import github
+
+        with metrics.get_metrics().timer('github_update'):
+            if shard:
+                # 仅更新本分片的 secret, 与传入的值相同时跳过
+                name, seen_name = key.upper(), seen_key.upper()
+                current = {
+                    **({name: ','.join(config[key])} if config.get(key) else {}),
+                    **({seen_name: ','.join(sorted(get_shard_seen(config, shard)))} if get_shard_seen(config, shard) else {}),
+                }
+                github.update_secrets({name: ','.join(new_users), seen_name: ','.join(seen)}, current=current)
+            else:
+                github.update_secret('REFRESH_TOKENS', ','.join(new_users))
+
+    store.rebase(users)
+
+
+def export_metrics(config: ConfigObj | dict) -> NoReturn:
+    """
+    输出各阶段耗时汇总, 并按配置导出 Prometheus textfile 及 JSON 摘要
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return:
+    """
+    summary = metrics.get_metrics().summary()
+
+    if summary:
+        logging.info(f'各阶段耗时:\n{summary}')
+
+    metrics.export(config.get('metrics_file'), config.get('metrics_json'))
+
+
+# 常驻模式下修改后需要重启才生效的配置项, 其余配置项在 SIGHUP 重新加载后生效
+DAEMON_RESTART_KEYS = (
+    'state_db', 'token_cache', 'push_outbox', 'push_retry_interval', 'push_outbox_ttl',
+    'metrics_port', 'metrics_host',
+)
+
+
+def run_daemon(force: bool = False, shard: Optional[Shard] = None) -> NoReturn:
+    """
+    常驻模式, 进程内保持 HTTP 连接池, access token 缓存及状态存储, 每日定时签到
+
+    :param force: 为 True 时忽略今日签到记录
+    :param shard: 命令行指定的分片, 为 None 时使用配置项 shard
+    :return:
+    """
+    from daemon import Daemon
+
+    def load_config() -> Optional[ConfigObj]:
+        with metrics.get_metrics().timer('config_load'):
+            config = ConfigObj('config.ini', encoding='UTF8')
+        return config if config else None
+
+    def get_day_accounts(c: ConfigObj) -> Optional[list[str]]:
+        # 单账号统计只保留当天, 汇总直方图持续累计
+        metrics.get_metrics().reset_accounts()
+        return None if c.get('refresh_tokens_file') else get_active_users(c, store, get_shard(c, shard))
+
+    def finish_day(c: ConfigObj, users: list[str], results: list[SignInResult]) -> NoReturn:
+        finish(c, False, store, users, results, token_cache, outbox, get_shard(c, shard))
+        export_metrics(c)
+
+    def run_all(c: ConfigObj) -> NoReturn:
+        with metrics.get_metrics().timer('run'):
+            run(c, False, store, token_cache, force, outbox, get_shard(c, shard))
+        export_metrics(c)
+
+    def apply_config(previous: ConfigObj, c: ConfigObj) -> NoReturn:
+        nonlocal options
+
+        # 日志, 统计及连接池按新配置重新初始化, 状态存储, 缓存, 发件箱及统计接口在启动时创建, 修改后需要重启
+        init_logger(c)
+        init_metrics(c)
+
+        if get_pool_size(c) != get_pool_size(previous):
+            init_session(get_pool_size(c))
+
+        # 限速, 熔断及并发配置可能已修改, 按新配置重建
+        options = get_sign_in_options(c, get_max_workers(c))
+
+        changed = [key for key in DAEMON_RESTART_KEYS if previous.get(key) != c.get(key)]
+
+        if changed:
+            logging.warning(f'配置项 {", ".join(changed)} 已修改, 需要重启常驻进程后生效.')
+
+    config = load_config()
+
+    if not config:
+        logging.error('获取配置失败.')
+        return
+
+    init_logger(config)
+    init_metrics(config)
+    init_session(get_pool_size(config))
+
+    # 统计接口, 未配置端口时不启动
+    metrics_port = get_config_number(config, 'metrics_port', 0)
+    server = metrics.serve(metrics_port, config.get('metrics_host') or '127.0.0.1') if metrics_port else None
+
+    token_cache = get_token_cache(config)
+    store = get_state_store(config)
+
+    # 常驻模式下发件箱按 push_retry_interval 定时重试未送达的消息
+    outbox = get_outbox(config, store)
+
+    # 分散签到时每批只有少数账号, 熔断器及自适应并发需要跨批次累积请求结果
+    options = get_sign_in_options(config, get_max_workers(config))
+
+    if outbox:
+        outbox.start(config)
+
+    try:
+        Daemon(
+            load_config=load_config,
+            get_accounts=get_day_accounts,
+            sign_in=lambda c, users: run_sign_in(c, users, get_max_workers(c), token_cache, store, force, options),
+            finish=finish_day,
+            run_all=run_all,
+            on_reload=apply_config,
+        ).run()
+    finally:
+        if server:
+            server.shutdown()
+
+        close_store(store, outbox, get_config_number(config, 'push_deadline', 60, float))
+        pushers.close()
+        close_session()
+
+
+def get_token_cache(config: ConfigObj | dict) -> Optional['TokenCache']:
+    """
+    按配置创建 access token 缓存
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: token 缓存, token_cache 为空时返回 None
+    """
+    path = config.get('token_cache', 'token_cache.json')
+    if not path:
+        return None
+
+    from cache import TokenCache
+
+    return TokenCache(path)
+
+
+def get_state_store(config: ConfigObj | dict) -> 'StateStore':
+    """
+    按配置打开状态存储
+
+    :param config: 配置文件, ConfigObj 对象或字典
+    :return: 状态存储, state_db 为空时仅在内存中保存
+    """
+    from state import StateStore
+
+    return StateStore(
+        config.get('state_db', 'aliyun_auto_signin.db') or ':memory:',
+        quarantine_after=get_config_number(config, 'quarantine_after', 3),
+    )
+
+
+def close_store(store: 'StateStore', outbox: Optional['Outbox'] = None, timeout: Optional[float] = None) -> NoReturn:
+    """
+    停止发件箱后关闭状态存储. 发件箱线程超时仍在运行时只提交已有的写入, 不在其使用中关闭连接
+
+    :param store: 状态存储
+    :param outbox: 推送发件箱
+    :param timeout: 等待发件箱的最长时间, 单位秒
+    :return:
+    """
+    if outbox and not outbox.close(timeout):
+        store.commit()
+        return
+
+    store.close()
+
+
+def manage_quarantine(store: 'StateStore', reactivate: Optional[list[str]] = None) -> NoReturn:
+    """
+    解除隔离或列出已隔离的账号
+
+    :param store: 状态存储
+    :param reactivate: 需要解除隔离的账号, 空列表表示所有账号, 为 None 时仅列出
+    :return:
+    """
+    if reactivate is not None:
+        count = store.reactivate(reactivate or None)
+        logging.info(f'已解除 {count} 个账号的隔离, 下次运行时重新签到.')
+        return
+
+    entries = store.list_quarantined()
+
+    if not entries:
+        logging.info('没有已隔离的账号.')
+        return
+
+    logging.info(
+        f'已隔离 {len(entries)} 个账号:\n'
+        + '\n'.join(
+            f'{i["user"] or "-"}: 连续失效 {i["failures"]} 次, 错误码 {i["error"]}, '
+            f'隔离于 {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(i["quarantined_at"]))}'
+            for i in entries
+        )
+    )
+
+
+def parse_shard_arg(value: str) -> Shard:
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args(args: list[str]) -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    :param args: 命令行参数, 不含程序名
+    :return: 解析结果
+    """
+    parser = argparse.ArgumentParser(description='阿里云盘自动签到')
+    parser.add_argument(
+        'mode', nargs='?', choices=['local', 'action', 'daemon'], default='local',
+        help='运行方式, local 读取 config.ini, action 读取环境变量, daemon 以常驻进程每日定时签到',
+    )
+    parser.add_argument('--force', action='store_true', help='忽略今日签到记录, 所有账号重新签到')
+    parser.add_argument(
+        '--shard', type=parse_shard_arg,
+        help='分片, 格式为 i/n, 仅处理第 i 个分片 (从 0 开始) 的账号, 多个实例共同处理所有账号',
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='性能分析模式, 使用 cProfile 及 tracemalloc 分析本次运行, 输出分析结果及摘要',
+    )
+    parser.add_argument(
+        '--profile-output', default='profile',
+        help='分析结果文件名前缀, 生成 <前缀>.prof 及 <前缀>.txt, 默认为 profile',
+    )
+    parser.add_argument('--profile-top', type=int, default=20, help='摘要中每项列出的条目数, 默认为 20')
+    quarantine = parser.add_mutually_exclusive_group()
+    quarantine.add_argument(
+        '--reactivate', nargs='*', metavar='ACCOUNT',
+        help='解除账号的隔离后退出, ACCOUNT 为 refresh token 或推送中显示的账号, 不指定时解除所有账号',
+    )
+    quarantine.add_argument('--list-quarantined', action='store_true', help='列出已隔离的账号后退出')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', metavar='PATH', help='录制本次运行的所有 HTTP 请求及响应, 脱敏后保存到 PATH')
+    cassette.add_argument('--replay', metavar='PATH', help='不访问网络, 从 PATH 回放录制的响应')
+    parser.add_argument(
+        '--replay-speed', type=float, default=1,
+        help='回放速度倍数, 1 为按录制时的耗时等待, 0 为不等待, 默认为 1',
+    )
+    parsed = parser.parse_args(args)
+
+    if parsed.replay and parsed.mode == 'daemon':
+        parser.error('--replay 不支持 daemon 模式')
+
+    return parsed
+
+
+def profile(args: argparse.Namespace) -> NoReturn:
+    """
+    以性能分析模式运行 start
+
+    :param args: 命令行参数
+    :return:
+    """
+    import profiling
+
+    profiler = profiling.Profiler(args.profile_top)
+    module = sys.modules[__name__]
+    profiler.tracker.wrap(SignIn, 'run', 'SignIn.run')
+    profiler.tracker.wrap(module, 'push', 'push')
+
+    if args.mode == 'action':
+        import github
+        # update_secret 经由 update_secrets 更新, 分片时直接调用 update_secrets
+        profiler.tracker.wrap(github, 'update_secrets', 'github.update_secrets')
+
+    try:
+        profiler.run(lambda: start(args))
+    finally:
+        profiler.dump(f'{args.profile_output}.prof')
+
+        with open(f'{args.profile_output}.txt', 'w', encoding='utf-8') as f:
+            f.write(profiler.report(profiling.import_times('app', args.profile_top)))
+
+        logging.info(f'性能分析结果已保存至 {args.profile_output}.prof 及 {args.profile_output}.txt')
+
+
+def main():
+    """
+    主函数
+
+    :return:
+    """
+    args = parse_args(argv[1:])
+    recording = None
+
+    if args.record or args.replay:
+        import cassette
+
+        if args.record:
+            recording = cassette.record(args.record)
+        else:
+            cassette.replay(args.replay, args.replay_speed)
+
+    try:
+        if args.profile:
+            profile(args)
+        else:
+            start(args)
+    finally:
+        if recording:
+            recording.save()
+            logging.info(f'已录制 {len(recording.interactions)} 个请求, 保存至 {args.record}')
+
+
+def start(args: argparse.Namespace) -> NoReturn:
+    """
+    按命令行参数运行
+
+    :param args: 命令行参数
+    :return:
+    """
+    environ['NO_PROXY'] = '*'  # 禁止代理
+
+    init_logger()  # 初始化日志系统
+
+    # 常驻模式下管理隔离账号时, 与本地运行相同读取 config.ini 后退出
+    if args.mode == 'daemon' and args.reactivate is None and not args.list_quarantined:
+        run_daemon(args.force, args.shard)
+        return
+
+    by_action = args.mode == 'action'
+
+    # 获取配置
+    with metrics.get_metrics().timer('config_load'):
+        config = (
+            get_config_from_env()
+            if by_action
+            else ConfigObj('config.ini', encoding='UTF8')
+        )
+
+    if not config:
+        logging.error('获取配置失败.')
+        return
+
+    # 按配置重新初始化日志, 启用滚动及结构化日志
+    init_logger(config)
+    init_metrics(config)
+
+    if args.replay:
+        # 回放的响应中 refresh token 已脱敏, 不回写配置, 账号文件及 GitHub Secret, 状态及缓存仅保存在内存中
+        config['state_db'] = ''
+        config['token_cache'] = ''
+
+    try:
+        shard = get_shard(config, args.shard)
+    except ValueError as e:
+        logging.error(e)
+        return
+
+    if shard:
+        logging.info(f'当前分片: {shard}')
+
+    init_session(get_pool_size(config))
+
+    # access token 缓存, 配置为空时不启用
+    token_cache = get_token_cache(config)
+
+    # 状态存储, 未配置时仅在内存中保存
+    store = get_state_store(config)
+
+    if args.reactivate is not None or args.list_quarantined:
+        manage_quarantine(store, args.reactivate)
+        store.close()
+        return
+
+    # 推送发件箱, 启动时即在后台重试此前未送达的消息
+    outbox = get_outbox(config, store)
+
+    if outbox:
+        outbox.start(config)
+
+    try:
+        with metrics.get_metrics().timer('run'):
+            run(config, by_action, store, token_cache, args.force, outbox, shard, bool(args.replay))
+    finally:
+        # 等待推送完成, 超出截止时间未送达的消息留待下次运行.
+        # 异常退出时也提交已完成账号的 refresh token
+        close_store(store, outbox, get_config_number(config, 'push_deadline', 60, float))
+        pushers.close()
+        close_session()
+        export_metrics(config)
 
 
 if __name__ == '__main__':
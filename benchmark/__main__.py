@@ -0,0 +1,343 @@
+"""
+    @Description: 离线基准测试, 使用本地模拟服务驱动 main() / SignIn 并统计吞吐量, 各阶段延迟及内存峰值
+
+    用法: python -m benchmark --accounts 1000 --workers 16 --latency 50,push=200
+"""
+
+from multiprocessing import Process, Queue
+from typing import NoReturn, Optional
+from urllib.parse import urlsplit
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from requests.adapters import HTTPAdapter
+
+import session
+from benchmark.server import FakeServer, endpoint_kind, parse_spec
+
+PHASES = {
+    'auth': 'access_token',
+    'member': 'sign_in',
+    'github': 'github',
+    'push': 'push',
+}
+
+
+class Recorder:
+    """
+    按阶段记录请求耗时
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, phase: str, latency: float, error: bool) -> NoReturn:
+        with self.lock:
+            self.latencies.setdefault(phase, []).append(latency)
+            self.errors[phase] = self.errors.get(phase, 0) + int(error)
+
+    def summary(self) -> dict:
+        return {
+            phase: {
+                'count': len(values),
+                'errors': self.errors.get(phase, 0),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': max(values) * 1000,
+            }
+            for phase, values in sorted(self.latencies.items())
+        }
+
+
+class BenchmarkAdapter(HTTPAdapter):
+    """
+    将请求转发到本地模拟服务, 原始 host 作为路径第一段
+    """
+
+    def __init__(self, base_url: str, recorder: Recorder, **kwargs):
+        self.base_url = base_url
+        self.recorder = recorder
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = f'{self.base_url}/{url.netloc}{url.path}' + (f'?{url.query}' if url.query else '')
+        kwargs['proxies'] = None
+
+        phase = PHASES[endpoint_kind(url.netloc)]
+        start = time.perf_counter()
+
+        try:
+            resp = super().send(request, **kwargs)
+        except Exception:
+            self.recorder.record(phase, time.perf_counter() - start, True)
+            raise
+
+        self.recorder.record(phase, time.perf_counter() - start, resp.status_code >= 400)
+        return resp
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    最近秩法计算百分位数
+
+    :param values: 数据
+    :param p: 百分位, 0 ~ 100
+    :return: 百分位数
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def serve(
+        queue: Queue,
+        latency: dict,
+        jitter: dict,
+        error_rate: dict,
+        seed: Optional[int],
+        capacity: Optional[dict] = None,
+) -> NoReturn:
+    """
+    子进程中运行模拟服务, 避免与被测代码争用 GIL 和内存统计
+
+    :return:
+    """
+    server = FakeServer(('127.0.0.1', 0), latency, jitter, error_rate, seed, capacity)
+    queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def synthetic_tokens(n: int) -> list[str]:
+    return [f'bench{i:06d}{"x" * 24}' for i in range(n)]
+
+
+def run_signin(args, tokens: list[str]) -> NoReturn:
+    """
+    直接驱动 run_sign_in, 只测试签到阶段
+
+    :return:
+    """
+    import app
+
+    config = {
+        'max_workers': args.workers,
+        'pool_size': args.pool_size or '',
+        'adaptive_concurrency': str(args.adaptive),
+    }
+    session.init_session(app.get_pool_size(config))
+    app.run_sign_in(config, tokens, app.get_max_workers(config))
+    session.close_session()
+
+
+def run_main(args, tokens: list[str], workdir: str) -> NoReturn:
+    """
+    驱动完整的 main(), 包含推送和 refresh token 回写
+
+    :return:
+    """
+    import app
+
+    push_types = args.push_types
+    common = {
+        'max_workers': str(args.workers),
+        'pool_size': str(args.pool_size or ''),
+        'push_types': push_types.split(','),
+        'adaptive_concurrency': str(args.adaptive),
+    }
+
+    if args.mode == 'action':
+        os.environ.update({
+            'REFRESH_TOKENS': ','.join(tokens),
+            'PUSH_TYPES': push_types,
+            'MAX_WORKERS': common['max_workers'],
+            'POOL_SIZE': common['pool_size'],
+            'ADAPTIVE_CONCURRENCY': common['adaptive_concurrency'],
+            'SERVERCHAN_SEND_KEY': 'bench',
+            'TELEGRAM_BOT_TOKEN': 'bench',
+            'TELEGRAM_CHAT_ID': 'bench',
+            'PUSHPLUS_TOKEN': 'bench',
+            'SMTP_HOST': '', 'SMTP_PORT': '', 'SMTP_TLS': '', 'SMTP_USER': '',
+            'SMTP_PASSWORD': '', 'SMTP_SENDER': '', 'SMTP_RECEIVER': '',
+            'GITHUB_REPOS': 'bench/bench',
+            'GP_TOKEN': 'bench',
+        })
+        argv = ['app.py', 'action']
+    else:
+        from configobj import ConfigObj
+
+        config = ConfigObj(encoding='UTF8')
+        config.filename = os.path.join(workdir, 'config.ini')
+        if args.stream:
+            with open(os.path.join(workdir, 'tokens.txt'), 'w', encoding='utf-8') as f:
+                f.writelines(f'{token}\n' for token in tokens)
+
+        config.update({
+            **common,
+            'refresh_tokens': tokens if not args.stream else '',
+            'refresh_tokens_file': 'tokens.txt' if args.stream else '',
+            'token_cache': '',
+            'serverchan_send_key': 'bench',
+            'pushdeer_endpoint': 'https://api2.pushdeer.com',
+            'pushdeer_send_key': 'bench',
+            'telegram_endpoint': 'https://api.telegram.org',
+            'telegram_bot_token': 'bench',
+            'telegram_chat_id': 'bench',
+            'telegram_proxy': '',
+            'pushplus_token': 'bench',
+            'dingtalk_app_key': 'bench',
+            'dingtalk_app_secret': 'bench',
+            'dingtalk_user_id': 'bench',
+        })
+        config.write()
+        argv = ['app.py']
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    # app 通过 from sys import argv 引用, 需原地修改
+    sys.argv[:] = argv
+
+    try:
+        app.main()
+    finally:
+        os.chdir(cwd)
+
+
+def report(result: dict) -> NoReturn:
+    print(
+        f'\n模式: {result["mode"]}, 账号数: {result["accounts"]}, 并发: {result["workers"]}, '
+        f'耗时: {result["wall_s"]:.2f}s, 吞吐量: {result["accounts_per_s"]:.1f} 账号/秒'
+    )
+
+    if result['peak_memory_mib'] is not None:
+        print(f'内存峰值 (tracemalloc): {result["peak_memory_mib"]:.2f} MiB')
+
+    print(f'\n{"阶段":<14}{"请求数":>8}{"错误":>8}{"p50(ms)":>10}{"p99(ms)":>10}{"max(ms)":>10}')
+    for phase, s in result['phases'].items():
+        print(
+            f'{phase:<16}{s["count"]:>8}{s["errors"]:>8}'
+            f'{s["p50_ms"]:>10.1f}{s["p99_ms"]:>10.1f}{s["max_ms"]:>10.1f}'
+        )
+
+
+def compare(result: dict, baseline_path: str, tolerance: float) -> bool:
+    """
+    与基线结果比较吞吐量
+
+    :param result: 本次结果
+    :param baseline_path: 基线 JSON 文件路径
+    :param tolerance: 允许的吞吐量下降比例
+    :return: 未出现回退返回 True
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    floor = baseline['accounts_per_s'] * (1 - tolerance)
+    ok = result['accounts_per_s'] >= floor
+    print(
+        f'\n基线吞吐量: {baseline["accounts_per_s"]:.1f} 账号/秒, 下限: {floor:.1f}, '
+        f'本次: {result["accounts_per_s"]:.1f} -> {"通过" if ok else "回退"}'
+    )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='阿里云盘签到离线基准测试')
+    parser.add_argument('--accounts', '-n', type=int, default=100, help='模拟账号数')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='签到并发数 (max_workers)')
+    parser.add_argument('--pool-size', type=int, default=None, help='连接池大小 (pool_size)')
+    parser.add_argument(
+        '--mode', choices=['signin', 'local', 'action'], default='signin',
+        help='signin: 只测试签到; local / action: 以对应方式运行完整 main()',
+    )
+    parser.add_argument('--stream', action='store_true', help='local 模式下通过账号文件流式签到')
+    parser.add_argument('--adaptive', action='store_true', help='启用自适应并发, --workers 作为并发上限的最大值')
+    parser.add_argument('--push-types', default='serverchan,telegram,pushplus', help='main() 模式下的推送渠道')
+    parser.add_argument('--latency', default='20', help='平均延迟 (毫秒), 如 50 或 50,member=120,push=300')
+    parser.add_argument('--jitter', default='5', help='延迟抖动 (毫秒), 格式同 --latency')
+    parser.add_argument('--error-rate', default='0', help='错误率 (0 ~ 1), 格式同 --latency')
+    parser.add_argument(
+        '--capacity', default='0', help='模拟服务的并发容量, 超出时返回 429 (0 为不限制), 格式同 --latency',
+    )
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='不统计内存峰值, 避免影响吞吐量')
+    parser.add_argument('--json', dest='json_path', help='将结果写入 JSON 文件')
+    parser.add_argument('--baseline', help='基线 JSON 文件, 吞吐量低于基线时以非零状态退出')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的吞吐量下降比例')
+    args = parser.parse_args()
+
+    queue = Queue()
+    server = Process(
+        target=serve,
+        args=(
+            queue,
+            parse_spec(args.latency),
+            parse_spec(args.jitter),
+            parse_spec(args.error_rate),
+            args.seed,
+            parse_spec(args.capacity, int),
+        ),
+        daemon=True,
+    )
+    server.start()
+    base_url = f'http://127.0.0.1:{queue.get(timeout=10)}'
+
+    recorder = Recorder()
+    session.set_transport(lambda **kwargs: BenchmarkAdapter(base_url, recorder, **kwargs))
+
+    tokens = synthetic_tokens(args.accounts)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.mode == 'signin':
+            run_signin(args, tokens)
+        else:
+            run_main(args, tokens, workdir)
+
+    wall = time.perf_counter() - start
+    peak = None
+
+    if not args.no_tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    session.set_transport()
+    server.terminate()
+
+    result = {
+        'mode': args.mode,
+        'accounts': args.accounts,
+        'workers': args.workers,
+        'wall_s': wall,
+        'accounts_per_s': args.accounts / wall if wall else 0.0,
+        'peak_memory_mib': peak,
+        'phases': recorder.summary(),
+    }
+
+    report(result)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    if args.baseline and not compare(result, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
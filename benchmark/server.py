@@ -0,0 +1,270 @@
+"""
+    @Description: 本地模拟服务, 模拟阿里云盘, 推送渠道及 GitHub Secrets 接口
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NoReturn, Optional
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+
+from nacl import public, encoding
+
+# 请求的原始 host 作为路径第一段转发到本地, 如 /auth.aliyundrive.com/v2/account/token
+ENDPOINT_KINDS = {
+    'auth.aliyundrive.com': 'auth',
+    'member.aliyundrive.com': 'member',
+    'api.github.com': 'github',
+}
+
+
+def endpoint_kind(host: str) -> str:
+    """
+    获取 host 对应的接口类别
+
+    :param host: 原始请求 host
+    :return: auth, member, github 或 push
+    """
+    return ENDPOINT_KINDS.get(host, 'push')
+
+
+def parse_spec(value: str, cast: type = float) -> dict:
+    """
+    解析按接口类别配置的参数, 如 "50" 或 "50,member=120,push=300"
+
+    :param value: 参数字符串, 不带类别的值作为默认值
+    :param cast: 数值类型
+    :return: 类别到数值的字典, 默认值的键为 default
+    """
+    spec = {'default': cast(0)}
+
+    for item in filter(None, (i.strip() for i in value.split(','))):
+        if '=' in item:
+            kind, v = item.split('=', 1)
+            spec[kind.strip()] = cast(v)
+        else:
+            spec['default'] = cast(item)
+
+    return spec
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    模拟服务, 按接口类别注入延迟, 错误及并发容量限制
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(
+            self,
+            address: tuple[str, int],
+            latency: Optional[dict] = None,
+            jitter: Optional[dict] = None,
+            error_rate: Optional[dict] = None,
+            seed: Optional[int] = None,
+            capacity: Optional[dict] = None,
+    ):
+        """
+        初始化
+
+        :param address: 监听地址
+        :param latency: 各类别接口的平均延迟, 单位毫秒
+        :param jitter: 各类别接口的延迟抖动, 单位毫秒
+        :param error_rate: 各类别接口的错误率, 0 ~ 1
+        :param seed: 随机数种子
+        :param capacity: 各类别接口同时处理的请求数上限, 超出时返回 429, 0 表示不限制
+        """
+        super().__init__(address, FakeHandler)
+        self.latency = latency or {'default': 0}
+        self.jitter = jitter or {'default': 0}
+        self.error_rate = error_rate or {'default': 0}
+        self.random = random.Random(seed)
+        self.capacity = capacity or {'default': 0}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        self.github_key = public.PrivateKey.generate().public_key.encode(encoding.Base64Encoder).decode()
+
+    def option(self, spec: dict, kind: str) -> float:
+        return spec.get(kind, spec['default'])
+
+    def delay(self, kind: str) -> float:
+        """
+        计算本次请求的延迟
+
+        :param kind: 接口类别
+        :return: 延迟, 单位秒
+        """
+        latency = self.option(self.latency, kind)
+        jitter = self.option(self.jitter, kind)
+        return max(latency + self.random.uniform(-jitter, jitter), 0) / 1000
+
+    def should_fail(self, kind: str) -> bool:
+        return self.random.random() < self.option(self.error_rate, kind)
+
+    def enter(self, kind: str) -> bool:
+        """
+        开始处理请求, 超出并发容量时不计入
+
+        :param kind: 接口类别
+        :return: 未超出容量返回 True, 之后需调用 leave
+        """
+        capacity = self.option(self.capacity, kind)
+
+        with self.lock:
+            if capacity and self.in_flight.get(kind, 0) >= capacity:
+                return False
+
+            self.in_flight[kind] = self.in_flight.get(kind, 0) + 1
+            return True
+
+    def leave(self, kind: str) -> NoReturn:
+        with self.lock:
+            self.in_flight[kind] -= 1
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: FakeServer
+
+    def log_message(self, format, *args) -> NoReturn:
+        pass
+
+    def do_GET(self) -> NoReturn:
+        self.handle_request()
+
+    def do_POST(self) -> NoReturn:
+        self.handle_request()
+
+    def do_PUT(self) -> NoReturn:
+        self.handle_request()
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+    def reply(self, status: int, data: Optional[dict] = None) -> NoReturn:
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self) -> NoReturn:
+        _, host, path = self.path.split('/', 2)
+        path = '/' + path.split('?', 1)[0]
+        kind = endpoint_kind(host)
+        body = self.read_body()
+
+        if not self.server.enter(kind):
+            return self.reply(429, {'code': 'TooManyRequests', 'message': 'capacity exceeded'})
+
+        try:
+            time.sleep(self.server.delay(kind))
+        finally:
+            self.server.leave(kind)
+
+        if self.server.should_fail(kind):
+            return self.reply_error(kind)
+
+        if kind == 'auth':
+            return self.reply_token(body)
+        if kind == 'member':
+            return self.reply_sign_in()
+        if kind == 'github':
+            return self.reply_github(path)
+
+        # PushPlus 成功时 code 为 200, 其他渠道为 0
+        code = 200 if host == 'www.pushplus.plus' else 0
+        return self.reply(200, {'code': code, 'errno': 0, 'errcode': 0, 'ok': True, 'message': 'success'})
+
+    def reply_error(self, kind: str) -> NoReturn:
+        if kind == 'auth':
+            return self.reply(400, {
+                'code': 'InvalidParameter.RefreshToken',
+                'message': 'The input parameter refresh_token is not valid.',
+            })
+
+        return self.reply(500, {'code': 'InternalError', 'message': 'injected error'})
+
+    def reply_token(self, body: dict) -> NoReturn:
+        refresh_token = body.get('refresh_token') or ''
+        account = refresh_token.split('.', 1)[0]
+        n = next(self.server.counter)
+
+        self.reply(200, {
+            'access_token': f'at-{account}-{n}',
+            'refresh_token': f'{account}.{n:08d}',
+            'user_name': account,
+            'expires_in': 7200,
+            'token_type': 'Bearer',
+        })
+
+    def reply_sign_in(self) -> NoReturn:
+        count = self.server.random.randint(1, 28)
+        logs = [
+            {
+                'day': i + 1,
+                'status': 'normal' if i < count else 'miss',
+                'isReward': i % 2 == 0,
+                'reward': {'name': '模拟奖励', 'description': f'第 {i + 1} 天'},
+            }
+            for i in range(31)
+        ]
+
+        self.reply(200, {
+            'success': True,
+            'code': None,
+            'result': {
+                'signInCount': count,
+                'signInLogs': logs,
+            },
+        })
+
+    def reply_github(self, path: str) -> NoReturn:
+        if path.endswith('/public-key'):
+            return self.reply(200, {'key_id': '0123456789', 'key': self.server.github_key})
+
+        self.reply(204)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='阿里云盘签到本地模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', default='0', help='平均延迟 (毫秒), 如 50 或 50,member=120')
+    parser.add_argument('--jitter', default='0', help='延迟抖动 (毫秒), 格式同 --latency')
+    parser.add_argument('--error-rate', default='0', help='错误率 (0 ~ 1), 格式同 --latency')
+    parser.add_argument('--capacity', default='0', help='并发容量, 超出时返回 429, 格式同 --latency')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeServer(
+        (args.host, args.port),
+        latency=parse_spec(args.latency),
+        jitter=parse_spec(args.jitter),
+        error_rate=parse_spec(args.error_rate),
+        seed=args.seed,
+        capacity=parse_spec(args.capacity, int),
+    )
+    print(f'模拟服务已启动: http://{args.host}:{server.server_address[1]}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+    @Description: 本地 JSON 缓存, 带过期时间
+"""
+
+from typing import NoReturn, Optional
+import json
+import logging
+import threading
+import time
+
+from utils import atomic_write
+
+
+class JsonCache:
+    """
+    基于 JSON 文件的键值缓存, 每个条目带过期时间戳
+    """
+
+    def __init__(self, path: str):
+        """
+        初始化, 读取已有缓存文件
+
+        :param path: 缓存文件路径
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.data = self.__load()
+        self.dirty = False
+
+    def __load(self) -> dict:
+        """
+        读取缓存文件, 文件不存在或损坏时返回空缓存
+
+        :return: 缓存数据
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f'读取缓存文件 {self.path} 失败, 将重新生成: {e}')
+            return {}
+
+        return data if isinstance(data, dict) else {}
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        获取未过期的缓存条目
+
+        :param key: 缓存键
+        :return: 缓存值, 不存在或已过期返回 None
+        """
+        with self.lock:
+            entry = self.data.get(key)
+
+            if not entry:
+                return None
+
+            if entry.get('expires_at', 0) <= time.time():
+                return None
+
+            return entry['value']
+
+    def set(self, key: str, value: dict, ttl: float) -> NoReturn:
+        """
+        写入缓存条目
+
+        :param key: 缓存键
+        :param value: 缓存值, 需可 JSON 序列化
+        :param ttl: 有效期, 单位秒
+        :return:
+        """
+        with self.lock:
+            self.data[key] = {
+                'value': value,
+                'expires_at': time.time() + ttl,
+            }
+            self.dirty = True
+
+    def delete(self, key: str) -> NoReturn:
+        """
+        删除缓存条目
+
+        :param key: 缓存键
+        :return:
+        """
+        with self.lock:
+            if self.data.pop(key, None) is not None:
+                self.dirty = True
+
+    def save(self) -> NoReturn:
+        """
+        写回缓存文件, 丢弃已过期条目. 先写临时文件再替换, 避免中断导致文件损坏
+
+        :return:
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+
+            now = time.time()
+            self.data = {
+                k: v
+                for k, v in self.data.items()
+                if v.get('expires_at', 0) > now
+            }
+
+            try:
+                with atomic_write(self.path) as f:
+                    json.dump(self.data, f, ensure_ascii=False)
+            except OSError as e:
+                logging.warning(f'写入缓存文件 {self.path} 失败: {e}')
+                return
+
+            self.dirty = False
+
+
+class TokenCache(JsonCache):
+    """
+    access token 缓存, 按账号 (user_name) 存储, 可通过当前 refresh token 查找
+    """
+
+    # 提前失效的时间, 避免使用即将过期的 access token
+    EXPIRY_MARGIN = 300
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.index = {
+            entry['value']['refresh_token']: user
+            for user, entry in self.data.items()
+            if entry.get('value', {}).get('refresh_token')
+        }
+
+    def find(self, refresh_token: str) -> Optional[dict]:
+        """
+        通过 refresh token 查找未过期的 access token
+
+        :param refresh_token: 当前使用的 refresh token
+        :return: 包含 user_name, access_token, refresh_token 的字典, 未命中返回 None
+        """
+        with self.lock:
+            user = self.index.get(refresh_token)
+
+            if not user:
+                return None
+
+            value = self.get(user)
+
+            if not value or value['refresh_token'] != refresh_token:
+                return None
+
+            return {'user_name': user, **value}
+
+    def put(
+            self,
+            user: str,
+            access_token: str,
+            refresh_token: str,
+            expires_in: float,
+    ) -> NoReturn:
+        """
+        缓存 access token
+
+        :param user: 账号, 即 user_name
+        :param access_token: access token
+        :param refresh_token: 与 access token 一同下发的 refresh token
+        :param expires_in: access token 有效期, 单位秒
+        :return:
+        """
+        with self.lock:
+            old = self.data.get(user, {}).get('value', {}).get('refresh_token')
+            if old:
+                self.index.pop(old, None)
+
+            self.set(
+                user,
+                {
+                    'access_token': access_token,
+                    'refresh_token': refresh_token,
+                },
+                max(expires_in - self.EXPIRY_MARGIN, 0),
+            )
+            self.index[refresh_token] = user
+
+    def invalidate(self, user: str) -> NoReturn:
+        """
+        使账号的缓存失效
+
+        :param user: 账号, 即 user_name
+        :return:
+        """
+        with self.lock:
+            old = self.data.get(user, {}).get('value', {}).get('refresh_token')
+            if old:
+                self.index.pop(old, None)
+            self.delete(user)
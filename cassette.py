@@ -0,0 +1,297 @@
+"""
+    @Description: HTTP 请求录制及回放, 用于离线复现真实运行并比较各阶段耗时
+"""
+
+from collections import deque
+from datetime import timedelta
+from hashlib import sha256
+from typing import NoReturn, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import gzip
+import json
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+import session
+
+VERSION = 1
+
+# 请求及响应 JSON 中需要脱敏的字段, 值替换为哈希占位符, 同一值的占位符相同
+SECRET_FIELDS = {
+    'refresh_token', 'access_token', 'accessToken', 'refreshToken',
+    'user_name', 'nick_name', 'phone', 'user_id', 'default_drive_id',
+    'appKey', 'appSecret', 'robotCode', 'userIds',
+    'token', 'sendkey', 'pushkey', 'chat_id', 'password', 'encrypted_value',
+}
+
+# 请求中的推送内容, 仅保留长度
+MESSAGE_FIELDS = {'text', 'desp', 'content', 'msgParam', 'title'}
+
+# 保留的响应头, 其余丢弃
+RESPONSE_HEADERS = ['Content-Type', 'Retry-After']
+
+# URL 路径中的长 token, 如 Telegram 的 bot token 及 Server 酱的 SendKey
+PATH_TOKEN = re.compile(r'[A-Za-z0-9_\-:]{24,}')
+
+
+def mask(value) -> str:
+    return f'redacted-{sha256(str(value).encode("utf-8")).hexdigest()[:12]}'
+
+
+def redact(data, message: bool = False):
+    """
+    脱敏 JSON 或表单数据
+
+    :param data: 数据
+    :param message: 是否同时省略推送内容, 用于请求
+    :return: 脱敏后的数据
+    """
+    if isinstance(data, list):
+        return [redact(i, message) for i in data]
+
+    if not isinstance(data, dict):
+        return data
+
+    redacted = {}
+
+    for key, value in data.items():
+        if key in SECRET_FIELDS and value not in (None, ''):
+            redacted[key] = [mask(i) for i in value] if isinstance(value, list) else mask(value)
+        elif message and key in MESSAGE_FIELDS and isinstance(value, str):
+            redacted[key] = f'<{len(value)} chars>'
+        else:
+            redacted[key] = redact(value, message)
+
+    return redacted
+
+
+def redact_url(url: str) -> str:
+    """
+    脱敏 URL, 替换路径中的长 token 及所有查询参数的值
+
+    :param url: 请求地址
+    :return: 脱敏后的地址
+    """
+    parts = urlsplit(url)
+    path = PATH_TOKEN.sub(lambda m: mask(m.group(0)), parts.path)
+    query = urlencode([(k, mask(v)) for k, v in parse_qsl(parts.query)])
+    return urlunsplit((parts.scheme, parts.netloc, path, query, ''))
+
+
+def parse_body(body: Optional[bytes | str], content_type: str = ''):
+    """
+    解析请求或响应体, 依次尝试 JSON 及表单格式
+
+    :param body: 原始内容
+    :param content_type: Content-Type
+    :return: 解析结果, 无法解析时返回字符串
+    """
+    if not body:
+        return None
+
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        pass
+
+    if 'x-www-form-urlencoded' in content_type:
+        return dict(parse_qsl(body))
+
+    return body
+
+
+class Cassette:
+    """
+    录制的请求序列, 以 JSON Lines 格式保存, 路径以 .gz 结尾时压缩. 首行为文件信息, 之后每行一个请求
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.perf_counter()
+        self.interactions: list[dict] = []
+        self.queues: Optional[dict[tuple[str, str], deque]] = None
+        self.lock = threading.Lock()
+
+    def take(self, method: str, url: str) -> Optional[dict]:
+        """
+        回放时取出下一个匹配的请求, 同一 (方法, URL) 按录制顺序返回, 多个会话共享进度
+
+        :param method: 请求方法
+        :param url: 脱敏后的请求地址
+        :return: 录制的请求, 没有剩余时返回 None
+        """
+        with self.lock:
+            if self.queues is None:
+                self.queues = {}
+
+                for interaction in self.interactions:
+                    self.queues.setdefault((interaction['method'], interaction['url']), deque()).append(interaction)
+
+            queue = self.queues.get((method, url))
+            return queue.popleft() if queue else None
+
+    def remaining(self) -> int:
+        with self.lock:
+            if self.queues is None:
+                return len(self.interactions)
+
+            return sum(len(queue) for queue in self.queues.values())
+
+    def add(self, interaction: dict) -> NoReturn:
+        with self.lock:
+            self.interactions.append(interaction)
+
+    def offset(self) -> float:
+        return time.perf_counter() - self.started
+
+    def save(self) -> NoReturn:
+        """
+        写入文件
+
+        :return:
+        """
+        with self.lock:
+            interactions = sorted(self.interactions, key=lambda i: i['offset'])
+
+        with (gzip.open if self.path.endswith('.gz') else open)(self.path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({'version': VERSION, 'recorded_at': time.time(), 'count': len(interactions)}) + '\n')
+
+            for interaction in interactions:
+                f.write(json.dumps(interaction, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    @classmethod
+    def load(cls, path: str) -> 'Cassette':
+        """
+        读取文件
+
+        :param path: 文件路径
+        :return: Cassette
+        :raises ValueError: 文件版本不支持
+        """
+        cassette = cls(path)
+
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+
+            if header.get('version') != VERSION:
+                raise ValueError(f'不支持的 cassette 版本: {header.get("version")}')
+
+            cassette.interactions = [json.loads(line) for line in f if line.strip()]
+
+        return cassette
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    正常发送请求, 同时将脱敏后的请求及响应记录到 cassette
+    """
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        offset = self.cassette.offset()
+        start = time.perf_counter()
+        interaction = {
+            'offset': round(offset, 6),
+            'method': request.method,
+            'url': redact_url(request.url),
+            'request': redact(parse_body(request.body, request.headers.get('Content-Type', '')), True),
+        }
+
+        try:
+            resp = super().send(request, **kwargs)
+        except requests.RequestException as e:
+            self.cassette.add({
+                **interaction,
+                'elapsed': round(time.perf_counter() - start, 6),
+                'error': type(e).__name__,
+                'message': PATH_TOKEN.sub(lambda m: mask(m.group(0)), str(e)),
+            })
+            raise
+
+        # 读取响应体, 计入耗时
+        content = resp.content
+        body = parse_body(content)
+        self.cassette.add({
+            **interaction,
+            'elapsed': round(time.perf_counter() - start, 6),
+            'status': resp.status_code,
+            'headers': {k: resp.headers[k] for k in RESPONSE_HEADERS if k in resp.headers},
+            **({'body': redact(body)} if not isinstance(body, str) else {'text': body}),
+        })
+        return resp
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    不访问网络, 按 (方法, 脱敏后的 URL) 依次返回 cassette 中的响应.
+    speed 为回放速度倍数, 1 为按录制时的耗时等待, 0 为不等待
+    """
+
+    def __init__(self, cassette: Cassette, speed: float = 1, **kwargs):
+        self.cassette = cassette
+        self.speed = speed
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = redact_url(request.url)
+        interaction = self.cassette.take(request.method, url)
+
+        if interaction is None:
+            raise requests.ConnectionError(f'cassette 中没有与 {request.method} {url} 匹配的请求', request=request)
+
+        if self.speed > 0:
+            time.sleep(interaction['elapsed'] / self.speed)
+
+        if 'error' in interaction:
+            error = getattr(requests.exceptions, interaction['error'], requests.ConnectionError)
+            raise error(interaction['message'], request=request)
+
+        resp = requests.Response()
+        resp.status_code = interaction['status']
+        resp.headers = CaseInsensitiveDict(interaction.get('headers') or {})
+        resp.encoding = 'utf-8'
+        resp._content = (
+            json.dumps(interaction['body'], ensure_ascii=False).encode('utf-8')
+            if 'body' in interaction
+            else (interaction.get('text') or '').encode('utf-8')
+        )
+        resp.url = request.url
+        resp.request = request
+        resp.elapsed = timedelta(seconds=interaction['elapsed'])
+        return resp
+
+
+def record(path: str) -> Cassette:
+    """
+    此后新建的会话录制所有请求, 结束时需调用 Cassette.save
+
+    :param path: cassette 文件路径
+    :return: Cassette
+    """
+    cassette = Cassette(path)
+    session.set_transport(lambda **kwargs: RecordingAdapter(cassette, **kwargs))
+    return cassette
+
+
+def replay(path: str, speed: float = 1) -> Cassette:
+    """
+    此后新建的会话从 cassette 回放响应, 不访问网络
+
+    :param path: cassette 文件路径
+    :param speed: 回放速度倍数, 0 为不等待
+    :return: Cassette
+    """
+    cassette = Cassette.load(path)
+    session.set_transport(lambda **kwargs: ReplayAdapter(cassette, speed, **kwargs))
+    return cassette
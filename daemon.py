@@ -0,0 +1,231 @@
+"""
+    @Description: 常驻进程模式, 每日定时签到, 每个账号在开始时间后随机分散签到
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, NoReturn, Optional
+import logging
+import random
+import signal
+import threading
+import time
+
+from configobj import ConfigObj
+
+from state import SIGNIN_TIMEZONE
+
+
+class Daemon:
+    """
+    常驻进程调度器. 收到 SIGHUP 时重新加载配置, 收到 SIGTERM / SIGINT 时等待当前批次完成后退出
+    """
+
+    def __init__(
+            self,
+            load_config: Callable[[], Optional[ConfigObj]],
+            get_accounts: Callable[[ConfigObj], Optional[list[str]]],
+            sign_in: Callable[[ConfigObj, list[str]], list[dict]],
+            finish: Callable[[ConfigObj, list[str], list[dict]], NoReturn],
+            run_all: Callable[[ConfigObj], NoReturn],
+            on_reload: Optional[Callable[[ConfigObj, ConfigObj], NoReturn]] = None,
+    ):
+        """
+        初始化
+
+        :param load_config: 加载配置, 失败返回 None
+        :param get_accounts: 获取当日需要签到的 refresh token 列表, 返回 None 表示不按账号分散, 由 run_all 整体运行
+        :param sign_in: 对一批账号签到, 返回签到结果
+        :param finish: 当日签到结束后推送并回写 refresh token, 参数为配置, 已签到的账号及结果
+        :param run_all: 整体运行一次签到
+        :param on_reload: 配置重新加载后调用, 参数为原配置及新配置, 用于按新配置重新初始化
+        """
+        self.load_config = load_config
+        self.get_accounts = get_accounts
+        self.sign_in = sign_in
+        self.finish = finish
+        self.run_all = run_all
+        self.on_reload = on_reload
+        self.config: Optional[ConfigObj] = None
+        self.stopping = threading.Event()
+        self.reloading = threading.Event()
+        self.wakeup = threading.Event()
+
+    def install_signals(self) -> NoReturn:
+        """
+        注册信号处理
+
+        :return:
+        """
+        def stop(signum, frame):
+            logging.info(f'收到信号 {signal.Signals(signum).name}, 当前批次完成后退出.')
+            self.stopping.set()
+            self.wakeup.set()
+
+        def reload(signum, frame):
+            logging.info('收到 SIGHUP, 重新加载配置.')
+            self.reloading.set()
+            self.wakeup.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, reload)
+
+    def reload(self) -> NoReturn:
+        """
+        重新加载配置, 加载失败时继续使用原配置
+
+        :return:
+        """
+        self.reloading.clear()
+        config = self.load_config()
+
+        if not config:
+            logging.error('重新加载配置失败, 继续使用原配置.')
+            return
+
+        previous, self.config = self.config, config
+        logging.info('配置已重新加载.')
+
+        if self.on_reload:
+            try:
+                self.on_reload(previous, config)
+            except Exception as e:
+                logging.exception(f'按新配置重新初始化失败: {e}')
+
+    def wait(self, until: float) -> str:
+        """
+        等待到指定时间, 可被信号打断
+
+        :param until: 目标时间戳
+        :return: due 表示已到达, reload 表示需要重新加载配置, stop 表示需要退出
+        """
+        while True:
+            if self.stopping.is_set():
+                return 'stop'
+
+            if self.reloading.is_set():
+                return 'reload'
+
+            remaining = until - time.time()
+
+            if remaining <= 0:
+                return 'due'
+
+            self.wakeup.wait(remaining)
+            self.wakeup.clear()
+
+    def start_time(self, day: datetime) -> datetime:
+        """
+        获取指定日期的签到开始时间
+
+        :param day: 日期, 北京时间
+        :return: 开始时间
+        """
+        value = str(self.config.get('daemon_time') or '08:00')
+
+        try:
+            hour, minute = (int(i) for i in value.split(':', 1))
+        except ValueError:
+            logging.warning(f'daemon_time 配置无效: {value}, 使用默认值 08:00.')
+            hour, minute = 8, 0
+
+        return day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    def spread(self) -> float:
+        try:
+            return max(float(self.config.get('daemon_spread') or 0), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def run_day(self, start: datetime) -> NoReturn:
+        """
+        执行一天的签到, 每个账号在开始时间后的 daemon_spread 秒内随机签到, 到期的账号按批次并发签到
+
+        :param start: 开始时间
+        :return:
+        """
+        accounts = self.get_accounts(self.config)
+
+        if accounts is None:
+            self.run_all(self.config)
+            return
+
+        start_ts = start.timestamp()
+        spread = self.spread()
+        plan = sorted(
+            (start_ts + random.uniform(0, spread), token)
+            for token in accounts
+        )
+        logging.info(f'今日共 {len(plan)} 个账号, 将在 {spread:.0f} 秒内分散签到.')
+
+        done = []
+        results = []
+        i = 0
+
+        while i < len(plan):
+            status = self.wait(plan[i][0])
+
+            if status == 'stop':
+                break
+
+            if status == 'reload':
+                self.reload()
+                continue
+
+            now = time.time()
+            batch = [token for due, token in plan[i:] if due <= now]
+            i += len(batch)
+
+            # 单个批次异常时跳过该批次, 已完成的账号仍在当日结束时推送并回写
+            try:
+                results += self.sign_in(self.config, batch)
+                done += batch
+            except Exception as e:
+                logging.exception(f'{len(batch)} 个账号签到异常, 已跳过: {e}')
+
+        if done:
+            self.finish(self.config, done, results)
+
+    def run(self) -> NoReturn:
+        """
+        运行常驻进程, 启动时若已过当日开始时间则立即补签
+
+        :return:
+        """
+        self.install_signals()
+        self.config = self.load_config()
+
+        if not self.config:
+            logging.error('获取配置失败.')
+            return
+
+        logging.info('常驻模式已启动.')
+        catch_up = True
+
+        while not self.stopping.is_set():
+            now = datetime.now(SIGNIN_TIMEZONE)
+            start = self.start_time(now)
+
+            if start <= now:
+                start = now if catch_up else self.start_time(now + timedelta(days=1))
+
+            catch_up = False
+            logging.info(f'下次签到时间: {start.isoformat(timespec="seconds")}')
+            status = self.wait(start.timestamp())
+
+            if status == 'stop':
+                break
+
+            if status == 'reload':
+                self.reload()
+                continue
+
+            # 当日签到异常时记录后继续调度, 不退出常驻进程
+            try:
+                self.run_day(start)
+            except Exception as e:
+                logging.exception(f'今日签到异常: {e}')
+
+        logging.info('常驻模式已退出.')
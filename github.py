@@ -1,11 +1,21 @@
 from os import environ
 from base64 import b64encode
+from hashlib import sha256
 import logging
-from typing import NoReturn
+from typing import NoReturn, Optional
 
 import requests
 from nacl import encoding, public
 
+from cache import JsonCache
+from session import get_session
+
+# 公钥缓存有效期, 公钥轮换后 PUT 失败时会重新获取
+PUB_KEY_TTL = 86400
+
+# 已写入 secret 摘要的有效期
+DIGEST_TTL = 30 * 86400
+
 
 def encrypt(public_key, secret_value) -> str:
     """
@@ -21,44 +31,128 @@ def encrypt(public_key, secret_value) -> str:
     return b64encode(encrypted).decode("utf-8")
 
 
-def get_pub_key(repos: str, token: str) -> tuple[str, int]:
-    url = 'https://api.github.com/repos/{}/actions/secrets/public-key'.format(repos)
-    headers = {
+def digest(value: str) -> str:
+    return sha256(value.encode('utf-8')).hexdigest()
+
+
+def get_headers(token: str) -> dict:
+    return {
         'Accept': 'application/vnd.github+json',
         'Authorization': 'Bearer {}'.format(token),
         'X-GitHub-Api-Version': '2022-11-28'
     }
 
-    r = requests.get(url, headers=headers)
-    return r.json()['key'], r.json()['key_id']
 
+def get_pub_key(
+        repos: str,
+        token: str,
+        session: Optional[requests.Session] = None,
+) -> tuple[str, int]:
+    url = 'https://api.github.com/repos/{}/actions/secrets/public-key'.format(repos)
+
+    r = (session or get_session()).get(url, headers=get_headers(token))
+    data = r.json()
+    return data['key'], data['key_id']
 
-def update_secret(name: str, value: str) -> NoReturn:
+
+def update_secrets(
+        secrets: dict[str, str],
+        session: Optional[requests.Session] = None,
+        current: Optional[dict[str, str]] = None,
+        cache: Optional[JsonCache] = None,
+) -> dict[str, bool]:
     """
-    更新 secret
+    批量更新 secret, 共用同一个会话和公钥. 值未变化的 secret 不会重复写入
 
-    :param name: secret 名称
-    :param value: secret 值
-    :return:
+    :param secrets: secret 名称到值的映射
+    :param session: HTTP 会话, 默认使用共享会话
+    :param current: 已知的 secret 当前值, 如 Action 传入的环境变量, 与新值相同时跳过
+    :param cache: 公钥及已写入值摘要的缓存, 默认使用 GITHUB_CACHE 指定的文件, 为空时不缓存
+    :return: secret 名称到是否写入的映射, 跳过或失败为 False
     """
     repos = environ['GITHUB_REPOS']
     token = environ['GP_TOKEN']
+    written = {name: False for name in secrets}
 
     if not token:
-        logging.error('未配置 GP_TOKEN, 更新 refresh_tokens 失败')
-        return
+        logging.error('未配置 GP_TOKEN, 更新 secret 失败')
+        return written
 
-    key, key_id = get_pub_key(repos, token)
+    if cache is None and environ.get('GITHUB_CACHE', 'github_cache.json'):
+        cache = JsonCache(environ.get('GITHUB_CACHE', 'github_cache.json'))
 
-    url = 'https://api.github.com/repos/{}/actions/secrets/{}'.format(repos, name)
-    headers = {
-        'Accept': 'application/vnd.github+json',
-        'Authorization': 'Bearer {}'.format(token),
-        'X-GitHub-Api-Version': '2022-11-28'
-    }
-    payload = {
-        'encrypted_value': encrypt(key, value),
-        'key_id': key_id
-    }
+    current = current or {}
+    changed = {}
+
+    for name, value in secrets.items():
+        value_digest = digest(value)
+
+        if (
+                current.get(name) == value
+                or (cache and (cache.get(f'digest:{repos}:{name}') or {}).get('digest') == value_digest)
+        ):
+            logging.info(f'{name} 未变化, 跳过更新')
+            continue
+
+        changed[name] = value
 
-    requests.put(url, headers=headers, json=payload)
+    if not changed:
+        return written
+
+    session = session or get_session()
+    headers = get_headers(token)
+    pub_key = cache.get(f'public_key:{repos}') if cache else None
+
+    for name, value in changed.items():
+        url = 'https://api.github.com/repos/{}/actions/secrets/{}'.format(repos, name)
+
+        for attempt in range(2):
+            if not pub_key:
+                key, key_id = get_pub_key(repos, token, session)
+                pub_key = {'key': key, 'key_id': key_id}
+
+                if cache:
+                    cache.set(f'public_key:{repos}', pub_key, PUB_KEY_TTL)
+
+            payload = {
+                'encrypted_value': encrypt(pub_key['key'], value),
+                'key_id': pub_key['key_id']
+            }
+            r = session.put(url, headers=headers, json=payload)
+
+            if r.status_code in (201, 204):
+                written[name] = True
+                break
+
+            # 缓存的公钥可能已轮换, 重新获取后重试一次
+            if attempt or not cache:
+                logging.error(f'更新 {name} 失败, HTTP {r.status_code}: {r.text}')
+                break
+
+            pub_key = None
+            cache.delete(f'public_key:{repos}')
+
+        if written[name] and cache:
+            cache.set(f'digest:{repos}:{name}', {'digest': digest(value)}, DIGEST_TTL)
+
+    if cache:
+        cache.save()
+
+    return written
+
+
+def update_secret(
+        name: str,
+        value: str,
+        session: Optional[requests.Session] = None,
+) -> NoReturn:
+    """
+    更新 secret, 与 Action 传入的同名环境变量相同时跳过
+
+    :param name: secret 名称
+    :param value: secret 值
+    :param session: HTTP 会话, 默认使用共享会话
+    :return:
+    """
+    current = {name: environ[name]} if name in environ else None
+    update_secrets({name: value}, session, current)
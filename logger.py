@@ -0,0 +1,160 @@
+"""
+    @Description: 日志系统, 日志记录写入队列后由单独的线程输出, 签到线程不阻塞在文件 I/O 上
+"""
+
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import NoReturn, Optional
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s: %(message)s'
+
+# 结构化日志中附加的字段, 通过 extra 传入
+FIELDS = ('account', 'phase', 'latency', 'target', 'outcome')
+
+# 耗时记录使用的 logger, 即 metrics 模块的 logger, 仅在启用结构化日志时输出
+METRICS_LOGGER = 'metrics'
+
+_handler: Optional[QueueHandler] = None
+_listener: Optional[QueueListener] = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出为一行 JSON
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                    + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+
+        for field in FIELDS:
+            value = getattr(record, field, None)
+
+            if value is not None:
+                data[field] = round(value, 6) if field == 'latency' else value
+
+        return json.dumps(data, ensure_ascii=False)
+
+
+def get_file_handler(
+        path: str,
+        max_bytes: int = 0,
+        backup_count: int = 0,
+        when: Optional[str] = None,
+) -> logging.FileHandler:
+    """
+    创建日志文件 handler, 按配置滚动
+
+    :param path: 日志文件路径
+    :param max_bytes: 按大小滚动的阈值, 单位字节, 0 表示不按大小滚动
+    :param backup_count: 保留的历史文件数
+    :param when: 按时间滚动的周期, 同 TimedRotatingFileHandler, 如 midnight, 优先于按大小滚动
+    :return: handler
+    """
+    if when:
+        return TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding='utf-8')
+
+    if max_bytes:
+        return RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+
+    return logging.FileHandler(path, mode='a', encoding='utf-8')
+
+
+def init(
+        path: Optional[str] = 'aliyun_auto_signin.log',
+        json_path: Optional[str] = None,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        when: Optional[str] = None,
+        level: int = logging.INFO,
+) -> NoReturn:
+    """
+    初始化日志系统. 根 logger 上只挂载一个 QueueHandler, 控制台及文件输出由 QueueListener 的线程完成.
+    重复调用时替换此前的配置, 不会重复输出
+
+    :param path: 日志文件路径, 为空时不写入文件
+    :param json_path: 结构化日志文件路径, 每行一个 JSON 对象, 包含账号, 阶段及耗时等字段, 为空时不写入
+    :param max_bytes: 按大小滚动的阈值, 单位字节, 0 表示不按大小滚动
+    :param backup_count: 保留的历史文件数
+    :param when: 按时间滚动的周期, 如 midnight, 为空时按大小滚动
+    :param level: 日志级别
+    :return:
+    """
+    global _handler, _listener
+
+    log_format = logging.Formatter(LOG_FORMAT)
+    handlers = []
+
+    # Console
+    ch = logging.StreamHandler()
+    ch.setLevel(level)
+    ch.setFormatter(log_format)
+    handlers.append(ch)
+
+    # Log file
+    if path:
+        fh = get_file_handler(path, max_bytes, backup_count, when)
+        fh.setLevel(level)
+        fh.setFormatter(log_format)
+        handlers.append(fh)
+
+    # 结构化日志, 额外包含 DEBUG 级别的耗时记录
+    if json_path:
+        jh = get_file_handler(json_path, max_bytes, backup_count, when)
+        jh.setLevel(logging.DEBUG)
+        jh.setFormatter(JsonFormatter())
+        handlers.append(jh)
+
+    with _lock:
+        shutdown()
+
+        log_queue = queue.SimpleQueue()
+        _handler = QueueHandler(log_queue)
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+        log = logging.getLogger()
+        log.setLevel(level)
+        log.addHandler(_handler)
+
+        # 耗时记录为 DEBUG 级别, 未启用结构化日志时在产生处即被丢弃
+        logging.getLogger(METRICS_LOGGER).setLevel(logging.DEBUG if json_path else logging.INFO)
+
+
+def shutdown() -> NoReturn:
+    """
+    输出队列中剩余的日志并关闭文件
+
+    :return:
+    """
+    global _handler, _listener
+
+    if _handler:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+    if _listener:
+        _listener.stop()
+
+        for handler in _listener.handlers:
+            handler.close()
+
+        _listener = None
+
+
+# 进程退出前输出队列中剩余的日志
+atexit.register(shutdown)
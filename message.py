@@ -0,0 +1,166 @@
+"""
+    @Description: 推送消息组装, 按渠道长度限制精简及分页
+"""
+
+from typing import Callable, Iterable, Optional
+
+from records import SignInResult
+
+# 推送内容由若干段组成, 段之间以空行分隔, 第一段为统计
+BLOCK_SEPARATOR = '\n\n'
+
+
+def summarize(success: int, failure: int, quarantined: Optional[list[str]] = None) -> str:
+    """
+    生成统计
+
+    :param success: 成功账号数
+    :param failure: 失败账号数
+    :param quarantined: 本次新隔离的账号, 附加在统计之后
+    :return: 统计
+    """
+    summary = f'签到完成, 成功 {success} 个, 失败 {failure} 个.'
+
+    if quarantined:
+        summary += (
+            f'\n{len(quarantined)} 个账号的 refresh token 已失效并被隔离, 此后不再签到: {", ".join(quarantined)}.'
+            f'\n更新 refresh token 或使用 --reactivate 解除隔离.'
+        )
+
+    return summary
+
+
+def compose(
+        results: list[SignInResult],
+        formats: Iterable[str] = ('text', 'html'),
+        summary: Optional[str] = None,
+        quarantined: Optional[list[str]] = None,
+) -> tuple[str, str]:
+    """
+    组装推送内容, 统计在前, 之后为每个账号的签到结果. 只生成 formats 中的格式, 其余格式为空字符串
+
+    :param results: 签到结果列表
+    :param formats: 需要生成的格式, 即已配置渠道使用的格式
+    :param summary: 统计, 默认按 results 统计
+    :param quarantined: 本次新隔离的账号, 仅在按 results 统计时使用
+    :return: 推送内容及 HTML 格式推送内容
+    """
+    if summary is None:
+        success = sum(1 for i in results if i.success)
+        summary = summarize(success, len(results) - success, quarantined)
+
+    return tuple(
+        BLOCK_SEPARATOR.join([summary, *[i.render(fmt) for i in results]]) if fmt in formats else ''
+        for fmt in ('text', 'html')
+    )
+
+
+def truncate(block: str, limit: int, html: bool = False) -> str:
+    """
+    截断超长的段
+
+    :param block: 段内容
+    :param limit: 最大长度
+    :param html: 是否为 HTML 格式, 为 True 时补全被截断的 code 标签
+    :return: 截断后的内容
+    """
+    if len(block) <= limit:
+        return block
+
+    suffix = '...' + ('</code>' if html else '')
+    block = block[:max(limit - len(suffix), 0)]
+
+    if html and block.count('<code>') <= block.count('</code>'):
+        suffix = '...'
+
+    return block + suffix
+
+
+def pack(blocks: list[str], limit: int) -> list[list[int]]:
+    """
+    按顺序将段装入尽量少的页, 每页长度不超过 limit
+
+    :param blocks: 段列表, 每段长度不超过 limit
+    :param limit: 每页最大长度
+    :return: 每页包含的段下标
+    """
+    pages = []
+    page = []
+    size = 0
+
+    for i, block in enumerate(blocks):
+        extra = len(block) + (len(BLOCK_SEPARATOR) if page else 0)
+
+        if page and size + extra > limit:
+            pages.append(page)
+            page, size, extra = [], 0, len(block)
+
+        page.append(i)
+        size += extra
+
+    if page:
+        pages.append(page)
+
+    return pages
+
+
+def paginate(
+        content: str,
+        content_html: str,
+        limit: Optional[int],
+        html: bool = False,
+        omit: Optional[Callable[[], tuple[set[str], set[str]]]] = None,
+) -> list[tuple[str, str]]:
+    """
+    按渠道长度限制拆分推送内容. 内容未超出限制时原样返回;
+    超出时先省略成功账号的详情, 仅保留统计及失败账号, 仍超出时分页. 分页标记由调用方加在标题中
+
+    :param content: 推送内容
+    :param content_html: 推送内容, HTML 格式
+    :param limit: 渠道单条消息的最大长度, 为空时不限制
+    :param html: 渠道是否使用 HTML 格式, 决定按哪种格式计算长度
+    :param omit: 返回可省略的段的函数, 即成功账号的推送内容及 HTML 格式推送内容, 仅在超出限制时调用
+    :return: 每页的推送内容及 HTML 格式推送内容
+    """
+    if not limit or len(content_html if html else content) <= limit:
+        return [(content, content_html)]
+
+    blocks = content.split(BLOCK_SEPARATOR)
+    blocks_html = content_html.split(BLOCK_SEPARATOR)
+
+    # 未生成的格式按另一种格式的段数补齐
+    if not content:
+        blocks = [''] * len(blocks_html)
+    elif not content_html:
+        blocks_html = [''] * len(blocks)
+
+    if len(blocks) != len(blocks_html):
+        # 两种格式的段无法对应, 只能截断
+        return [(truncate(content, limit), truncate(content_html, limit, True))]
+
+    if omit:
+        omit_text, omit_html = omit()
+        kept = [
+            i for i, (block, block_html) in enumerate(zip(blocks, blocks_html))
+            if i == 0
+            or (content and block not in omit_text)
+            or (content_html and block_html not in omit_html)
+        ]
+        omitted = len(blocks) - len(kept)
+
+        if omitted:
+            note = f'另有 {omitted} 个账号签到成功, 详情已省略.'
+            blocks = [blocks[kept[0]], note, *[blocks[i] for i in kept[1:]]]
+            blocks_html = [blocks_html[kept[0]], note, *[blocks_html[i] for i in kept[1:]]]
+
+    blocks = [truncate(block, limit) for block in blocks]
+    blocks_html = [truncate(block, limit, True) for block in blocks_html]
+    pages = pack(blocks_html if html else blocks, limit)
+
+    return [
+        (
+            BLOCK_SEPARATOR.join(blocks[i] for i in page) if content else '',
+            BLOCK_SEPARATOR.join(blocks_html[i] for i in page) if content_html else '',
+        )
+        for page in pages
+    ]
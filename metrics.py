@@ -0,0 +1,395 @@
+"""
+    @Description: 各阶段耗时统计, 导出为 Prometheus textfile 或 JSON, 常驻模式下可通过 HTTP 获取
+"""
+
+from hashlib import sha256
+from typing import TYPE_CHECKING, Callable, NoReturn, Optional
+import json
+import logging
+import threading
+import time
+
+from utils import atomic_write
+
+# HTTP 接口仅在常驻模式配置 metrics_port 时使用, 在 serve 中再导入
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# 直方图桶上限, 单位秒
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIX = 'aliyun_signin'
+
+# 每次耗时以 DEBUG 级别记录, 启用结构化日志时输出, 附带 account, phase, latency 等字段
+log = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    累计直方图, 与 Prometheus histogram 语义一致
+    """
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> NoReturn:
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else 0,
+            'max': round(self.max, 6),
+            'buckets': dict(zip([str(i) for i in BUCKETS], self.buckets)),
+        }
+
+
+class Timer:
+    """
+    计时上下文, 退出时记录耗时. 代码块内可修改 outcome, 抛出异常时记为 failure
+    """
+
+    def __init__(
+            self,
+            metrics: 'Metrics',
+            phase: str,
+            account: Optional[str | Callable[[], Optional[str]]] = None,
+            target: str = '',
+    ):
+        self.metrics = metrics
+        self.phase = phase
+        self.account = account
+        self.target = target
+        self.outcome = 'success'
+        self.start = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.outcome = 'failure'
+
+        account = self.account() if callable(self.account) else self.account
+        self.metrics.observe(self.phase, time.perf_counter() - self.start, self.outcome, account, self.target)
+
+
+class Metrics:
+    """
+    按阶段汇总的耗时统计. 汇总直方图以 (阶段, 目标, 结果) 为键, 目标如推送渠道名;
+    单账号统计以 (账号哈希, 阶段) 为键, 记录次数, 失败次数, 总耗时及最大耗时, 导出时不包含手机号等账号原文.
+    另有以名称为键的瞬时值, 如并发上限
+    """
+
+    def __init__(self, per_account: bool = True):
+        """
+        初始化
+
+        :param per_account: 是否记录单账号统计
+        """
+        self.lock = threading.Lock()
+        self.per_account = per_account
+        self.histograms: dict[tuple[str, str, str], Histogram] = {}
+        self.accounts: dict[tuple[str, str], dict] = {}
+        self.gauges: dict[str, tuple[float, str]] = {}
+
+    def reset_accounts(self) -> NoReturn:
+        """
+        清空单账号统计, 常驻模式下每天开始时调用, 避免账号变动后统计项无限增长
+
+        :return:
+        """
+        with self.lock:
+            self.accounts = {}
+
+    def set_gauge(self, name: str, value: float, help_text: str = '') -> NoReturn:
+        """
+        记录瞬时值, 同名覆盖
+
+        :param name: 名称, 如 concurrency_limit
+        :param value: 值
+        :param help_text: Prometheus 中的说明
+        :return:
+        """
+        with self.lock:
+            self.gauges[name] = (value, help_text)
+
+    def observe(
+            self,
+            phase: str,
+            seconds: float,
+            outcome: str = 'success',
+            account: Optional[str] = None,
+            target: str = '',
+    ) -> NoReturn:
+        """
+        记录一次耗时
+
+        :param phase: 阶段名, 如 access_token, sign_in, push
+        :param seconds: 耗时, 单位秒
+        :param outcome: 结果, 如 success, failure, cached, timeout
+        :param account: 账号, 为空时不计入单账号统计
+        :param target: 目标, 如推送渠道名
+        :return:
+        """
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                f'{phase} {outcome} {seconds * 1000:.1f}ms',
+                extra={'account': account, 'phase': phase, 'latency': seconds, 'target': target or None,
+                       'outcome': outcome},
+            )
+
+        with self.lock:
+            key = (phase, target or '', outcome)
+
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+
+            self.histograms[key].observe(seconds)
+
+            if not account or not self.per_account:
+                return
+
+            stats = self.accounts.setdefault(
+                (account_label(account), phase),
+                {'count': 0, 'failures': 0, 'sum': 0.0, 'max': 0.0},
+            )
+            stats['count'] += 1
+            stats['failures'] += int(outcome in ('failure', 'timeout'))
+            stats['sum'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+    def timer(
+            self,
+            phase: str,
+            account: Optional[str | Callable[[], Optional[str]]] = None,
+            target: str = '',
+    ) -> Timer:
+        """
+        创建计时上下文
+
+        :param phase: 阶段名
+        :param account: 账号, 或退出时返回账号的可调用对象
+        :param target: 目标, 如推送渠道名
+        :return: 计时上下文
+        """
+        return Timer(self, phase, account, target)
+
+    def to_json(self) -> dict:
+        """
+        导出 JSON 摘要
+
+        :return: 包含 phases 及 accounts 的字典
+        """
+        with self.lock:
+            phases = [
+                {'phase': phase, 'target': target, 'outcome': outcome, **histogram.to_dict()}
+                for (phase, target, outcome), histogram in sorted(self.histograms.items())
+            ]
+            accounts = {}
+
+            for (account, phase), stats in sorted(self.accounts.items()):
+                accounts.setdefault(account, {})[phase] = {
+                    **stats,
+                    'sum': round(stats['sum'], 6),
+                    'max': round(stats['max'], 6),
+                }
+
+            gauges = {name: value for name, (value, _) in sorted(self.gauges.items())}
+
+        return {'generated_at': time.time(), 'phases': phases, 'accounts': accounts, 'gauges': gauges}
+
+    def to_prometheus(self) -> str:
+        """
+        导出 Prometheus 文本格式
+
+        :return: 文本
+        """
+        name = f'{PREFIX}_phase_duration_seconds'
+        lines = [
+            f'# HELP {name} Duration of each sign-in phase.',
+            f'# TYPE {name} histogram',
+        ]
+
+        with self.lock:
+            for (phase, target, outcome), histogram in sorted(self.histograms.items()):
+                labels = f'phase="{escape(phase)}",target="{escape(target)}",outcome="{escape(outcome)}"'
+
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+
+                lines += [
+                    f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}',
+                    f'{name}_sum{{{labels}}} {histogram.sum:.6f}',
+                    f'{name}_count{{{labels}}} {histogram.count}',
+                ]
+
+            for metric, field, kind, help_text in [
+                ('account_phase_seconds_total', 'sum', 'counter', 'Total duration of each phase per account.'),
+                ('account_phase_seconds_max', 'max', 'gauge', 'Longest duration of each phase per account.'),
+                ('account_phase_total', 'count', 'counter', 'Number of runs of each phase per account.'),
+                ('account_phase_failures_total', 'failures', 'counter', 'Failed runs of each phase per account.'),
+            ]:
+                metric = f'{PREFIX}_{metric}'
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+
+                for (account, phase), stats in sorted(self.accounts.items()):
+                    value = stats[field]
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    lines.append(f'{metric}{{account="{escape(account)}",phase="{escape(phase)}"}} {value}')
+
+            for gauge, (value, help_text) in sorted(self.gauges.items()):
+                metric = f'{PREFIX}_{gauge}'
+                lines += [f'# HELP {metric} {help_text or gauge}', f'# TYPE {metric} gauge', f'{metric} {value}']
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """
+        按阶段汇总的简要文本, 用于日志
+
+        :return: 每个阶段一行
+        """
+        totals: dict[tuple[str, str], list] = {}
+
+        with self.lock:
+            for (phase, target, outcome), histogram in self.histograms.items():
+                total = totals.setdefault((phase, target), [0, 0, 0.0, 0.0])
+                total[0] += histogram.count
+                total[1] += histogram.count if outcome in ('failure', 'timeout') else 0
+                total[2] += histogram.sum
+                total[3] = max(total[3], histogram.max)
+
+            gauges = sorted(self.gauges.items())
+
+        return '\n'.join([
+            *(
+                f'{phase}{f"[{target}]" if target else ""}: {count} 次, 失败 {failures} 次, '
+                f'总耗时 {total:.3f}s, 平均 {total / count * 1000:.1f}ms, 最大 {longest * 1000:.1f}ms'
+                for (phase, target), (count, failures, total, longest) in sorted(totals.items())
+            ),
+            *(f'{name}: {value:g}' for name, (value, _) in gauges),
+        ])
+
+
+def account_label(account: str) -> str:
+    """
+    单账号统计中的账号标签, 取哈希前缀, 同一账号在各次运行中一致
+
+    :param account: 账号, 即 user_name
+    :return: 标签
+    """
+    return sha256(account.encode('utf-8')).hexdigest()[:12]
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    获取全局统计
+
+    :return: 全局统计
+    """
+    return _metrics
+
+
+def reset_metrics(per_account: bool = True) -> Metrics:
+    """
+    重置全局统计
+
+    :param per_account: 是否记录单账号统计
+    :return: 新的全局统计
+    """
+    global _metrics
+    _metrics = Metrics(per_account)
+    return _metrics
+
+
+def write_file(path: str, content: str) -> NoReturn:
+    """
+    先写临时文件再替换, 避免采集方读到不完整的文件
+
+    :param path: 文件路径
+    :param content: 文件内容
+    :return:
+    """
+    # 采集方如 node_exporter 可能以其他用户运行, 统计文件不含敏感信息, 允许其他用户读取
+    with atomic_write(path, 0o644) as f:
+        f.write(content)
+
+
+def export(textfile: Optional[str] = None, json_file: Optional[str] = None) -> NoReturn:
+    """
+    导出全局统计到文件
+
+    :param textfile: Prometheus textfile 路径, 为空时不导出
+    :param json_file: JSON 摘要路径, 为空时不导出
+    :return:
+    """
+    metrics = get_metrics()
+
+    try:
+        if textfile:
+            write_file(textfile, metrics.to_prometheus())
+
+        if json_file:
+            write_file(json_file, json.dumps(metrics.to_json(), ensure_ascii=False, indent=2))
+    except OSError as e:
+        logging.warning(f'导出统计失败: {e}')
+
+
+def serve(port: int, host: str = '127.0.0.1') -> 'ThreadingHTTPServer':
+    """
+    在后台线程中提供统计接口
+
+    :param port: 端口
+    :param host: 监听地址
+    :return: HTTP 服务, 调用 shutdown 停止
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """
+        /metrics 返回 Prometheus 文本格式, /metrics.json 返回 JSON 摘要
+        """
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = get_metrics().to_prometheus().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path == '/metrics.json':
+                body = json.dumps(get_metrics().to_json(), ensure_ascii=False).encode('utf-8')
+                content_type = 'application/json; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f'统计接口已启动: http://{host}:{server.server_address[1]}/metrics')
+    return server
@@ -2,59 +2,179 @@
     @Author: ImYrS Yang
     @Date: 2023/2/11
     @Copyright: ImYrS Yang
-    @Description: 
+    @Description:
 """
 
-from typing import List
+from typing import List, Optional
 import logging
+import threading
 
 import requests
 from configobj import ConfigObj
 
+from cache import JsonCache
+from session import get_session
+
+DEFAULT_TIMEOUT = 10
+
+# sampleText 的 content 长度上限, 标题同在 content 中, 预留标题长度
+MESSAGE_LIMIT = 4900
+MESSAGE_FORMAT = 'text'
+
+# batchSend 单次请求的 userIds 数量上限
+BATCH_SIZE = 20
+
+# 提前失效的时间, 避免使用即将过期的 access token
+EXPIRY_MARGIN = 300
+
+# access token 无效时的错误码
+INVALID_TOKEN_CODES = ['InvalidAuthentication', 'Forbidden.AccessDenied.AccessTokenPermissionDenied']
+
+_caches: dict[str, JsonCache] = {}
+_lock = threading.Lock()
+
+
+def get_token_cache(path: str) -> JsonCache:
+    """
+    获取 access token 缓存, 同一路径在进程内共享
+
+    :param path: 缓存文件路径, 为空时仅在内存中缓存
+    :return: 缓存
+    """
+    with _lock:
+        if path not in _caches:
+            _caches[path] = JsonCache(path)
+
+        return _caches[path]
+
 
 class Pusher:
 
-    def __init__(self, app_key, app_secret):
+    def __init__(
+            self,
+            app_key,
+            app_secret,
+            session: Optional[requests.Session] = None,
+            timeout: float = DEFAULT_TIMEOUT,
+            token_cache: Optional[JsonCache] = None,
+    ):
+        """
+        初始化
+
+        :param app_key: 应用 AppKey
+        :param app_secret: 应用 AppSecret
+        :param session: HTTP 会话, 默认使用共享会话
+        :param timeout: 请求超时时间, 单位秒
+        :param token_cache: access token 缓存, 为 None 时仅在当前实例内复用
+        """
         self.app_key = app_key
         self.app_secret = app_secret
-        self.access_token = self.get_access_token()
+        self.session = session or get_session()
+        self.timeout = timeout
+        self.token_cache = token_cache
+        self.access_token = None
 
-    def get_access_token(self) -> dict:
+    def get_access_token(self) -> str:
         """
-        获取 access_token
+        获取 access_token, 优先使用缓存
 
         :return:
         """
-        return requests.post(
+        if self.access_token:
+            return self.access_token
+
+        cached = self.token_cache.get(self.app_key) if self.token_cache else None
+
+        if cached:
+            self.access_token = cached['access_token']
+            return self.access_token
+
+        r = self.session.post(
             'https://api.dingtalk.com/v1.0/oauth2/accessToken',
             json={
                 'appKey': self.app_key,
                 'appSecret': self.app_secret,
             },
-        ).json()['accessToken']
+            timeout=self.timeout,
+        )
+        data = r.json()
+
+        if 'accessToken' not in data:
+            raise Exception(f'获取 access token 失败, 错误信息: {data}')
+
+        self.access_token = data['accessToken']
+
+        if self.token_cache:
+            self.token_cache.set(
+                self.app_key,
+                {'access_token': self.access_token},
+                max(int(data.get('expireIn', 7200)) - EXPIRY_MARGIN, 0),
+            )
+            if self.token_cache.path:
+                self.token_cache.save()
+
+        return self.access_token
+
+    def invalidate(self) -> None:
+        """
+        使缓存的 access_token 失效
+
+        :return:
+        """
+        self.access_token = None
+
+        if self.token_cache:
+            self.token_cache.delete(self.app_key)
 
     def send(self, user_ids: List, content: str) -> dict:
         """
-        发送消息
+        发送消息, 按 BATCH_SIZE 分批请求, access token 失效时刷新后重试一次
 
         :param user_ids: 用户 ID 列表
         :param content: 消息内容
-        :return:
+        :return: 合并后的 invalidStaffIdList 及 flowControlledStaffIdList
         """
-        return requests.post(
-            'https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend',
-            headers={
-                'x-acs-dingtalk-access-token': self.access_token,
-            },
-            json={
-                'robotCode': self.app_key,
-                'userIds': user_ids,
-                'msgKey': 'sampleText',
-                'msgParam': str({
-                    'content': content,
-                })
-            }
-        ).json()
+        result = {
+            'invalidStaffIdList': [],
+            'flowControlledStaffIdList': [],
+        }
+
+        for i in range(0, len(user_ids), BATCH_SIZE):
+            batch = user_ids[i:i + BATCH_SIZE]
+
+            for attempt in range(2):
+                r = self.session.post(
+                    'https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend',
+                    headers={
+                        'x-acs-dingtalk-access-token': self.get_access_token(),
+                    },
+                    json={
+                        'robotCode': self.app_key,
+                        'userIds': batch,
+                        'msgKey': 'sampleText',
+                        'msgParam': str({
+                            'content': content,
+                        })
+                    },
+                    timeout=self.timeout,
+                )
+                data = r.json()
+
+                if r.status_code == 401 or data.get('code') in INVALID_TOKEN_CODES:
+                    self.invalidate()
+
+                    if not attempt:
+                        continue
+
+                break
+
+            if r.status_code != 200:
+                raise Exception(f'发送消息失败, 错误信息: {data}')
+
+            for key in result:
+                result[key] += data.get(key) or []
+
+        return result
 
 
 def push(
@@ -62,6 +182,7 @@ def push(
         content: str,
         content_html: str,
         title: str,
+        timeout: float = DEFAULT_TIMEOUT,
 ) -> bool:
     """
     签到消息推送
@@ -70,6 +191,7 @@ def push(
     :param content: 推送内容
     :param content_html: 推送内容, HTML 格式
     :param title: 标题
+    :param timeout: 请求超时时间, 单位秒
     :return:
     """
     if (
@@ -80,15 +202,31 @@ def push(
         logging.error('DingTalk 推送参数配置不完整')
         return False
 
+    # 多个用户 ID 以逗号分隔, ConfigObj 会解析为列表
+    user_ids = config['dingtalk_user_id']
+    user_ids = [
+        i.strip()
+        for i in (user_ids.split(',') if isinstance(user_ids, str) else user_ids)
+        if i.strip()
+    ]
+
     try:
-        pusher = Pusher(config['dingtalk_app_key'], config['dingtalk_app_secret'])
-        pusher.send(
-            [config['dingtalk_user_id']],
-            f'{title}\n\n{content}'
+        pusher = Pusher(
+            config['dingtalk_app_key'],
+            config['dingtalk_app_secret'],
+            timeout=timeout,
+            token_cache=get_token_cache(config.get('dingtalk_token_cache', 'dingtalk_token.json')),
         )
-        logging.info('DingTalk 推送成功')
+        result = pusher.send(user_ids, f'{title}\n\n{content}')
     except Exception as e:
         logging.error(f'DingTalk 推送失败, 错误信息: {e}')
         return False
 
+    if result['invalidStaffIdList']:
+        logging.warning(f'DingTalk 无效的用户 ID: {result["invalidStaffIdList"]}')
+
+    if result['flowControlledStaffIdList']:
+        logging.warning(f'DingTalk 推送被限流的用户 ID: {result["flowControlledStaffIdList"]}')
+
+    logging.info('DingTalk 推送成功')
     return True
@@ -5,17 +5,34 @@
     @Description: 
 """
 
+from typing import Optional
 import logging
 
 import requests
 from configobj import ConfigObj
 
+from session import get_session
+
+DEFAULT_TIMEOUT = 10
+
+# 无明确长度限制
+MESSAGE_LIMIT = None
+MESSAGE_FORMAT = 'text'
+
 
 class Pusher:
 
-    def __init__(self, endpoint: str, push_key: str):
+    def __init__(
+            self,
+            endpoint: str,
+            push_key: str,
+            session: Optional[requests.Session] = None,
+            timeout: float = DEFAULT_TIMEOUT,
+    ):
         self.endpoint = endpoint
         self.push_key = push_key
+        self.session = session or get_session()
+        self.timeout = timeout
 
     def send(self, title: str, content: str) -> dict:
         """
@@ -25,14 +42,15 @@ class Pusher:
         :param content: 消息内容
         :return:
         """
-        return requests.post(
+        return self.session.post(
             self.endpoint + '/message/push',
             json={
                 'pushkey': self.push_key,
                 'type': 'markdown',
                 'text': title,
                 'desp': content,
-            }
+            },
+            timeout=self.timeout,
         ).json()
 
 
@@ -41,6 +59,7 @@ def push(
         content: str,
         content_html: str,
         title: str,
+        timeout: float = DEFAULT_TIMEOUT,
 ) -> bool:
     """
     签到消息推送
@@ -49,6 +68,7 @@ def push(
     :param content: 推送内容
     :param content_html: 推送内容, HTML 格式
     :param title: 标题
+    :param timeout: 请求超时时间, 单位秒
     :return:
     """
     if (
@@ -59,8 +79,13 @@ def push(
         return False
 
     try:
-        pusher = Pusher(config['pushdeer_endpoint'], config['pushdeer_send_key'])
-        pusher.send(title, content)
+        pusher = Pusher(config['pushdeer_endpoint'], config['pushdeer_send_key'], timeout=timeout)
+        data = pusher.send(title, content)
+
+        if data.get('code') != 0:
+            logging.error(f'PushDeer 推送失败, 错误信息: {data.get("error") or data}')
+            return False
+
         logging.info('PushDeer 推送成功')
     except Exception as e:
         logging.error(f'PushDeer 推送失败, 错误信息: {e}')
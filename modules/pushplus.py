@@ -1,15 +1,28 @@
+from typing import Optional
 import logging
 
 import requests
 from configobj import ConfigObj
 
+from session import get_session
+
+DEFAULT_TIMEOUT = 10
+
+# content 长度上限, 保守取值
+MESSAGE_LIMIT = 10000
+MESSAGE_FORMAT = 'text'
+
 
 class Pusher:
     def __init__(
             self,
-            token: str
+            token: str,
+            session: Optional[requests.Session] = None,
+            timeout: float = DEFAULT_TIMEOUT,
     ):
         self.token = token
+        self.session = session or get_session()
+        self.timeout = timeout
 
     def send(self, title: str, content: str) -> dict:
         """
@@ -19,13 +32,14 @@ class Pusher:
         :param content: 消息内容
         :return:
         """
-        return requests.post(
+        return self.session.post(
             'http://www.pushplus.plus/send',
             json={
                 'token': self.token,
                 'title': title,
                 'content': content,
-            }
+            },
+            timeout=self.timeout,
         ).json()
 
 
@@ -34,6 +48,7 @@ def push(
         content: str,
         content_html: str,
         title: str,
+        timeout: float = DEFAULT_TIMEOUT,
 ) -> bool:
     """
     签到消息推送
@@ -42,6 +57,7 @@ def push(
     :param content: 推送内容
     :param content_html: 推送内容, HTML 格式
     :param title: 标题
+    :param timeout: 请求超时时间, 单位秒
     :return:
     """
     if not config['pushplus_token']:
@@ -49,8 +65,13 @@ def push(
         return False
 
     try:
-        pusher = Pusher(config['pushplus_token'])
-        pusher.send(title, content)
+        pusher = Pusher(config['pushplus_token'], timeout=timeout)
+        data = pusher.send(title, content)
+
+        if data.get('code') != 200:
+            logging.error(f'PushPlus 推送失败, 错误信息: {data.get("msg") or data}')
+            return False
+
         logging.info('PushPlus 推送成功')
     except Exception as e:
         logging.error(f'PushPlus 推送失败, 错误信息: {e}')
@@ -1,12 +1,28 @@
+from typing import Optional
 import logging
 
 import requests
 from configobj import ConfigObj
 
+from session import get_session
+
+DEFAULT_TIMEOUT = 10
+
+# desp 最大 32KB, 按中文 UTF-8 编码保守换算为字符数
+MESSAGE_LIMIT = 10000
+MESSAGE_FORMAT = 'text'
+
 
 class Pusher:
-    def __init__(self, send_key):
+    def __init__(
+            self,
+            send_key,
+            session: Optional[requests.Session] = None,
+            timeout: float = DEFAULT_TIMEOUT,
+    ):
         self.send_key = send_key
+        self.session = session or get_session()
+        self.timeout = timeout
 
     def send(self, title: str, content: str) -> dict:
         """
@@ -18,7 +34,7 @@ class Pusher:
         """
         api = "https://sc.ftqq.com/%s.send" % self.send_key
         data = {"text": title, "desp": content}
-        return requests.post(api, data=data).json()
+        return self.session.post(api, data=data, timeout=self.timeout).json()
 
 
 def push(
@@ -26,6 +42,7 @@ def push(
         content: str,
         content_html: str,
         title: str,
+        timeout: float = DEFAULT_TIMEOUT,
 ) -> bool:
     """
     签到消息推送
@@ -34,6 +51,7 @@ def push(
     :param content: 推送内容
     :param content_html: 推送内容, HTML 格式
     :param title: 标题
+    :param timeout: 请求超时时间, 单位秒
     :return:
     """
     if not config['serverchan_send_key']:
@@ -41,8 +59,13 @@ def push(
         return False
 
     try:
-        pusher = Pusher(config['serverchan_send_key'])
-        pusher.send(title, content)
+        pusher = Pusher(config['serverchan_send_key'], timeout=timeout)
+        data = pusher.send(title, content)
+
+        if data.get('errno', data.get('code')) != 0:
+            logging.error(f'ServerChan 推送失败, 错误信息: {data.get("errmsg") or data.get("message") or data}')
+            return False
+
         logging.info('ServerChan 推送成功')
     except Exception as e:
         logging.error(f'ServerChan 推送失败, 错误信息: {e}')
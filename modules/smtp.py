@@ -2,19 +2,51 @@
     @Author: ImYrS Yang
     @Date: 2023/2/27
     @Copyright: ImYrS Yang
-    @Description: 
+    @Description:
 """
 
+from typing import NoReturn, Optional
 import logging
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.header import Header
 from email.utils import formataddr
 
 from configobj import ConfigObj
 
+from records import SignInResult
+from utils import parse_bool
+
+DEFAULT_TIMEOUT = 10
+
+# 邮件无长度限制
+MESSAGE_LIMIT = None
+MESSAGE_FORMAT = 'text'
+
+# 复用的连接在发送前检查时出现这些错误说明已断开, 重新连接. 超时不重新连接, 邮件可能已被接收
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+def parse_list(value: Optional[str | list[str]]) -> list[str]:
+    """
+    解析逗号分隔的配置项, ConfigObj 会将含逗号的值解析为列表, 环境变量中为字符串
+
+    :param value: 配置值
+    :return: 去除空白后的非空项列表
+    """
+    if not value:
+        return []
+
+    items = value.split(',') if isinstance(value, str) else value
+    return [i.strip() for i in items if i and i.strip()]
+
 
 class Pusher:
+    """
+    SMTP 推送, 复用同一个已登录的连接发送多封邮件, 连接断开时自动重连
+    """
 
     def __init__(
             self,
@@ -24,38 +56,192 @@ class Pusher:
             user: str,
             password: str,
             sender: str,
-            receiver: str,
+            receiver: str | list[str],
+            timeout: float = DEFAULT_TIMEOUT,
     ):
         self.host = host
-        self.port = port
+        self.port = int(port)
         self.tls = tls
         self.user = user
         self.password = password
         self.sender = sender
-        self.receiver = receiver
+        self.receivers = parse_list(receiver)
+        self.timeout = timeout
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.lock = threading.Lock()
+
+    def connect(self, timeout: Optional[float] = None) -> smtplib.SMTP:
+        """
+        建立连接并登录
 
-    def send(self, title: str, content: str) -> None:
+        :param timeout: 超时时间, 单位秒, 默认为 self.timeout
+        :return: 已登录的 SMTP 连接
         """
-        发送消息
+        smtp = smtplib.SMTP(self.host, self.port, timeout=timeout or self.timeout)
+
+        try:
+            smtp.ehlo()
+
+            if self.tls:
+                smtp.starttls()
+                smtp.ehlo()
+
+            smtp.login(self.user, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+
+        return smtp
+
+    def send(
+            self,
+            title: str,
+            content: str,
+            receivers: Optional[list[str]] = None,
+            timeout: Optional[float] = None,
+    ) -> None:
+        """
+        发送消息, 所有收件人在同一封邮件中投递
 
         :param title: 通知标题
         :param content: 消息内容
+        :param receivers: 收件人列表, 默认为配置的收件人
+        :param timeout: 本次发送的超时时间, 单位秒, 默认为 self.timeout
         :return:
         """
-        smtp = smtplib.SMTP(self.host, self.port)
-        smtp.ehlo()
-
-        if self.tls:
-            smtp.starttls()
-
-        smtp.login(self.user, self.password)
+        receivers = receivers or self.receivers
 
         message = MIMEText(content, 'plain', 'utf-8')
         message['From'] = formataddr((str(Header('AliyunDrive Auto Signin', 'utf-8')), self.sender))
-        message['To'] = self.receiver
+        message['To'] = ', '.join(receivers)
         message['Subject'] = title
+        message = message.as_string()
+
+        with self.lock:
+            if self.smtp:
+                # 复用的连接按本次的超时时间设置, 并在发送前检查是否仍然可用.
+                # 常驻模式下空闲连接可能已被服务端关闭, 此时尚未发送邮件, 可安全地重新连接
+                if self.smtp.sock:
+                    self.smtp.sock.settimeout(timeout or self.timeout)
+
+                try:
+                    code, _ = self.smtp.noop()
+
+                    if code != 250:
+                        raise smtplib.SMTPServerDisconnected(f'NOOP 返回 {code}')
+                except RECONNECT_ERRORS as e:
+                    logging.warning(f'SMTP 连接已断开, 重新连接: {e}')
+                    self.smtp.close()
+                    self.smtp = None
+
+            if not self.smtp:
+                self.smtp = self.connect(timeout)
+
+            # 发送过程中出错时不重发, 避免服务端已接收后重复投递
+            try:
+                self.smtp.sendmail(self.sender, receivers, message)
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self.smtp.close()
+                self.smtp = None
+                raise
+
+    def close(self) -> NoReturn:
+        """
+        退出登录并关闭连接
+
+        :return:
+        """
+        with self.lock:
+            if not self.smtp:
+                return
+
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+
+            self.smtp = None
+
+
+# 以连接参数为键复用 Pusher, 常驻模式下连接在多次推送间保持
+_pushers: dict[tuple, Pusher] = {}
+_lock = threading.Lock()
+
+
+def get_pusher(config: ConfigObj | dict, timeout: float = DEFAULT_TIMEOUT) -> Pusher:
+    """
+    获取与配置对应的 Pusher, 配置变化时关闭旧连接
+
+    :param config: 配置文件, ConfigObj 对象 | dict
+    :param timeout: 连接超时时间, 单位秒
+    :return: Pusher
+    """
+    key = (
+        config['smtp_host'],
+        str(config['smtp_port']),
+        parse_bool(config['smtp_tls']),
+        config['smtp_user'],
+        config['smtp_password'],
+        config['smtp_sender'],
+        tuple(parse_list(config['smtp_receiver'])),
+        timeout,
+    )
 
-        smtp.sendmail(self.sender, [self.receiver], message.as_string())
+    with _lock:
+        pusher = _pushers.get(key)
+
+        if pusher:
+            return pusher
+
+        for stale in _pushers.values():
+            stale.close()
+
+        _pushers.clear()
+        pusher = _pushers[key] = Pusher(
+            host=config['smtp_host'],
+            port=config['smtp_port'],
+            tls=parse_bool(config['smtp_tls']),
+            user=config['smtp_user'],
+            password=config['smtp_password'],
+            sender=config['smtp_sender'],
+            receiver=config['smtp_receiver'],
+            timeout=timeout,
+        )
+        return pusher
+
+
+def get_account_receivers(config: ConfigObj | dict) -> dict[str, str]:
+    """
+    读取账号到收件人的映射, 格式为 账号:邮箱, 多个以逗号分隔
+
+    :param config: 配置文件, ConfigObj 对象 | dict
+    :return: 账号到收件人的映射
+    """
+    receivers = {}
+
+    for item in parse_list(config.get('smtp_account_receivers')):
+        user, sep, receiver = item.partition(':')
+
+        if not sep or not receiver.strip():
+            logging.warning(f'smtp_account_receivers 配置项格式错误, 已忽略: {item}')
+            continue
+
+        receivers[user.strip()] = receiver.strip()
+
+    return receivers
+
+
+def close() -> NoReturn:
+    """
+    关闭所有 SMTP 连接
+
+    :return:
+    """
+    with _lock:
+        for pusher in _pushers.values():
+            pusher.close()
+
+        _pushers.clear()
 
 
 def push(
@@ -63,16 +249,26 @@ def push(
         content: str,
         content_html: str,
         title: str,
+        timeout: float = DEFAULT_TIMEOUT,
+        results: Optional[list[SignInResult]] = None,
+        deadline: Optional[float] = None,
 ) -> bool:
     """
-    签到消息推送
+    签到消息推送. 汇总消息发送给 smtp_receiver 中的所有收件人,
+    结果中带有 email 字段或在 smtp_account_receivers 中配置了收件人的账号, 另外单独发送该账号的结果
 
     :param config: 配置文件, ConfigObj 对象 | dict
     :param content: 推送内容
     :param content_html: 推送内容, HTML 格式
     :param title: 标题
+    :param timeout: 请求超时时间, 单位秒
+    :param results: 签到结果列表, 用于按账号发送
+    :param deadline: 截止时间, time.monotonic() 时间戳, 每封邮件的超时不超过剩余时间, 超出后不再发送
     :return:
     """
+    def remaining() -> float:
+        return timeout if deadline is None else min(timeout, deadline - time.monotonic())
+
     if (
             not config['smtp_host']
             or not config['smtp_port']
@@ -80,25 +276,40 @@ def push(
             or not config['smtp_user']
             or not config['smtp_password']
             or not config['smtp_sender']
-            or not config['smtp_receiver']
+            or not parse_list(config['smtp_receiver'])
     ):
         logging.error('SMTP 推送参数配置不完整')
         return False
 
     try:
-        pusher = Pusher(
-            host=config['smtp_host'],
-            port=config['smtp_port'],
-            tls=config['smtp_tls'],
-            user=config['smtp_user'],
-            password=config['smtp_password'],
-            sender=config['smtp_sender'],
-            receiver=config['smtp_receiver'],
-        )
-        pusher.send(title, content)
+        pusher = get_pusher(config, timeout)
+
+        if remaining() <= 0:
+            raise TimeoutError('已超出推送截止时间')
+
+        pusher.send(title, content, timeout=remaining())
         logging.info('SMTP 推送成功')
     except Exception as e:
         logging.error(f'SMTP 推送失败, 错误信息: {e}')
         return False
 
-    return True
+    account_receivers = get_account_receivers(config)
+    success = True
+
+    for i, result in enumerate(results or []):
+        receiver = result.email or account_receivers.get(result.user)
+
+        if not receiver:
+            continue
+
+        if remaining() <= 0:
+            logging.error(f'SMTP 已超出推送截止时间, 剩余 {len(results) - i} 个账号未发送')
+            return False
+
+        try:
+            pusher.send(title, result.text, [receiver], remaining())
+        except Exception as e:
+            logging.error(f'[{result.user}] SMTP 推送失败, 错误信息: {e}')
+            success = False
+
+    return success
@@ -11,6 +11,14 @@ import logging
 import requests
 from configobj import ConfigObj
 
+from session import get_session
+
+DEFAULT_TIMEOUT = 10
+
+# sendMessage 的 text 最多 4096 个字符, 标题同在 text 中, 预留标题长度
+MESSAGE_LIMIT = 4000
+MESSAGE_FORMAT = 'html'
+
 
 class Pusher:
 
@@ -19,12 +27,16 @@ class Pusher:
             endpoint: str,
             token: str,
             chat_id: str,
-            proxy: Optional[str] = None
+            proxy: Optional[str] = None,
+            session: Optional[requests.Session] = None,
+            timeout: float = DEFAULT_TIMEOUT,
     ):
         self.endpoint = endpoint
         self.token = token
         self.chat_id = chat_id
         self.proxy = proxy
+        self.session = session or get_session()
+        self.timeout = timeout
 
     def send(self, title: str, content: str) -> Optional[dict]:
         """
@@ -34,7 +46,7 @@ class Pusher:
         :param content: 消息内容
         :return:
         """
-        resp = requests.post(
+        resp = self.session.post(
             self.endpoint + f'/bot{self.token}/sendMessage',
             json={
                 'chat_id': self.chat_id,
@@ -45,7 +57,7 @@ class Pusher:
                 'http': self.proxy,
                 'https': self.proxy,
             } if self.proxy else None,
-            timeout=10,
+            timeout=self.timeout,
         )
 
         if resp.status_code == 200:
@@ -60,6 +72,7 @@ def push(
         content: str,
         content_html: str,
         title: str,
+        timeout: float = DEFAULT_TIMEOUT,
 ) -> bool:
     """
     签到消息推送
@@ -68,6 +81,7 @@ def push(
     :param content: 推送内容
     :param content_html: 推送内容, HTML 格式
     :param title: 标题
+    :param timeout: 请求超时时间, 单位秒
     :return:
     """
     if (
@@ -84,9 +98,11 @@ def push(
             config['telegram_bot_token'],
             config['telegram_chat_id'],
             config['telegram_proxy'],
+            timeout=timeout,
         )
-        if pusher.send(title, content_html):
-            logging.info('Telegram 推送成功')
+        if not pusher.send(title, content_html):
+            return False
+        logging.info('Telegram 推送成功')
     except Exception as e:
         logging.error(f'Telegram 推送失败, 错误信息: {e}')
         return False
@@ -0,0 +1,212 @@
+"""
+    @Description: 推送发件箱, 消息先写入状态存储再由后台线程推送, 失败的消息保留并在之后按渠道合并重试
+"""
+
+from typing import Callable, NoReturn, Optional
+import logging
+import threading
+import time
+
+from configobj import ConfigObj
+
+from records import SignInResult
+from state import StateStore
+
+
+class Outbox:
+    """
+    推送发件箱. 每条消息按渠道分别保存, 同一渠道积压的多条消息合并为一次推送
+    """
+
+    def __init__(
+            self,
+            store: StateStore,
+            deliver: Callable[..., list[dict]],
+            get_channels: Callable[[ConfigObj | dict], list[str]],
+            interval: float = 300,
+            ttl: float = 3 * 86400,
+    ):
+        """
+        初始化
+
+        :param store: 状态存储
+        :param deliver: 推送函数, 参数与 app.push 相同, 返回各渠道推送结果
+        :param get_channels: 获取配置的推送渠道
+        :param interval: 失败后的重试间隔, 单位秒, 每次失败后翻倍
+        :param ttl: 消息最长保留时间, 单位秒, 超出后丢弃
+        """
+        self.store = store
+        self.deliver = deliver
+        self.get_channels = get_channels
+        self.interval = interval
+        self.ttl = ttl
+        self.config: Optional[ConfigObj | dict] = None
+        self.thread: Optional[threading.Thread] = None
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.urgent = False
+        self.lock = threading.Lock()
+
+    def submit(
+            self,
+            config: ConfigObj | dict,
+            content: str,
+            content_html: str,
+            title: Optional[str] = None,
+            results: Optional[list[SignInResult]] = None,
+    ) -> NoReturn:
+        """
+        写入消息并通知后台线程推送, 不等待推送完成
+
+        :param config: 配置文件, ConfigObj 对象或字典
+        :param content: 推送内容
+        :param content_html: 推送内容, HTML 格式
+        :param title: 推送标题
+        :param results: 签到结果, 用于按账号推送
+        :return:
+        """
+        # 随消息保存签到结果的原始字段, 推送内容在推送时生成, 不保存 refresh token
+        results = [
+            {k: v for k, v in result.to_dict().items() if k != 'refresh_token'}
+            for result in results or []
+        ]
+
+        self.store.enqueue_push(self.get_channels(config), title, content, content_html, results)
+
+        with self.lock:
+            self.config = config
+            self.urgent = True
+
+        self.wakeup.set()
+
+    def flush(self, force: bool = False) -> NoReturn:
+        """
+        推送积压的消息, 同一渠道的消息合并, 积压消息相同的渠道一同推送
+
+        :param force: 为 True 时忽略重试间隔, 推送所有积压消息
+        :return:
+        """
+        with self.lock:
+            config = self.config
+
+        if config is None:
+            return
+
+        expired = self.store.expire_pushes(time.time() - self.ttl)
+
+        if expired:
+            logging.error(f'{expired} 条推送消息超过 {self.ttl:.0f} 秒未能送达, 已丢弃.')
+
+        channels = set(self.get_channels(config))
+        grouped: dict[str, list[dict]] = {}
+
+        for item in self.store.pending_pushes(None if force else time.time()):
+            grouped.setdefault(item['channel'], []).append(item)
+
+        # 同一次写入的各渠道消息写入时间相同, 积压消息的写入时间完全相同的渠道可合并为一次 deliver 调用
+        batches: dict[tuple[float, ...], list[str]] = {}
+
+        for channel, items in grouped.items():
+            if channel not in channels:
+                # 渠道已从配置中移除, 保留消息, 重新配置后推送
+                continue
+
+            batches.setdefault(tuple(item['created_at'] for item in items), []).append(channel)
+
+        for batch_channels in batches.values():
+            items = grouped[batch_channels[0]]
+            outcomes = self.deliver(config, *merge(items), push_types=batch_channels)
+            outcomes = {outcome['type']: outcome for outcome in outcomes}
+
+            for channel in batch_channels:
+                channel_ids = [item['id'] for item in grouped[channel]]
+                outcome = outcomes.get(channel)
+
+                if outcome and outcome['success']:
+                    self.store.remove_pushes(channel_ids)
+                    continue
+
+                attempts = max(item['attempts'] for item in grouped[channel]) + 1
+                delay = self.interval * 2 ** (attempts - 1)
+                error = outcome['error'] if outcome else '推送渠道不可用'
+                self.store.defer_pushes(channel_ids, error, time.time() + delay)
+                logging.warning(
+                    f'{channel} 推送失败, {len(channel_ids)} 条消息已保留, 将在 {delay:.0f} 秒后或下次运行时重试.'
+                )
+
+    def worker(self) -> NoReturn:
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+            with self.lock:
+                force, self.urgent = self.urgent, False
+
+            try:
+                self.flush(force)
+            except Exception as e:
+                logging.error(f'推送发件箱处理失败, 错误信息: {e}')
+
+            if self.stopping.is_set() and not self.urgent:
+                return
+
+    def start(self, config: ConfigObj | dict) -> NoReturn:
+        """
+        启动后台线程, 并立即重试到期的积压消息
+
+        :param config: 配置文件, ConfigObj 对象或字典
+        :return:
+        """
+        with self.lock:
+            self.config = config
+
+        self.thread = threading.Thread(target=self.worker, name='outbox', daemon=True)
+        self.thread.start()
+        self.wakeup.set()
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待已提交的消息推送完成后停止后台线程
+
+        :param timeout: 最长等待时间, 单位秒
+        :return: 后台线程已停止返回 True, 超时仍在运行返回 False, 此时不能关闭状态存储
+        """
+        if not self.thread:
+            return True
+
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join(timeout)
+
+        if self.thread.is_alive():
+            logging.warning('推送发件箱未能在截止时间前处理完成, 未送达的消息将在下次运行时重试.')
+            return False
+
+        return True
+
+
+def merge(items: list[dict]) -> tuple[str, str, Optional[str], list[SignInResult]]:
+    """
+    合并同一渠道积压的消息
+
+    :param items: 消息列表, 按写入顺序排列
+    :return: 推送内容, HTML 格式推送内容, 标题及签到结果
+    """
+    latest = items[-1]
+
+    if len(items) == 1:
+        return (
+            latest['content'],
+            latest['content_html'],
+            latest['title'],
+            [SignInResult.from_dict(result) for result in latest['results']],
+        )
+
+    title = f'{latest["title"] or ""} (含 {len(items) - 1} 条此前未送达的消息)'.strip()
+    separator = '\n\n' + '-' * 20 + '\n\n'
+    return (
+        separator.join(item['content'] for item in reversed(items)),
+        separator.join(item['content_html'] for item in reversed(items)),
+        title,
+        [SignInResult.from_dict(result) for item in items for result in item['results']],
+    )
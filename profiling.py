@@ -0,0 +1,285 @@
+"""
+    @Description: 性能分析模式, 使用 cProfile 及 tracemalloc 分析一次签到运行的 CPU 耗时, 内存分配及导入耗时
+"""
+
+from functools import wraps
+from typing import Any, Callable, NoReturn
+import cProfile
+import io
+import os
+import pstats
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+# 按函数归类自身耗时 (tottime), 用于区分导入, JSON 解析, TLS 握手及网络等待. 按顺序匹配, 先匹配先归类
+CATEGORIES = [
+    ('导入', lambda file, name: 'importlib._bootstrap' in file or name in (
+        "<built-in method marshal.loads>", "<built-in method _imp.create_dynamic>",
+    )),
+    ('TLS 握手', lambda file, name: (
+        'do_handshake' in name or 'load_verify_locations' in name or '_ssl._SSLContext' in name
+        or file.endswith('ssl.py') and name in ('wrap_socket', '_create', 'create_default_context')
+    )),
+    ('网络等待', lambda file, name: any(i in name for i in (
+        "'recv_into'", "'recv'", "'read' of '_ssl", "'write' of '_ssl", "'sendall'", "'send'",
+        "'connect'", 'getaddrinfo', 'select.select', 'select.poll', "'poll'",
+    ))),
+    ('JSON 解析', lambda file, name: '/json/' in file.replace('\\', '/') or '_json' in name),
+    ('线程等待', lambda file, name: "'acquire' of '_thread" in name or name == '<built-in method time.sleep>'),
+]
+
+# Python 3.12 起 cProfile 基于 sys.monitoring, 同一时刻只能启用一个分析器, 但其记录所有线程的调用,
+# 此时只使用主线程的分析器; 3.10 / 3.11 中 cProfile 只统计启用它的线程, 需为每个线程启用独立的分析器
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class Tracker:
+    """
+    统计指定函数的调用次数, 耗时, 所在线程的 CPU 时间及内存变化
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: dict[str, dict] = {}
+        self.patched: list[tuple[Any, str, Callable]] = []
+
+    def wrap(self, owner: Any, attr: str, label: str) -> NoReturn:
+        """
+        替换 owner 上的函数为统计版本
+
+        :param owner: 模块或类
+        :param attr: 函数名
+        :param label: 报告中的名称
+        :return:
+        """
+        func = getattr(owner, attr)
+        stats = self.stats.setdefault(label, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'memory': 0})
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            wall, cpu, memory = time.perf_counter(), time.thread_time(), tracemalloc.get_traced_memory()[0]
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self.lock:
+                    stats['calls'] += 1
+                    stats['wall'] += time.perf_counter() - wall
+                    stats['cpu'] += time.thread_time() - cpu
+                    stats['memory'] += tracemalloc.get_traced_memory()[0] - memory
+
+        setattr(owner, attr, wrapper)
+        self.patched.append((owner, attr, func))
+
+    def restore(self) -> NoReturn:
+        for owner, attr, func in reversed(self.patched):
+            setattr(owner, attr, func)
+
+        self.patched = []
+
+
+class Profiler:
+    """
+    分析一次运行, 所有线程的 cProfile 结果合并输出. 支持 Python 3.10 及以上版本,
+    3.12 起各线程共用一个分析器, 并发线程的调用栈相互交错, 累计耗时仅供参考
+    """
+
+    def __init__(self, top: int = 20):
+        """
+        初始化
+
+        :param top: 报告中每项列出的条目数
+        """
+        self.top = top
+        self.tracker = Tracker()
+        self.profiles: list[cProfile.Profile] = []
+        self.lock = threading.Lock()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.memory = (0, 0)
+        self.snapshot = None
+
+    def thread_profile(self, frame, event, arg):
+        """
+        新线程的首个 profile 事件中为其启用独立的 cProfile, cProfile 只统计启用它的线程
+        """
+        profile = cProfile.Profile()
+        sys.setprofile(None)
+
+        try:
+            profile.enable()
+        except ValueError:
+            # 已有其他分析工具启用, 该线程不单独统计
+            return
+
+        with self.lock:
+            self.profiles.append(profile)
+
+    def run(self, func: Callable[[], Any]) -> Any:
+        """
+        分析运行 func
+
+        :param func: 被分析的函数
+        :return: func 的返回值
+        """
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        tracemalloc.start(10)
+
+        if PER_THREAD_PROFILES:
+            threading.setprofile(self.thread_profile)
+        wall, cpu = time.perf_counter(), time.process_time()
+        profile.enable()
+
+        try:
+            return func()
+        finally:
+            profile.disable()
+
+            if PER_THREAD_PROFILES:
+                threading.setprofile(None)
+            self.wall = time.perf_counter() - wall
+            self.cpu = time.process_time() - cpu
+            self.memory = tracemalloc.get_traced_memory()
+            self.snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ])
+            tracemalloc.stop()
+            self.tracker.restore()
+
+    def stats(self) -> pstats.Stats:
+        """
+        合并所有线程的分析结果
+
+        :return: pstats.Stats
+        """
+        stats = None
+
+        for profile in self.profiles:
+            try:
+                stats = pstats.Stats(profile) if stats is None else stats.add(profile)
+            except TypeError:
+                # 线程中未产生任何调用记录
+                continue
+
+        return stats
+
+    def categories(self, stats: pstats.Stats) -> dict[str, float]:
+        """
+        按类别汇总函数自身耗时
+
+        :param stats: 分析结果
+        :return: 类别到耗时的映射, 单位秒
+        """
+        totals = {name: 0.0 for name, _ in CATEGORIES}
+        totals['其他'] = 0.0
+
+        for (file, line, name), (_, _, tottime, _, _) in stats.stats.items():
+            for category, match in CATEGORIES:
+                if match(file, name):
+                    totals[category] += tottime
+                    break
+            else:
+                totals['其他'] += tottime
+
+        return totals
+
+    def report(self, imports: str) -> str:
+        """
+        生成文本报告
+
+        :param imports: 启动导入耗时报告
+        :return: 报告
+        """
+        stats = self.stats()
+        out = io.StringIO()
+        w = lambda line='': out.write(line + '\n')  # noqa: E731
+
+        w(f'总耗时: {self.wall:.3f}s, 进程 CPU 时间: {self.cpu:.3f}s')
+        w(f'内存: 结束时 {self.memory[0] / 1024 / 1024:.2f} MiB, 峰值 {self.memory[1] / 1024 / 1024:.2f} MiB')
+        w()
+        w('== 关键函数 (耗时为各次调用之和, CPU 为所在线程时间, 内存为调用前后变化, 并发时包含其他线程的分配) ==')
+        w(f'{"函数":<24}{"调用":>8}{"耗时(s)":>12}{"CPU(s)":>12}{"内存(KiB)":>12}')
+
+        for label, item in self.tracker.stats.items():
+            w(
+                f'{label:<24}{item["calls"]:>8}{item["wall"]:>12.3f}{item["cpu"]:>12.3f}'
+                f'{item["memory"] / 1024:>12.1f}'
+            )
+
+        w()
+        w('== 按类别汇总的函数自身耗时 (所有线程之和, 可能大于总耗时) ==')
+
+        for category, seconds in self.categories(stats).items():
+            w(f'{category:<12}{seconds:>10.3f}s')
+
+        w()
+        w('== 启动导入耗时 (python -X importtime -c "import app") ==')
+        w(imports)
+
+        for title, key in [('累计耗时', 'cumulative'), ('自身耗时', 'tottime')]:
+            w()
+            w(f'== 按{title}排序的前 {self.top} 个函数 ==')
+            stats.stream = out
+            stats.sort_stats(key).print_stats(self.top)
+
+        w(f'== 内存分配最多的前 {self.top} 个位置 (运行结束时仍未释放) ==')
+
+        for stat in self.snapshot.statistics('lineno')[:self.top]:
+            w(str(stat))
+
+        return out.getvalue()
+
+    def dump(self, path: str) -> NoReturn:
+        """
+        保存合并后的分析结果, 可使用 pstats / snakeviz 等工具查看
+
+        :param path: 文件路径
+        :return:
+        """
+        self.stats().dump_stats(path)
+
+
+def import_times(module: str = 'app', top: int = 20) -> str:
+    """
+    在子进程中统计导入模块的耗时
+
+    :param module: 模块名
+    :param top: 列出的条目数
+    :return: 报告, 包含总耗时及累计耗时最多的模块
+    """
+    try:
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, timeout=60,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        return f'统计导入耗时失败: {e}'
+
+    rows = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+        except ValueError:
+            continue
+
+    if result.returncode:
+        return f'统计导入耗时失败: {result.stderr.strip().splitlines()[-1:]}'
+
+    total = next((row[0] for row in rows if row[2].strip() == module), 0)
+    lines = [f'导入 {module} 共 {total / 1000:.1f}ms, 累计耗时最多的模块:']
+    lines += [
+        f'{cumulative / 1000:>10.1f}ms {self_us / 1000:>10.1f}ms  {name}'
+        for cumulative, self_us, name in sorted(rows, reverse=True)[:top]
+    ]
+    return '\n'.join(lines)
@@ -0,0 +1,109 @@
+"""
+    @Description: 推送渠道注册表, 仅在渠道被配置时导入对应模块
+"""
+
+from importlib import import_module
+from types import ModuleType
+from typing import Any, NoReturn, Optional
+import logging
+import threading
+
+# 内置推送渠道, 渠道名到模块路径的映射
+BUILTIN_PUSHERS = {
+    'dingtalk': 'modules.dingtalk',
+    'serverchan': 'modules.serverchan',
+    'pushdeer': 'modules.pushdeer',
+    'telegram': 'modules.telegram',
+    'pushplus': 'modules.pushplus',
+    'smtp': 'modules.smtp',
+}
+
+# 第三方推送渠道的 entry point 分组, 加载对象需提供与内置模块相同签名的 push 函数
+ENTRY_POINT_GROUP = 'aliyun_auto_signin.pushers'
+
+_registry: dict[str, str | ModuleType | Any] = dict(BUILTIN_PUSHERS)
+_loaded: dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def register(name: str, target: str | ModuleType | Any) -> NoReturn:
+    """
+    注册推送渠道
+
+    :param name: 渠道名, 不区分大小写
+    :param target: 模块路径, 或提供 push 函数的模块 / 对象
+    :return:
+    """
+    with _lock:
+        name = name.lower().strip()
+        _registry[name] = target
+        _loaded.pop(name, None)
+
+
+def _find_entry_point(name: str) -> Optional[Any]:
+    """
+    在已安装的包中查找第三方推送渠道
+
+    :param name: 渠道名
+    :return: entry point, 未找到返回 None
+    """
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name.lower() == name:
+            return entry_point
+
+    return None
+
+
+def get(name: str) -> Optional[Any]:
+    """
+    获取推送渠道, 首次获取时导入
+
+    :param name: 渠道名, 不区分大小写
+    :return: 提供 push 函数的模块或对象, 渠道不存在或导入失败返回 None
+    """
+    name = name.lower().strip()
+
+    with _lock:
+        if name in _loaded:
+            return _loaded[name]
+
+        target = _registry.get(name)
+
+        try:
+            if target is None:
+                entry_point = _find_entry_point(name)
+
+                if entry_point is None:
+                    logging.error(f'未知的推送渠道: {name}')
+                    return None
+
+                target = entry_point.load()
+            elif isinstance(target, str):
+                target = import_module(target)
+        except Exception as e:
+            logging.error(f'加载推送渠道 {name} 失败, 错误信息: {e}')
+            return None
+
+        _loaded[name] = target
+        return target
+
+
+def close() -> NoReturn:
+    """
+    关闭已加载渠道持有的连接, 渠道提供 close 函数时调用
+
+    :return:
+    """
+    with _lock:
+        loaded = list(_loaded.items())
+
+    for name, pusher in loaded:
+        if not callable(getattr(pusher, 'close', None)):
+            continue
+
+        try:
+            pusher.close()
+        except Exception as e:
+            logging.warning(f'关闭推送渠道 {name} 失败, 错误信息: {e}')
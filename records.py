@@ -0,0 +1,154 @@
+"""
+    @Description: 签到结果记录, 只保存原始字段, 推送内容在使用时按渠道格式生成
+"""
+
+from html import escape
+from typing import Optional
+import json
+
+# 支持的推送内容格式
+FORMATS = ('text', 'html')
+
+# 获取 access token 时表示 refresh token 已失效的错误码, 重试无法恢复
+DEAD_TOKEN_CODES = ('RefreshTokenExpired', 'InvalidParameter.RefreshToken')
+
+
+class SignInResult:
+    """
+    单个账号的签到结果. 使用 __slots__ 减少大量账号时的内存占用, text / text_html 每次访问时生成
+    """
+
+    __slots__ = (
+        'success', 'user', 'refresh_token', 'count', 'reward',
+        'retryable', 'error_code', 'error_message', 'email', 'skipped',
+    )
+
+    def __init__(
+            self,
+            success: bool,
+            user: Optional[str],
+            refresh_token: str,
+            count: int = 0,
+            reward: Optional[str] = None,
+            retryable: bool = False,
+            error_code: Optional[str] = None,
+            error_message: Optional[str] = None,
+            email: Optional[str] = None,
+            skipped: bool = False,
+    ):
+        """
+        初始化
+
+        :param success: 是否签到成功
+        :param user: 用户名, 未获取到时为隐藏后的 refresh token
+        :param refresh_token: 轮换后的 refresh token
+        :param count: 本月累计签到天数
+        :param reward: 本次签到奖励
+        :param retryable: 是否为临时错误, 可重新排队签到
+        :param error_code: 错误码
+        :param error_message: 错误信息
+        :param email: 按账号推送的收件人
+        :param skipped: 是否因今日已签到而跳过
+        """
+        self.success = success
+        self.user = user
+        self.refresh_token = refresh_token
+        self.count = count
+        self.reward = reward
+        self.retryable = retryable
+        self.error_code = error_code
+        self.error_message = error_message
+        self.email = email
+        self.skipped = skipped
+
+    @classmethod
+    def from_error(cls, user: Optional[str], refresh_token: str, error: dict, retryable: bool = False) -> 'SignInResult':
+        """
+        由接口返回的错误创建失败结果, 只保留错误码及错误信息
+
+        :param user: 用户名
+        :param refresh_token: refresh token
+        :param error: 错误响应
+        :param retryable: 是否为临时错误
+        :return: 签到结果
+        """
+        return cls(
+            success=False,
+            user=user,
+            refresh_token=refresh_token,
+            retryable=retryable,
+            error_code=error.get('code'),
+            error_message=error.get('message') or json.dumps(error, ensure_ascii=False),
+        )
+
+    @property
+    def dead(self) -> bool:
+        """
+        refresh token 是否已失效
+        """
+        return not self.success and self.error_code in DEAD_TOKEN_CODES
+
+    @property
+    def error(self) -> Optional[dict]:
+        if self.error_code is None and self.error_message is None:
+            return None
+
+        return {'code': self.error_code, 'message': self.error_message}
+
+    def render(self, fmt: str = 'text') -> str:
+        """
+        生成推送内容
+
+        :param fmt: 格式, text 或 html
+        :return: 推送内容
+        """
+        user = self.user or ''
+        tag = f'<code>{escape(user)}</code>' if fmt == 'html' else f'[{user}]'
+
+        if self.skipped:
+            return f'{tag} 今日已签到, 本月累计签到 {self.count} 天.'
+
+        if self.success:
+            return f'{tag} 签到成功, 本月累计签到 {self.count} 天.\n本次签到{self.reward}'
+
+        error = f'{self.error_code}: {self.error_message}' if self.error_code else str(self.error_message)
+
+        if fmt == 'html':
+            return f'{tag} 签到失败\n<code>{escape(error)}</code>'
+
+        return f'{tag} 签到失败\n{error}'
+
+    @property
+    def text(self) -> str:
+        return self.render('text')
+
+    @property
+    def text_html(self) -> str:
+        return self.render('html')
+
+    def to_dict(self) -> dict:
+        """
+        导出原始字段, 用于持久化
+
+        :return: 非空字段的字典
+        """
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if getattr(self, name) not in (None, False)
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'SignInResult':
+        """
+        由 to_dict 导出的字典创建, 忽略未知字段
+
+        :param data: 字典
+        :return: 签到结果
+        """
+        return cls(**{
+            'success': False,
+            'user': None,
+            'refresh_token': '',
+            **{k: v for k, v in data.items() if k in cls.__slots__},
+        })
@@ -0,0 +1,400 @@
+"""
+    @Description: 请求调度, 按 host 限速, 熔断及临时错误重试
+"""
+
+from collections import deque
+from typing import NoReturn, Optional
+from urllib.parse import urlsplit
+import logging
+import random
+import threading
+import time
+
+
+class TransientError(Exception):
+    """
+    临时错误, 如网络异常, 限流, 服务端错误等, 重试后可能成功
+    """
+    pass
+
+
+class TokenBucket:
+    """
+    令牌桶限速
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        初始化
+
+        :param rate: 每秒补充的令牌数
+        :param burst: 桶容量, 即允许的突发请求数
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        获取一个令牌, 令牌不足时阻塞等待
+
+        :return: 等待时间, 单位秒
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 先预留令牌再等待, 并发请求按到达顺序排队
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+
+class RateLimiter:
+    """
+    按 host 限速, 未配置的 host 不限速
+    """
+
+    def __init__(self, rates: dict[str, float], burst: int = 1):
+        """
+        初始化
+
+        :param rates: host 到每秒请求数的映射, 小于等于 0 表示不限速
+        :param burst: 每个 host 允许的突发请求数
+        """
+        self.buckets = {
+            host: TokenBucket(rate, burst)
+            for host, rate in rates.items()
+            if rate > 0
+        }
+
+    def acquire(self, url: str) -> float:
+        """
+        请求前获取对应 host 的令牌
+
+        :param url: 请求地址
+        :return: 等待时间, 单位秒
+        """
+        bucket = self.buckets.get(urlsplit(url).hostname)
+        return bucket.acquire() if bucket else 0
+
+
+class RetryPolicy:
+    """
+    带随机抖动的指数退避重试策略
+    """
+
+    def __init__(self, retries: int = 3, base: float = 1, cap: float = 30):
+        """
+        初始化
+
+        :param retries: 最大重试次数, 不含首次请求
+        :param base: 首次重试的退避时间, 单位秒
+        :param cap: 单次退避时间上限, 单位秒
+        """
+        self.retries = max(retries, 0)
+        self.base = base
+        self.cap = cap
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        计算第 attempt 次重试前的等待时间, 采用 full jitter, 避免大量请求同时重试
+
+        :param attempt: 重试次数, 从 1 开始
+        :param retry_after: 服务端返回的 Retry-After, 单位秒
+        :return: 等待时间, 单位秒
+        """
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+        return max(delay, min(retry_after or 0, self.cap))
+
+    def sleep(self, attempt: int, retry_after: Optional[float] = None) -> NoReturn:
+        time.sleep(self.backoff(attempt, retry_after))
+
+
+class CircuitOpenError(TransientError):
+    """
+    熔断器打开, 请求未发出. 属于临时错误, 账号在本轮结束后重新排队
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    熔断器. 最近 window 次请求的错误率达到 error_rate 时打开, 此后的请求直接失败;
+    cooldown 秒后进入半开状态, 放行 probes 个探测请求, 其余请求等待探测结果, 探测成功则关闭, 失败则重新打开
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+            self,
+            name: str,
+            error_rate: float = 0.5,
+            window: int = 20,
+            min_requests: int = 5,
+            cooldown: float = 10,
+            probes: int = 1,
+    ):
+        """
+        初始化
+
+        :param name: 名称, 用于日志
+        :param error_rate: 打开熔断器的错误率, 0 ~ 1
+        :param window: 统计错误率的请求数
+        :param min_requests: 统计错误率所需的最少请求数
+        :param cooldown: 打开后到进入半开状态的时间, 单位秒
+        :param probes: 半开状态下同时放行的探测请求数
+        """
+        self.name = name
+        self.error_rate = error_rate
+        self.window = deque(maxlen=max(window, 1))
+        self.min_requests = max(min(min_requests, self.window.maxlen), 1)
+        self.cooldown = cooldown
+        self.probes = max(probes, 1)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = 0
+        self.rejected = 0
+        self.condition = threading.Condition()
+
+    def allow(self) -> bool:
+        """
+        请求前检查是否放行. 半开状态下非探测请求阻塞等待探测结果
+
+        :return: 放行返回 True, 熔断器打开时返回 False
+        """
+        with self.condition:
+            while True:
+                if self.state == self.CLOSED:
+                    return True
+
+                if self.state == self.OPEN:
+                    if time.monotonic() - self.opened_at < self.cooldown:
+                        self.rejected += 1
+                        return False
+
+                    self.state = self.HALF_OPEN
+                    self.probing = 0
+                    logging.info(f'{self.name} 熔断器半开, 发送探测请求.')
+
+                if self.probing < self.probes:
+                    self.probing += 1
+                    return True
+
+                # 探测请求异常退出时不会记录结果, 等待超时后重新检查
+                if not self.condition.wait(self.cooldown or None):
+                    self.probing = 0
+
+    def record(self, success: bool) -> NoReturn:
+        """
+        记录请求结果
+
+        :param success: 请求是否成功, 仅网络异常, 限流及服务端错误计为失败
+        :return:
+        """
+        with self.condition:
+            if self.state == self.HALF_OPEN:
+                if success:
+                    self.state = self.CLOSED
+                    self.window.clear()
+                    logging.info(f'{self.name} 探测请求成功, 熔断器关闭.')
+                else:
+                    self.open('探测请求失败')
+
+                self.condition.notify_all()
+                return
+
+            if self.state == self.OPEN:
+                return
+
+            self.window.append(success)
+            failures = self.window.count(False)
+
+            if len(self.window) >= self.min_requests and failures / len(self.window) >= self.error_rate:
+                self.open(f'最近 {len(self.window)} 次请求失败 {failures} 次')
+
+    def open(self, reason: str) -> NoReturn:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.window.clear()
+        logging.warning(f'{self.name} {reason}, 熔断器打开, {self.cooldown:g} 秒内的请求将直接失败.')
+
+    def remaining(self) -> float:
+        """
+        距离进入半开状态的剩余时间
+
+        :return: 剩余时间, 单位秒, 未打开时为 0
+        """
+        with self.condition:
+            if self.state != self.OPEN:
+                return 0
+
+            return max(self.cooldown - (time.monotonic() - self.opened_at), 0)
+
+
+class CircuitBreakers:
+    """
+    按 host 熔断, 未配置的 host 不熔断
+    """
+
+    def __init__(self, hosts: list[str], **kwargs):
+        """
+        初始化
+
+        :param hosts: 需要熔断的 host 列表
+        :param kwargs: 传递给 CircuitBreaker 的参数
+        """
+        self.breakers = {host: CircuitBreaker(host, **kwargs) for host in hosts}
+
+    def get(self, url: str) -> Optional[CircuitBreaker]:
+        """
+        获取请求地址对应的熔断器
+
+        :param url: 请求地址
+        :return: 熔断器, 未配置时返回 None
+        """
+        return self.breakers.get(urlsplit(url).hostname)
+
+    def wait(self) -> float:
+        """
+        等待所有打开的熔断器进入半开状态, 用于重新排队前, 避免重新签到的账号再次直接失败
+
+        :return: 等待时间, 单位秒
+        """
+        delay = max([breaker.remaining() for breaker in self.breakers.values()] + [0])
+
+        if delay:
+            logging.info(f'等待熔断器恢复, {delay:.1f} 秒后重新签到.')
+            time.sleep(delay)
+
+        return delay
+
+    def rejected(self) -> int:
+        return sum(breaker.rejected for breaker in self.breakers.values())
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发限制. 请求成功且延迟正常时增加: 首次减小前每个请求上限加 1 (慢启动),
+    此后每完成约 limit 个请求上限加 1; 被限流, 超时或延迟超过基线的 latency_factor 倍时乘性减小.
+    基线按 host 分别统计, 延迟还需比基线高出 min_latency_delta 才视为拥塞, 避免毫秒级的抖动或较慢的接口被误判.
+    同一时刻发出的请求只减小一次, 避免一批并发请求同时被限流时上限骤降
+    """
+
+    def __init__(
+            self,
+            initial: int,
+            max_limit: int,
+            min_limit: int = 1,
+            decrease: float = 0.5,
+            latency_factor: float = 2,
+            min_latency_delta: float = 0.05,
+    ):
+        """
+        初始化
+
+        :param initial: 初始并发上限
+        :param max_limit: 并发上限的最大值
+        :param min_limit: 并发上限的最小值
+        :param decrease: 减小时的乘数, 0 ~ 1
+        :param latency_factor: 延迟超过基线的倍数时视为拥塞
+        :param min_latency_delta: 延迟至少比基线高出多少秒才视为拥塞
+        """
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = min(max(min_limit, 1), self.max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.min_latency_delta = max(min_latency_delta, 0)
+        self.baselines: dict[str, float] = {}
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.peak = self.limit
+        self.low = self.limit
+        self.increases = 0
+        self.decreases = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        请求前获取并发名额, 已达上限时阻塞等待
+
+        :return: 请求开始时间, 传给 release
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+
+            self.in_flight += 1
+
+        return time.monotonic()
+
+    def release(self, started: float, success: bool, throttled: bool = False, url: Optional[str] = None) -> NoReturn:
+        """
+        请求完成后归还名额, 并按结果调整并发上限
+
+        :param started: acquire 返回的请求开始时间
+        :param success: 请求是否成功, 临时错误为 False
+        :param throttled: 是否被限流或超时
+        :param url: 请求地址, 按 host 分别统计基线延迟
+        :return:
+        """
+        latency = time.monotonic() - started
+        host = urlsplit(url).netloc if url else ''
+
+        with self.condition:
+            self.in_flight -= 1
+            baseline = self.baselines.get(host)
+            congested = throttled or (
+                    success
+                    and baseline is not None
+                    and latency > baseline * self.latency_factor
+                    and latency - baseline > self.min_latency_delta
+            )
+
+            if congested:
+                # 上次减小后发出的请求才反映减小后的负载
+                if started >= self.last_decrease:
+                    self.limit = max(self.limit * self.decrease, self.min_limit)
+                    self.last_decrease = time.monotonic()
+                    self.decreases += 1
+                    self.low = min(self.low, self.limit)
+                    logging.info(
+                        f'{"请求被限流" if throttled else f"延迟 {latency * 1000:.0f}ms 超出基线"}, '
+                        f'并发上限减小为 {int(self.limit)}.'
+                    )
+            elif success:
+                # 基线取该 host 正常请求延迟的滑动平均
+                self.baselines[host] = latency if baseline is None else baseline * 0.9 + latency * 0.1
+
+                if self.limit < self.max_limit:
+                    previous = int(self.limit)
+                    self.limit = min(self.limit + (1 / self.limit if self.decreases else 1), self.max_limit)
+                    self.peak = max(self.peak, self.limit)
+                    self.increases += int(int(self.limit) > previous)
+
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        并发上限统计
+
+        :return: 当前, 最大及最小并发上限, 增加及减小次数, 各 host 的基线延迟
+        """
+        with self.condition:
+            return {
+                'limit': int(self.limit),
+                'peak': int(self.peak),
+                'low': int(self.low),
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'baselines': dict(self.baselines),
+            }
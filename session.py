@@ -0,0 +1,94 @@
+"""
+    @Description: 共享 HTTP 会话, 复用 keep-alive 连接
+"""
+
+from typing import Callable, NoReturn, Optional
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_CONNECTIONS = 10
+
+_session: Optional[requests.Session] = None
+_lock = threading.Lock()
+_transport: Callable[..., HTTPAdapter] = HTTPAdapter
+
+
+def set_transport(transport: Optional[Callable[..., HTTPAdapter]] = None) -> NoReturn:
+    """
+    替换新建会话使用的传输适配器, 用于基准测试等场景将请求转发到本地服务
+
+    :param transport: 接受 pool_connections, pool_maxsize 参数并返回 HTTPAdapter 的可调用对象,
+        为 None 时恢复默认
+    :return:
+    """
+    global _transport
+    _transport = transport or HTTPAdapter
+
+
+def create_session(
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+) -> requests.Session:
+    """
+    创建带连接池的会话
+
+    :param pool_size: 每个 host 连接池的最大连接数
+    :param pool_connections: 缓存的 host 连接池数量
+    :return: requests.Session 对象
+    """
+    session = requests.Session()
+    adapter = _transport(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_size,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def init_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    按配置重新初始化共享会话, 旧会话会被关闭
+
+    :param pool_size: 每个 host 连接池的最大连接数
+    :return: 新的共享会话
+    """
+    global _session
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = create_session(pool_size=pool_size)
+        return _session
+
+
+def get_session() -> requests.Session:
+    """
+    获取共享会话, 未初始化时使用默认连接池大小创建
+
+    :return: 共享会话
+    """
+    global _session
+
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def close_session() -> NoReturn:
+    """
+    关闭共享会话, 释放连接
+
+    :return:
+    """
+    global _session
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,123 @@
+"""
+    @Description: 账号分片, 多个运行实例各自处理一部分账号
+"""
+
+from hashlib import sha256
+from typing import Callable, Iterable, Iterator, NamedTuple, NoReturn, Optional, TypeVar
+import os
+
+from utils import atomic_write
+
+T = TypeVar('T')
+
+
+class Shard(NamedTuple):
+    """
+    分片, index 从 0 开始
+    """
+    index: int
+    total: int
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.total}'
+
+
+def parse_shard(value: str) -> Shard:
+    """
+    解析 i/n 格式的分片参数
+
+    :param value: 分片参数, 如 0/3
+    :return: 分片
+    :raises ValueError: 格式错误或超出范围
+    """
+    try:
+        index, total = (int(i) for i in value.split('/', 1))
+    except ValueError:
+        raise ValueError(f'分片格式错误: {value}, 应为 i/n, 如 0/3')
+
+    if total < 1 or not 0 <= index < total:
+        raise ValueError(f'分片超出范围: {value}, 应满足 0 <= i < n')
+
+    return Shard(index, total)
+
+
+def shard_of(key: str, total: int) -> int:
+    """
+    计算账号所属分片, 结果只与 key 有关, 不同实例及多次运行间一致
+
+    :param key: 账号标识
+    :param total: 分片总数
+    :return: 分片下标
+    """
+    return int(digest(key), 16) % total
+
+
+def digest(key: str) -> str:
+    """
+    计算账号标识的摘要, 用于分片及记录已分配的账号, 不保存原始 refresh token
+
+    :param key: 账号标识
+    :return: 16 位十六进制摘要
+    """
+    return sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def select(items: Iterable[T], shard: Shard, key: Callable[[T], str]) -> Iterator[T]:
+    """
+    筛选属于指定分片的账号
+
+    :param items: 账号迭代器
+    :param shard: 分片
+    :param key: 获取账号标识的函数
+    :return: 属于该分片的账号迭代器
+    """
+    return (item for item in items if shard_of(key(item), shard.total) == shard.index)
+
+
+def unseen(items: Iterable[T], shard: Shard, key: Callable[[T], str], seen: set[str]) -> Iterator[T]:
+    """
+    筛选属于指定分片且未分配过的账号, 即分片建立后新增到全部账号中的账号
+
+    :param items: 全部账号迭代器
+    :param shard: 分片
+    :param key: 获取账号标识的函数
+    :param seen: 已分配账号标识的摘要
+    :return: 新增账号迭代器
+    """
+    return (item for item in select(items, shard, key) if digest(key(item)) not in seen)
+
+
+def read_digests(path: str) -> Optional[set[str]]:
+    """
+    读取已分配账号的摘要文件
+
+    :param path: 文件路径
+    :return: 摘要集合, 文件不存在时返回 None
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def write_digests(path: str, digests: Iterable[str]) -> NoReturn:
+    """
+    写入已分配账号的摘要文件, 每行一个
+
+    :param path: 文件路径
+    :param digests: 摘要
+    :return:
+    """
+    with atomic_write(path) as f:
+        f.writelines(f'{i}\n' for i in digests)
+
+
+def account_key(account: dict) -> str:
+    """
+    获取账号文件中账号的分片标识, 优先使用不随 refresh token 轮换变化的字段
+
+    :param account: 账号信息
+    :return: 账号标识
+    """
+    return str(account.get('user') or account.get('name') or account['refresh_token'])
@@ -0,0 +1,430 @@
+"""
+    @Description: 基于 SQLite 的本地状态存储, 每个账号签到完成后即记录轮换后的 refresh token
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import NoReturn, Optional
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from records import SignInResult
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    source_token TEXT PRIMARY KEY,
+    refresh_token TEXT NOT NULL,
+    user TEXT,
+    success INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    reward TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ledger (
+    user TEXT NOT NULL,
+    date TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user, date)
+);
+
+CREATE TABLE IF NOT EXISTS quarantine (
+    source_token TEXT PRIMARY KEY,
+    user TEXT,
+    failures INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    quarantined_at REAL,
+    reported INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    title TEXT,
+    content TEXT NOT NULL,
+    content_html TEXT NOT NULL,
+    results TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    next_at REAL NOT NULL
+);
+"""
+
+# 签到按北京时间零点重置
+SIGNIN_TIMEZONE = timezone(timedelta(hours=8))
+
+
+def today() -> str:
+    """
+    获取签到日期
+
+    :return: 北京时间当天日期, 如 2023-03-10
+    """
+    return datetime.now(SIGNIN_TIMEZONE).date().isoformat()
+
+
+class StateStore:
+    """
+    账号状态存储. 以配置中的 refresh token (source_token) 为键, 记录最新的 refresh token 及签到结果.
+    进程中途退出时, 已轮换的 refresh token 在下次运行时通过 resolve 找回
+    """
+
+    def __init__(self, path: str, batch_size: int = 50, interval: float = 1, quarantine_after: int = 3):
+        """
+        初始化
+
+        :param path: 数据库文件路径, 为 :memory: 时仅在内存中保存
+        :param batch_size: 累计多少条写入后提交一次事务
+        :param interval: 距上次提交超过多少秒后提交事务, 单位秒
+        :param quarantine_after: refresh token 连续失效多少次后隔离, 0 表示不隔离
+        """
+        self.path = path
+        self.batch_size = max(batch_size, 1)
+        self.interval = interval
+        self.quarantine_after = max(quarantine_after, 0)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.pending = 0
+        self.committed_at = time.monotonic()
+
+    def resolve(self, source_token: str) -> str:
+        """
+        获取配置中的 refresh token 对应的最新 refresh token
+
+        :param source_token: 配置中的 refresh token
+        :return: 最新的 refresh token, 无记录时原样返回
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT refresh_token FROM accounts WHERE source_token = ?',
+                (source_token,),
+            ).fetchone()
+
+        return row[0] if row else source_token
+
+    def get(self, source_token: str) -> Optional[dict]:
+        """
+        获取账号的最近一次签到记录
+
+        :param source_token: 配置中的 refresh token
+        :return: 记录字典, 无记录时返回 None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT refresh_token, user, success, count, reward FROM accounts WHERE source_token = ?',
+                (source_token,),
+            ).fetchone()
+
+        if not row:
+            return None
+
+        return dict(zip(['refresh_token', 'user', 'success', 'count', 'reward'], row))
+
+    def signed_today(self, user: Optional[str]) -> bool:
+        """
+        账号今日是否已签到成功
+
+        :param user: 账号, 即 user_name
+        :return: 已签到返回 True
+        """
+        if not user:
+            return False
+
+        with self.lock:
+            return self.conn.execute(
+                'SELECT 1 FROM ledger WHERE user = ? AND date = ?',
+                (user, today()),
+            ).fetchone() is not None
+
+    def record(self, source_token: str, result: SignInResult) -> NoReturn:
+        """
+        记录账号签到结果, 按批次提交事务
+
+        :param source_token: 配置中的 refresh token
+        :param result: 签到结果
+        :return:
+        """
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO accounts '
+                '(source_token, refresh_token, user, success, count, reward, error, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    source_token,
+                    result.refresh_token,
+                    result.user,
+                    int(result.success),
+                    result.count,
+                    result.reward,
+                    json.dumps(result.error, ensure_ascii=False) if result.error else None,
+                    time.time(),
+                ),
+            )
+            self.pending += 1
+
+            if result.success and result.user:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO ledger (user, date, updated_at) VALUES (?, ?, ?)',
+                    (result.user, today(), time.time()),
+                )
+
+            if result.dead:
+                self.__count_failure(source_token, result)
+            elif not result.retryable:
+                # 获取 access token 成功即说明 refresh token 有效, 临时错误不影响连续失效次数
+                self.conn.execute(
+                    'DELETE FROM quarantine WHERE source_token = ? AND quarantined_at IS NULL',
+                    (source_token,),
+                )
+
+            if self.pending >= self.batch_size or time.monotonic() - self.committed_at >= self.interval:
+                self.commit()
+
+    def __count_failure(self, source_token: str, result: SignInResult) -> NoReturn:
+        """
+        记录一次 refresh token 失效, 连续失效次数达到 quarantine_after 时隔离
+
+        :param source_token: 配置中的 refresh token
+        :param result: 签到结果
+        :return:
+        """
+        now = time.time()
+        self.conn.execute(
+            'INSERT INTO quarantine (source_token, user, failures, error, updated_at) VALUES (?, ?, 1, ?, ?) '
+            'ON CONFLICT (source_token) DO UPDATE SET '
+            'user = excluded.user, failures = failures + 1, error = excluded.error, updated_at = excluded.updated_at',
+            (source_token, result.user, result.error_code, now),
+        )
+
+        if not self.quarantine_after:
+            return
+
+        quarantined = self.conn.execute(
+            'UPDATE quarantine SET quarantined_at = ? '
+            'WHERE source_token = ? AND quarantined_at IS NULL AND failures >= ?',
+            (now, source_token, self.quarantine_after),
+        ).rowcount
+
+        if quarantined:
+            logging.warning(
+                f'[{result.user}] refresh token 连续 {self.quarantine_after} 次失效, 已隔离, 此后不再签到.'
+            )
+
+    def quarantined(self) -> set[str]:
+        """
+        获取已隔离的账号
+
+        :return: 配置中的 refresh token 集合
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT source_token FROM quarantine WHERE quarantined_at IS NOT NULL').fetchall()
+
+        return {row[0] for row in rows}
+
+    def list_quarantined(self) -> list[dict]:
+        """
+        获取已隔离账号的详情, 按隔离时间排列
+
+        :return: 记录列表, 包含 source_token, user, failures, error, quarantined_at
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT source_token, user, failures, error, quarantined_at FROM quarantine '
+                'WHERE quarantined_at IS NOT NULL ORDER BY quarantined_at'
+            ).fetchall()
+
+        return [dict(zip(['source_token', 'user', 'failures', 'error', 'quarantined_at'], row)) for row in rows]
+
+    def report_quarantined(self) -> list[str]:
+        """
+        获取尚未推送过的新隔离账号, 并标记为已推送, 每个账号只推送一次
+
+        :return: 账号列表
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT source_token, user FROM quarantine WHERE quarantined_at IS NOT NULL AND reported = 0 '
+                'ORDER BY quarantined_at'
+            ).fetchall()
+            self.conn.executemany(
+                'UPDATE quarantine SET reported = 1 WHERE source_token = ?',
+                [(row[0],) for row in rows],
+            )
+            self.commit()
+
+        return [row[1] or row[0] for row in rows]
+
+    def reactivate(self, accounts: Optional[list[str]] = None) -> int:
+        """
+        解除隔离, 连续失效次数清零
+
+        :param accounts: 配置中的 refresh token 或账号 (user_name 及隐藏后的 refresh token) 列表, 为 None 时解除所有
+        :return: 解除隔离的账号数
+        """
+        with self.lock:
+            if accounts is None:
+                count = self.conn.execute('DELETE FROM quarantine WHERE quarantined_at IS NOT NULL').rowcount
+            else:
+                count = sum(
+                    self.conn.execute(
+                        'DELETE FROM quarantine WHERE source_token = ? OR user = ?',
+                        (account, account),
+                    ).rowcount
+                    for account in accounts
+                )
+
+            self.commit()
+            return count
+
+    def commit(self) -> NoReturn:
+        """
+        提交未提交的写入
+
+        :return:
+        """
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+            self.committed_at = time.monotonic()
+
+    def export(self, source_tokens: list[str]) -> list[str]:
+        """
+        导出最新的 refresh token, 用于回写配置或 GitHub Secret
+
+        :param source_tokens: 配置中的 refresh token 列表
+        :return: 最新的 refresh token 列表, 顺序与 source_tokens 一致
+        """
+        return [self.resolve(token) for token in source_tokens]
+
+    def rebase(self, source_tokens: list[str]) -> NoReturn:
+        """
+        配置回写成功后, 以最新的 refresh token 作为新的键, 并清理旧记录
+
+        :param source_tokens: 本次运行使用的配置中的 refresh token 列表
+        :return:
+        """
+        with self.lock:
+            for token in source_tokens:
+                self.conn.execute(
+                    'UPDATE OR REPLACE accounts SET source_token = refresh_token WHERE source_token = ?',
+                    (token,),
+                )
+            self.commit()
+
+    def enqueue_push(
+            self,
+            channels: list[str],
+            title: Optional[str],
+            content: str,
+            content_html: str,
+            results: Optional[list[dict]] = None,
+    ) -> float:
+        """
+        为每个渠道写入一条待推送消息, 立即提交
+
+        :param channels: 推送渠道列表
+        :param title: 标题
+        :param content: 推送内容
+        :param content_html: 推送内容, HTML 格式
+        :param results: 签到结果, 用于按账号推送
+        :return: 写入时间戳, 同一次写入的各渠道消息相同
+        """
+        with self.lock:
+            now = time.time()
+            results = json.dumps(results, ensure_ascii=False) if results else None
+            self.conn.executemany(
+                'INSERT INTO outbox (channel, title, content, content_html, results, created_at, next_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(channel, title, content, content_html, results, now, now) for channel in channels],
+            )
+            self.commit()
+            return now
+
+    def pending_pushes(self, due: Optional[float] = None) -> list[dict]:
+        """
+        获取待推送消息, 按写入顺序排列
+
+        :param due: 仅返回下次推送时间不晚于该时间戳的渠道的消息, 为 None 时返回全部
+        :return: 消息列表
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, channel, title, content, content_html, results, attempts, created_at, next_at '
+                'FROM outbox ORDER BY id'
+            ).fetchall()
+
+        pushes = [
+            dict(zip(
+                ['id', 'channel', 'title', 'content', 'content_html', 'results', 'attempts', 'created_at', 'next_at'],
+                row,
+            ))
+            for row in rows
+        ]
+
+        for item in pushes:
+            item['results'] = json.loads(item['results']) if item['results'] else []
+
+        if due is None:
+            return pushes
+
+        # 同一渠道的消息合并推送, 任一消息到期时整个渠道到期
+        channels = {item['channel'] for item in pushes if item['next_at'] <= due}
+        return [item for item in pushes if item['channel'] in channels]
+
+    def remove_pushes(self, ids: list[int]) -> NoReturn:
+        """
+        删除已送达的消息
+
+        :param ids: 消息 ID 列表
+        :return:
+        """
+        with self.lock:
+            self.conn.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
+            self.commit()
+
+    def defer_pushes(self, ids: list[int], error: str, next_at: float) -> NoReturn:
+        """
+        记录推送失败, 推迟到 next_at 后重试
+
+        :param ids: 消息 ID 列表
+        :param error: 错误信息
+        :param next_at: 下次推送时间戳
+        :return:
+        """
+        with self.lock:
+            self.conn.executemany(
+                'UPDATE outbox SET attempts = attempts + 1, error = ?, next_at = ? WHERE id = ?',
+                [(error, next_at, i) for i in ids],
+            )
+            self.commit()
+
+    def expire_pushes(self, before: float) -> int:
+        """
+        删除写入时间早于 before 的消息
+
+        :param before: 时间戳
+        :return: 删除的消息数
+        """
+        with self.lock:
+            count = self.conn.execute('DELETE FROM outbox WHERE created_at < ?', (before,)).rowcount
+            self.commit()
+            return count
+
+    def close(self) -> NoReturn:
+        """
+        提交并关闭数据库
+
+        :return:
+        """
+        with self.lock:
+            self.commit()
+            self.conn.close()
@@ -0,0 +1,110 @@
+"""
+    @Description: 通用工具, 原子写入文件及布尔配置解析
+"""
+
+from contextlib import contextmanager
+from typing import Iterator, NoReturn, Optional, TextIO
+import os
+import tempfile
+
+# 布尔配置项可接受的取值, 不区分大小写
+TRUE_VALUES = ('true', 'yes', 'on', '1')
+FALSE_VALUES = ('false', 'no', 'off', '0')
+
+
+def parse_bool(value: Optional[str | bool], default: bool = False) -> bool:
+    """
+    解析布尔配置项
+
+    :param value: 配置值
+    :param default: 为空或无法识别时的默认值
+    :return: 布尔值
+    """
+    if isinstance(value, bool):
+        return value
+
+    value = str(value or '').strip().lower()
+
+    if value in TRUE_VALUES:
+        return True
+
+    if value in FALSE_VALUES:
+        return False
+
+    return default
+
+
+class AtomicFile:
+    """
+    原子写入文件. 先写入同目录下的临时文件, commit 时刷盘后替换目标文件, 读取方不会读到不完整的内容,
+    写入中途退出时原文件保持不变
+    """
+
+    def __init__(self, path: str, mode: int = 0o600):
+        """
+        初始化
+
+        :param path: 目标文件路径
+        :param mode: 文件权限, 默认仅所有者可读写, 文件中可能包含 refresh token 等敏感信息
+        """
+        self.path = path
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, self.tmp = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+
+        try:
+            os.chmod(self.tmp, mode)
+        except OSError:
+            pass
+
+        self.file: TextIO = os.fdopen(fd, 'w', encoding='utf-8')
+
+    def write(self, content: str) -> NoReturn:
+        self.file.write(content)
+
+    def commit(self) -> NoReturn:
+        """
+        完成写入并替换目标文件
+
+        :return:
+        """
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self.tmp, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self) -> NoReturn:
+        """
+        放弃写入, 删除临时文件
+
+        :return:
+        """
+        self.file.close()
+
+        try:
+            os.remove(self.tmp)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def atomic_write(path: str, mode: int = 0o600) -> Iterator[TextIO]:
+    """
+    原子写入文件, 代码块正常结束时替换目标文件, 抛出异常时保留原文件
+
+    :param path: 目标文件路径
+    :param mode: 文件权限
+    :return: 临时文件对象
+    """
+    file = AtomicFile(path, mode)
+
+    try:
+        yield file.file
+    except BaseException:
+        file.abort()
+        raise
+
+    file.commit()